@@ -0,0 +1,47 @@
+"""
+Random rollouts/sec (the inner loop of engine.mctsv1.Engine._simulate) with
+each connect4 backend
+
+    python -m benchmarks.connect4_rollouts --min-time 2
+"""
+import argparse
+import random
+import time
+
+import connect4.bitboard
+import connect4.rules
+
+BACKENDS = {
+    "rules": connect4.rules,
+    "bitboard": connect4.bitboard,
+}
+
+
+def rollout(rules, rng: random.Random):
+    gamestate = rules.init_game()
+    while rules.is_over(gamestate) is None:
+        rules.take_action_mut(
+            gamestate, rng.choice(rules.get_all_actions(gamestate))
+        )
+
+
+def rollouts_per_sec(rules, min_time: float) -> float:
+    rng = random.Random(0)
+    n, start = 0, time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < min_time:
+        rollout(rules, rng)
+        n += 1
+    return n / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark connect4 rules")
+    parser.add_argument("--min-time", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f"{'backend':<10}{'rollouts/s':>12}{'speedup':>10}")
+    baseline = None
+    for name, rules in BACKENDS.items():
+        rate = rollouts_per_sec(rules, args.min_time)
+        baseline = baseline or rate
+        print(f"{name:<10}{rate:>12.0f}{rate / baseline:>9.1f}x")
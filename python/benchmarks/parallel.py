@@ -0,0 +1,79 @@
+"""
+Walks/sec of parallel ponder (MctsConfig.n_workers) as the number of worker
+processes grows. Walks/sec is measured around Engine.ponder after the worker
+pool has been started.
+
+    python -m benchmarks.parallel --workers 1 2 4 8 --walks 2000
+    python -m benchmarks.parallel --parallelism tree
+"""
+import argparse
+import copy
+import os
+import random
+import time
+
+from engine.mctsv1 import Engine
+import common.main as common
+import engine.typesv1 as types
+
+
+def make_config(
+    game_type: str, n_workers: int, parallelism: str
+) -> types.MctsConfig:
+    rules = common.load_rules(game_type)
+    return types.MctsConfig(
+        take_action_mut=rules.take_action_mut,
+        get_all_actions=rules.get_all_actions,
+        is_over=rules.is_over,
+        get_final_score=rules.get_final_score,
+        players=rules.get_players(),
+        encode_action=rules.encode_action,
+        decode_action=rules.decode_action,
+        action_to_int=rules.action_to_int,
+        int_to_action=rules.int_to_action,
+        clone_gamestate=rules.clone_gamestate,
+        n_workers=n_workers,
+        parallelism=parallelism,
+    )
+
+
+def walks_per_sec(
+    game_type: str, n_workers: int, parallelism: str, n_walks: int
+) -> float:
+    random.seed(0)
+    gamestate = common.load_rules(game_type).init_game()
+    config = make_config(game_type, n_workers, parallelism)
+    engine = Engine(config, copy.deepcopy(gamestate))
+    try:
+        engine.ponder(n_workers)  # start the pool
+        start = time.perf_counter()
+        engine.ponder(n_walks)
+        return n_walks / (time.perf_counter() - start)
+    finally:
+        engine.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark parallel ponder")
+    parser.add_argument(
+        "--game-type",
+        type=str,
+        default="connect4",
+        choices=["2048", "connect4"],
+    )
+    parser.add_argument(
+        "--parallelism", type=str, default="root", choices=["root", "tree"]
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--walks", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cpus")
+    print(f"{'workers':>8}{'walks/s':>12}{'scaling':>10}")
+    baseline = None
+    for n_workers in args.workers:
+        rate = walks_per_sec(
+            args.game_type, n_workers, args.parallelism, args.walks
+        )
+        baseline = baseline or rate
+        print(f"{n_workers:>8}{rate:>12.0f}{rate / baseline:>9.2f}x")
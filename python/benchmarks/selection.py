@@ -0,0 +1,95 @@
+"""
+Selections/sec of the scalar (per child) ucb path vs the vectorized (per node)
+ucb path used by engine.mctsv1.Engine._tree_policy.
+
+    python -m benchmarks.selection --branching 7 64 256 1024
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+import engine.typesv1 as types
+from engine.mctsv1 import UCB_FNS, UCB_VECTORIZED_FNS
+from engine.tree import ArrayTree
+
+C = types.MctsConfig.C
+
+
+def make_tree(branching: int, seed: int = 0) -> ArrayTree:
+    """
+    A root with <branching> children that have all been visited a few times,
+    i.e. the steady state of a node somewhere in the middle of a search
+    """
+    rng = random.Random(seed)
+    tree = ArrayTree(["player"])
+    tree.set_expanded(tree.root)
+    for i in range(branching):
+        child = tree.new_node(
+            i + 1,
+            tree.root,
+            i,
+            types.HeuristicVal(5 * rng.random(), 5),
+        )
+        visits = rng.randint(1, 50)
+        tree.visit_counts[child] = visits
+        tree.score_sums[child, 0] = visits * rng.random()
+    tree.visit_counts[tree.root] = tree.visit_counts[1:branching + 1].sum()
+    return tree
+
+
+def select_scalar(ucb_fn, tree: ArrayTree, node: int) -> int:
+    return max(
+        range(tree.num_children(node)),
+        key=lambda k: ucb_fn(C, tree, tree.child(node, k)[0], 0),
+    )
+
+
+def select_vectorized(ucb_fn, tree: ArrayTree, node: int) -> int:
+    return int(np.argmax(ucb_fn(C, tree, node, 0)))
+
+
+def selections_per_sec(select, ucb_fn, tree: ArrayTree, min_time: float):
+    n, start = 0, time.perf_counter()
+    while (elapsed := time.perf_counter() - start) < min_time:
+        for _ in range(10):
+            select(ucb_fn, tree, tree.root)
+        n += 10
+    return n / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ucb selection")
+    parser.add_argument(
+        "--branching", type=int, nargs="+", default=[7, 64, 256, 1024]
+    )
+    parser.add_argument("--min-time", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(
+        f"{'heuristic_type':<16}{'branching':>10}"
+        f"{'scalar/s':>14}{'vectorized/s':>14}{'speedup':>10}"
+    )
+    for heuristic_type in UCB_FNS:
+        for branching in args.branching:
+            tree = make_tree(branching)
+            assert select_scalar(
+                UCB_FNS[heuristic_type], tree, tree.root
+            ) == select_vectorized(
+                UCB_VECTORIZED_FNS[heuristic_type], tree, tree.root
+            )
+            scalar = selections_per_sec(
+                select_scalar, UCB_FNS[heuristic_type], tree, args.min_time
+            )
+            vectorized = selections_per_sec(
+                select_vectorized,
+                UCB_VECTORIZED_FNS[heuristic_type],
+                tree,
+                args.min_time,
+            )
+            print(
+                f"{str(heuristic_type):<16}{branching:>10}"
+                f"{scalar:>14.0f}{vectorized:>14.0f}"
+                f"{vectorized / scalar:>9.1f}x"
+            )
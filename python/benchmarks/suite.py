@@ -0,0 +1,368 @@
+"""
+Throughput of Engine.ponder on fixed, seeded positions of every game in every
+heuristic_type, saved as a JSON baseline that later runs can be compared
+against.
+
+    python -m benchmarks.suite run --out baseline.json
+    python -m benchmarks.suite run --games connect4 --out after.json
+    python -m benchmarks.suite compare baseline.json after.json --threshold 0.1
+
+For every case run reports walks/sec, nodes/sec (tree nodes created per
+second of ponder), the peak RSS of the process that ran it and the time per
+walk spent in each phase (MctsConfig.profile). Every repeat runs in a fresh
+process so peak RSS isn't inherited from earlier cases. The best repeat is
+kept.
+
+compare flags a case whose walks/sec or nodes/sec dropped, or whose peak RSS
+or time per walk in some phase grew, by more than --threshold (a fraction),
+and exits with 1 if anything was flagged.
+
+reef has no MCTS wiring (no final score, is_over only says whether the game is
+over and full random games take too long to roll out), so its cases stand in
+a score based rollout_policy and a matching heuristic.
+"""
+import argparse
+import concurrent.futures
+import copy
+import dataclasses
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+import typing as t
+
+from engine.mctsv1 import Engine
+import common.main as common
+import engine.typesv1 as types
+
+GAMES = ["connect4", "2048", "reef"]
+HEURISTIC_TYPES = [None, "pre-visit", "simple"]
+
+# random moves played from init_game to get the benchmarked position
+N_OPENING_MOVES = {"connect4": 6, "2048": 20, "reef": 4}
+DEFAULT_WALKS = {"connect4": 2000, "2048": 300, "reef": 300}
+
+# metrics where higher is better, the rest are costs
+RATES = ["walks_per_sec", "nodes_per_sec"]
+
+
+def _connect4_heuristic(gamestate) -> float:
+    from connect4.heuristic import heuristic
+
+    return heuristic(gamestate)
+
+
+def _t2048_heuristic(gamestate) -> float:
+    import t2048.rules
+
+    return t2048.rules.rollout_policy(gamestate)["player"]
+
+
+def _reef_score_share(gamestate, player: int) -> float:
+    scores = [p.score for p in gamestate.players]
+    total = sum(scores)
+    if total == 0:
+        return 1 / len(scores)
+    return scores[player] / total
+
+
+def _reef_rollout_policy(gamestate) -> types.ScoreVec:
+    return {
+        player: _reef_score_share(gamestate, player)
+        for player in range(len(gamestate.players))
+    }
+
+
+def _reef_heuristic(gamestate) -> float:
+    return _reef_score_share(gamestate, gamestate.player)
+
+
+def _reef_is_over(gamestate) -> t.Optional[int]:
+    import reef.rules
+
+    if not reef.rules.is_over(gamestate):
+        return None
+    scores = [p.score for p in gamestate.players]
+    return scores.index(max(scores))
+
+
+def _reef_encode_action(action) -> str:
+    import reef.rules
+
+    return str(reef.rules.action_to_int(action))
+
+
+def _reef_decode_action(encoded: str):
+    import reef.rules
+
+    return reef.rules.int_to_action(int(encoded))
+
+
+def make_config(
+    game_type: str, heuristic_type: t.Optional[str]
+) -> types.MctsConfig:
+    if game_type == "reef":
+        import reef.rules
+
+        config = types.MctsConfig(
+            take_action_mut=reef.rules.take_action_mut,
+            get_all_actions=reef.rules.get_all_actions,
+            is_over=_reef_is_over,
+            get_final_score=_reef_rollout_policy,
+            players=[0, 1],
+            encode_action=_reef_encode_action,
+            decode_action=_reef_decode_action,
+            action_to_int=reef.rules.action_to_int,
+            int_to_action=reef.rules.int_to_action,
+            rollout_policy=_reef_rollout_policy,
+            heuristic=_reef_heuristic,
+        )
+    else:
+        rules = common.load_rules(game_type)
+        config = types.MctsConfig(
+            take_action_mut=rules.take_action_mut,
+            get_all_actions=rules.get_all_actions,
+            is_over=rules.is_over,
+            get_final_score=rules.get_final_score,
+            players=rules.get_players(),
+            encode_action=rules.encode_action,
+            decode_action=rules.decode_action,
+            action_to_int=rules.action_to_int,
+            int_to_action=rules.int_to_action,
+            clone_gamestate=rules.clone_gamestate,
+            heuristic=(
+                _connect4_heuristic
+                if game_type == "connect4"
+                else _t2048_heuristic
+            ),
+        )
+    return dataclasses.replace(
+        config, heuristic_type=heuristic_type, profile=True
+    )
+
+
+def make_position(game_type: str, seed: int):
+    """
+    init_game followed by N_OPENING_MOVES[game_type] random moves, the same
+    for every run with the same seed
+    """
+    random.seed(seed)
+    if game_type == "reef":
+        import reef.rules
+
+        gamestate = reef.rules.init_game(2)
+        get_random_action = reef.rules.get_random_action
+        is_over = _reef_is_over
+        take_action_mut = reef.rules.take_action_mut
+    else:
+        rules = common.load_rules(game_type)
+        gamestate = rules.init_game()
+        get_random_action = rules.get_random_action
+        is_over = rules.is_over
+        take_action_mut = rules.take_action_mut
+    for _ in range(N_OPENING_MOVES[game_type]):
+        action = get_random_action(gamestate)
+        if action is None or is_over(gamestate) is not None:
+            break
+        take_action_mut(gamestate, action)
+    assert is_over(gamestate) is None, "opening ended the game"
+    return gamestate
+
+
+def case_name(game_type: str, heuristic_type: t.Optional[str]) -> str:
+    return f"{game_type}/{heuristic_type or 'none'}"
+
+
+def run_case(
+    game_type: str, heuristic_type: t.Optional[str], n_walks: int, seed: int
+) -> t.Dict[str, t.Any]:
+    """ One repeat of one case. Meant to run in a fresh process """
+    config = make_config(game_type, heuristic_type)
+    gamestate = make_position(game_type, seed)
+    random.seed(seed)
+    engine = Engine(config, copy.deepcopy(gamestate))
+    engine.ponder(n_walks)
+    stats = engine.stats()
+    n_walks = stats.n_walks_produced
+    return {
+        "walks_per_sec": stats.walks_per_sec,
+        "nodes_per_sec": stats.tree_size / stats.ponder_seconds,
+        # kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        / 1024,
+        "us_per_walk": {
+            name: 1e6 * phase.seconds / n_walks
+            for name, phase in stats.phases.items()
+            if phase.calls > 0
+        },
+        "walks": n_walks,
+        "tree_size": stats.tree_size,
+        "max_depth": stats.max_depth,
+    }
+
+
+def _in_fresh_process(*args) -> t.Dict[str, t.Any]:
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=1, mp_context=context
+    ) as executor:
+        return executor.submit(run_case, *args).result()
+
+
+def _best(results: t.List[t.Dict[str, t.Any]]) -> t.Dict[str, t.Any]:
+    best = max(results, key=lambda result: result["walks_per_sec"])
+    return {
+        **best,
+        "peak_rss_mb": min(result["peak_rss_mb"] for result in results),
+    }
+
+
+def run(
+    games: t.List[str],
+    n_walks: t.Optional[int],
+    repeat: int,
+    seed: int,
+) -> t.Dict[str, t.Any]:
+    cases = [
+        (game_type, heuristic_type)
+        for game_type in games
+        for heuristic_type in HEURISTIC_TYPES
+    ]
+    results: t.Dict[str, t.List[t.Dict[str, t.Any]]] = {
+        case_name(*case): [] for case in cases
+    }
+    # interleaved, so that every case sees the same machine load
+    for _ in range(repeat):
+        for game_type, heuristic_type in cases:
+            walks = n_walks or DEFAULT_WALKS[game_type]
+            result = _in_fresh_process(game_type, heuristic_type, walks, seed)
+            results[case_name(game_type, heuristic_type)].append(result)
+    return {
+        "meta": {
+            "python": sys.version.split()[0],
+            "machine": platform.machine(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "cases": {name: _best(case) for name, case in results.items()},
+    }
+
+
+def _metrics(result: t.Dict[str, t.Any]) -> t.Dict[str, float]:
+    metrics = {
+        "walks_per_sec": result["walks_per_sec"],
+        "nodes_per_sec": result["nodes_per_sec"],
+        "peak_rss_mb": result["peak_rss_mb"],
+    }
+    for name, us in result["us_per_walk"].items():
+        metrics[f"{name} us/walk"] = us
+    return metrics
+
+
+def compare(
+    baseline: t.Dict[str, t.Any],
+    current: t.Dict[str, t.Any],
+    threshold: float,
+) -> t.List[str]:
+    """
+    Print every metric of every case in both runs next to its relative
+    change. Returns the regressions
+    """
+    regressions = []
+    print(f"{'case':<22}{'metric':<22}{'baseline':>11}{'current':>11}")
+    for name, result in current["cases"].items():
+        if name not in baseline["cases"]:
+            print(f"{name:<22}not in baseline")
+            continue
+        old = _metrics(baseline["cases"][name])
+        for metric, value in _metrics(result).items():
+            if metric not in old or old[metric] == 0:
+                continue
+            change = value / old[metric] - 1
+            worse = -change if metric in RATES else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{name} {metric} {change:+.1%}")
+            print(
+                f"{name:<22}{metric:<22}{old[metric]:>11.1f}{value:>11.1f}"
+                f" {change:>+7.1%}{flag}"
+            )
+    return regressions
+
+
+def format_results(results: t.Dict[str, t.Any]) -> str:
+    lines = [
+        f"{'case':<22}{'walks/s':>10}{'nodes/s':>10}{'rss MB':>9}"
+        "  us/walk per phase"
+    ]
+    for name, result in results["cases"].items():
+        phases = " ".join(
+            f"{phase}={us:.0f}" for phase, us in result["us_per_walk"].items()
+        )
+        lines.append(
+            f"{name:<22}{result['walks_per_sec']:>10.0f}"
+            f"{result['nodes_per_sec']:>10.0f}"
+            f"{result['peak_rss_mb']:>9.1f}  {phases}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Engine benchmark suite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the suite")
+    run_parser.add_argument(
+        "--games", nargs="+", choices=GAMES, default=GAMES
+    )
+    run_parser.add_argument(
+        "--walks",
+        type=int,
+        default=None,
+        help="walks per case (default depends on the game)",
+    )
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--out", type=str, help="save results as json")
+    run_parser.add_argument(
+        "--baseline", type=str, help="compare against this json baseline"
+    )
+    run_parser.add_argument("--threshold", type=float, default=0.1)
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare two saved runs"
+    )
+    compare_parser.add_argument("baseline", type=str)
+    compare_parser.add_argument("current", type=str)
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        current = run(args.games, args.walks, args.repeat, args.seed)
+        print(format_results(current))
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(current, f, indent=2)
+        if args.baseline is None:
+            sys.exit(0)
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+    print()
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regressions above {args.threshold:.0%}")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
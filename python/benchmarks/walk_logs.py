@@ -0,0 +1,87 @@
+"""
+Walks/sec of Engine.ponder with and without walk logs
+(MctsConfig.record_walk_logs), and how much memory the walk logs of one walk
+take.
+
+    python -m benchmarks.walk_logs --walks 3000 --repeat 3
+    python -m benchmarks.walk_logs --game-type 2048
+"""
+import argparse
+import copy
+import dataclasses
+import random
+import time
+import tracemalloc
+
+from engine.mctsv1 import Engine
+import common.main as common
+import engine.typesv1 as types
+
+
+def make_config(game_type: str, record_walk_logs: bool) -> types.MctsConfig:
+    rules = common.load_rules(game_type)
+    return types.MctsConfig(
+        take_action_mut=rules.take_action_mut,
+        get_all_actions=rules.get_all_actions,
+        is_over=rules.is_over,
+        get_final_score=rules.get_final_score,
+        players=rules.get_players(),
+        encode_action=rules.encode_action,
+        decode_action=rules.decode_action,
+        action_to_int=rules.action_to_int,
+        int_to_action=rules.int_to_action,
+        clone_gamestate=rules.clone_gamestate,
+        record_walk_logs=record_walk_logs,
+    )
+
+
+def walks_per_sec(config: types.MctsConfig, gamestate, n_walks: int) -> float:
+    random.seed(0)
+    engine = Engine(config, copy.deepcopy(gamestate))
+    start = time.perf_counter()
+    engine.ponder(n_walks)
+    return n_walks / (time.perf_counter() - start)
+
+
+def bytes_per_walk(config: types.MctsConfig, gamestate, n_walks: int) -> float:
+    """ Memory held by what ponder returns, per walk """
+    random.seed(0)
+    engine = Engine(config, copy.deepcopy(gamestate))
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    walk_logs, _ = engine.ponder(n_walks)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # the tree grows the same way in both modes, so this is mostly walk logs
+    return (after - before) / n_walks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark walk logs")
+    parser.add_argument(
+        "--game-type",
+        type=str,
+        default="connect4",
+        choices=["2048", "connect4", "connect4-bitboard"],
+    )
+    parser.add_argument("--walks", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    gamestate = common.load_rules(args.game_type).init_game()
+    logged = make_config(args.game_type, record_walk_logs=True)
+    unlogged = dataclasses.replace(logged, record_walk_logs=False)
+
+    configs = {"on": logged, "off": unlogged}
+    # interleaved, so that both modes see the same machine load
+    rates = {name: 0.0 for name in configs}
+    for _ in range(args.repeat):
+        for name, config in configs.items():
+            rate = walks_per_sec(config, gamestate, args.walks)
+            rates[name] = max(rates[name], rate)
+
+    print(f"{'walk logs':<10}{'walks/s':>10}{'bytes/walk':>12}")
+    for name, config in configs.items():
+        memory = bytes_per_walk(config, gamestate, args.walks // 3)
+        print(f"{name:<10}{rates[name]:>10.0f}{memory:>12.0f}")
+    print(f"speedup {rates['off'] / rates['on']:.2f}x")
@@ -1,5 +1,7 @@
 from dataclasses import dataclass
 import atexit
+import copy
+import dataclasses
 import json
 import random
 import subprocess
@@ -43,10 +45,17 @@ P = t.TypeVar("P")  # action
 class Agent(t.Generic[G, A, P]):
     agent_type: AgentType
     get_action: t.Callable[[G], A]
+    # frees what the agent holds on to (e.g. an engine's worker processes),
+    # called once the game is over
+    close: t.Callable[[], None] = lambda: None
 
 
 def get_agent(
-    agent_type: AgentType, game_type: str, mcts_budget=1, n_engine_servers=2
+    agent_type: AgentType,
+    game_type: str,
+    mcts_budget=1,
+    n_engine_servers=2,
+    n_workers=1,
 ) -> Agent:
     rules = common.load_rules(game_type)
 
@@ -58,6 +67,11 @@ def get_agent(
         players=rules.get_players(),
         encode_action=rules.encode_action,
         decode_action=rules.decode_action,
+        action_to_int=rules.action_to_int,
+        int_to_action=rules.int_to_action,
+        clone_gamestate=rules.clone_gamestate,
+        action_prior=rules.action_prior,
+        n_workers=n_workers,
     )
 
     if agent_type == "random":
@@ -80,13 +94,28 @@ def get_agent(
             get_action=rules.get_action_from_human, agent_type=agent_type
         )
     elif agent_type == "mcts-local":
+        engine = None
 
         def get_action(gamestate: G) -> A:
-            engine = Engine(config, gamestate)
+            nonlocal engine
+            # keep the subtree from the last search if the game went through it
+            if engine is None:
+                # nobody consumes the walk logs of a local search
+                engine = Engine(
+                    dataclasses.replace(config, record_walk_logs=False),
+                    copy.deepcopy(gamestate),
+                )
+            else:
+                engine.advance_to(gamestate)
             _, action = engine.ponder(100)
             return action
 
-        return Agent(get_action=get_action, agent_type=agent_type)
+        def close():
+            # the worker pool and the shared tree outlive the moves
+            if engine is not None:
+                engine.close()
+
+        return Agent(get_action=get_action, agent_type=agent_type, close=close)
     elif agent_type == "mcts-distributed":
         return EngineServerFarmClient(
             agent_type, game_type, n_engine_servers, timeout=mcts_budget
@@ -145,6 +174,9 @@ class EngineServerFarmClient(t.Generic[G, A]):
         atexit.register(killall)
         return procs
 
+    def close(self):
+        """ Nothing to free, the engine servers are stopped at exit """
+
     def get_action(self, gamestate: G) -> A:
         """
         Send this gamestate to redis, wait <timeout> seconds and return
@@ -181,7 +213,7 @@ class EngineServerFarmClient(t.Generic[G, A]):
                 exit=True,
             )
         actions = [
-            a["best_move"]
+            self.rules.int_to_action(a["best_move"])
             for a in messages
             if a["gamestate_id"] == gamestate_id
         ]
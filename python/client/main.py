@@ -76,16 +76,24 @@ if __name__ == "__main__":
         type=int,
     )
 
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes mcts-local searches with",
+    )
+
     parser.add_argument("game_type", type=str, choices=["2048", "connect4"])
     parser.add_argument(
         "player_type", type=str, choices=AGENT_TYPES, nargs="+"
     )
 
     args = vars(parser.parse_args())
-    filepath, nofile, seed, player_types, game_type = (
+    filepath, nofile, seed, n_workers, player_types, game_type = (
         args.get("file"),
         args.get("no_file"),
         args.get("seed"),
+        args.get("workers"),
         args.get("player_type"),
         args.get("game_type"),
     )
@@ -108,10 +116,13 @@ if __name__ == "__main__":
         default_config = {
             "mcts_budget": 2,
             "n_engine_servers": 2,
+            "n_workers": n_workers,
         }
         agents = [
             get_agent(player_type, game_type, **default_config)
             for player_type in player_types
         ]
+        for agent in agents:
+            stack.callback(agent.close)
 
         play_game(agents, game_type, output)
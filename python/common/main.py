@@ -16,9 +16,22 @@ class Rules(t.Generic[G, A, P]):
     get_final_score: t.Callable[[G], t.Dict[str, float]]
     encode_action: t.Callable[[A], str]
     decode_action: t.Callable[[str], A]
+    # compact codec used inside the engine, in walk logs and on the wire.
+    # Codes are small non-negative ints, unique per game (not per gamestate)
+    action_to_int: t.Callable[[A], int]
+    int_to_action: t.Callable[[int], A]
     get_random_action: t.Callable[[G], t.Optional[A]]
     get_all_actions: t.Callable[[G], t.List[A]]
+    # MctsConfig.action_prior, None where the engine's shuffle is the best
+    # guess (2048's environment places tiles uniformly at random)
+    action_prior: t.Optional[t.Callable[[G, A], float]]
     get_players: t.Callable[[G], t.List[P]]
+    # 64 bit zobrist hash, maintained incrementally by take_action_mut (and
+    # undo_action where the game has one)
+    hash_gamestate: t.Callable[[G], int]
+    # copy of a gamestate that take_action_mut can't change through the
+    # original, faster than copy.deepcopy
+    clone_gamestate: t.Callable[[G], G]
 
     format_gamestate: t.Callable[[G], str]
 
@@ -33,6 +46,10 @@ def load_rules(game_type: str):
     elif game_type == "connect4":
         import connect4.rules as rules
         import connect4.fmt as fmt
+    elif game_type == "connect4-bitboard":
+        import connect4.bitboard as rules
+
+        fmt = rules
     else:
         raise Exception(f"Unknown game type {game_type}")
 
@@ -43,9 +60,14 @@ def load_rules(game_type: str):
         get_final_score=rules.get_final_score,
         encode_action=rules.encode_action,
         decode_action=rules.decode_action,
+        action_to_int=rules.action_to_int,
+        int_to_action=rules.int_to_action,
         get_random_action=rules.get_random_action,
         get_all_actions=rules.get_all_actions,
+        action_prior=getattr(rules, "action_prior", None),
         get_players=rules.get_players,
+        hash_gamestate=rules.hash_gamestate,
+        clone_gamestate=rules.clone_gamestate,
         format_gamestate=fmt.format_gamestate,
         encode_gamestate=rules.encode_gamestate,
         decode_gamestate=rules.decode_gamestate,
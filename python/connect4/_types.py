@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import typing as t
 
 XSpace = t.Literal["X"]
@@ -15,6 +15,39 @@ class GameState:
     board: Board
     num_moves: int
     player: Player
+    # zobrist hash of board and player, kept up to date by
+    # rules.take_action_mut and rules.undo_action
+    zobrist: int = 0
+
+    # (row, col) of the piece take_action_mut placed last, so rules.is_over
+    # only has to look at lines through it. None if unknown (e.g. after
+    # rules.undo_action)
+    last_move: t.Optional[t.Tuple[int, int]] = field(
+        default=None, compare=False
+    )
+    # rules.is_over's answer (rules.ONGOING if the game isn't over), or None
+    # if it hasn't been computed since the board last changed.
+    # rules.undo_action sets it to rules.ONGOING
+    result: t.Optional[str] = field(default=None, compare=False)
+
+
+@dataclass
+class BitboardGameState:
+    """
+    Same game as GameState, used by connect4.bitboard. Bit (col * 7 + row) of
+    a player's board is set if the player has a piece there, row 0 being the
+    bottom row. The top bit of each column (row 6) is always 0 so that lines
+    can't wrap from one column into the next
+    """
+
+    x_board: int
+    o_board: int
+    # heights[col] is the bit index of the next free cell of col
+    heights: t.List[int]
+    num_moves: int
+    player: Player
+    # same hash as GameState.zobrist for the same position
+    zobrist: int = 0
 
 
 Action = t.Tuple[int, Player]
@@ -0,0 +1,214 @@
+"""
+Bitboard backend for connect4. Same rules, actions and hashes as
+connect4.rules, but a gamestate is two ints and the column heights (see
+_types.BitboardGameState). A win is four bits in a row, found by shifting a
+player's board onto itself in each of the four directions.
+"""
+import json
+import random
+import typing as t
+
+from connect4 import _types as types
+from connect4 import fmt
+from connect4.rules import (
+    BOARD_HEIGHT,
+    BOARD_LENGTH,
+    ZOBRIST_PIECES,
+    ZOBRIST_O_TO_MOVE,
+    Draw,
+    other_player,
+)
+
+# actions and players are the same as in connect4.rules
+from connect4.rules import (  # noqa
+    encode_action,
+    decode_action,
+    action_to_int,
+    int_to_action,
+    order_actions,
+    action_prior,
+    get_players,
+)
+
+COLUMN_BITS = BOARD_HEIGHT + 1
+
+# distance between neighbouring cells on the board: vertical, horizontal and
+# the two diagonals
+DIRECTIONS = [1, COLUMN_BITS, COLUMN_BITS - 1, COLUMN_BITS + 1]
+
+
+def init_game() -> types.BitboardGameState:
+    return types.BitboardGameState(
+        x_board=0,
+        o_board=0,
+        heights=[col * COLUMN_BITS for col in range(BOARD_LENGTH)],
+        num_moves=0,
+        player="X",
+    )
+
+
+def _zobrist_key(player: types.Player, bit: int) -> int:
+    col, row = divmod(bit, COLUMN_BITS)
+    # connect4.rules counts rows from the top
+    return ZOBRIST_PIECES[player][BOARD_HEIGHT - 1 - row][col]
+
+
+def take_action_mut(
+    gamestate: types.BitboardGameState, action: types.Action
+) -> t.Optional[types.BitboardGameState]:
+    col, mark = action
+    bit = gamestate.heights[col]
+    if bit == col * COLUMN_BITS + BOARD_HEIGHT:
+        return None  # column is full
+
+    if mark == "X":
+        gamestate.x_board |= 1 << bit
+    else:
+        gamestate.o_board |= 1 << bit
+    gamestate.heights[col] = bit + 1
+    gamestate.zobrist ^= _zobrist_key(mark, bit) ^ ZOBRIST_O_TO_MOVE
+    gamestate.num_moves += 1
+    gamestate.player = other_player(gamestate.player)
+    return gamestate
+
+
+def undo_action(gamestate: types.BitboardGameState, action: types.Action):
+    col, _ = action
+    bit = gamestate.heights[col] - 1
+    assert (
+        bit >= col * COLUMN_BITS
+    ), "Tried to undo action for a column which does not have a marker in it"
+
+    mask = 1 << bit
+    if gamestate.x_board & mask:
+        gamestate.x_board ^= mask
+        mark = "X"
+    else:
+        gamestate.o_board ^= mask
+        mark = "O"
+    gamestate.heights[col] = bit
+    gamestate.zobrist ^= _zobrist_key(mark, bit) ^ ZOBRIST_O_TO_MOVE
+    gamestate.num_moves -= 1
+    gamestate.player = other_player(gamestate.player)
+
+
+def has_four(board: int) -> bool:
+    for shift in DIRECTIONS:
+        pairs = board & (board >> shift)
+        if pairs & (pairs >> (2 * shift)):
+            return True
+    return False
+
+
+def is_over(
+    state: types.BitboardGameState,
+) -> t.Optional[t.Union[types.Player, Draw]]:
+    if has_four(state.x_board):
+        return "X"
+    if has_four(state.o_board):
+        return "O"
+    if state.num_moves == BOARD_LENGTH * BOARD_HEIGHT:
+        return "draw"
+    return None
+
+
+def get_final_score(
+    state: types.BitboardGameState,
+) -> t.Dict[types.Player, float]:
+    winner = is_over(state)
+    assert winner is not None
+    if winner in ["X", "O"]:
+        vec = {"X": 0, "O": 0}
+        vec[winner] = 1
+        return vec
+    else:
+        return {"X": 0.5, "O": 0.5}
+
+
+def get_all_actions(
+    gamestate: types.BitboardGameState,
+) -> t.List[types.Action]:
+    player = gamestate.player
+    return [
+        (col, player)
+        for col, bit in enumerate(gamestate.heights)
+        if bit != col * COLUMN_BITS + BOARD_HEIGHT
+    ]
+
+
+def get_random_action(
+    gamestate: types.BitboardGameState,
+) -> t.Optional[types.Action]:
+    actions = get_all_actions(gamestate)
+    if len(actions) == 0:
+        return None
+    return random.choice(actions)
+
+
+def clone_gamestate(
+    gamestate: types.BitboardGameState,
+) -> types.BitboardGameState:
+    return types.BitboardGameState(
+        x_board=gamestate.x_board,
+        o_board=gamestate.o_board,
+        heights=gamestate.heights.copy(),
+        num_moves=gamestate.num_moves,
+        player=gamestate.player,
+        zobrist=gamestate.zobrist,
+    )
+
+
+def hash_gamestate(gamestate: types.BitboardGameState) -> int:
+    return gamestate.zobrist
+
+
+def from_gamestate(gamestate: types.GameState) -> types.BitboardGameState:
+    boards = {"X": 0, "O": 0}
+    heights = [col * COLUMN_BITS for col in range(BOARD_LENGTH)]
+    # walk each column bottom up
+    for r in range(BOARD_HEIGHT - 1, -1, -1):
+        for c, x in enumerate(gamestate.board[r]):
+            if x is not None:
+                boards[x] |= 1 << heights[c]
+                heights[c] += 1
+    return types.BitboardGameState(
+        x_board=boards["X"],
+        o_board=boards["O"],
+        heights=heights,
+        num_moves=gamestate.num_moves,
+        player=gamestate.player,
+        zobrist=gamestate.zobrist,
+    )
+
+
+def to_gamestate(gamestate: types.BitboardGameState) -> types.GameState:
+    board = [[None] * BOARD_LENGTH for _ in range(BOARD_HEIGHT)]
+    for c in range(BOARD_LENGTH):
+        for row in range(BOARD_HEIGHT):
+            mask = 1 << (c * COLUMN_BITS + row)
+            r = BOARD_HEIGHT - 1 - row
+            if gamestate.x_board & mask:
+                board[r][c] = "X"
+            elif gamestate.o_board & mask:
+                board[r][c] = "O"
+    return types.GameState(
+        board=board,
+        num_moves=gamestate.num_moves,
+        player=gamestate.player,
+        zobrist=gamestate.zobrist,
+    )
+
+
+def format_gamestate(gamestate: types.BitboardGameState) -> str:
+    return fmt.format_gamestate(to_gamestate(gamestate))
+
+
+def encode_gamestate(gamestate: types.BitboardGameState) -> bytes:
+    return json.dumps(gamestate.__dict__).encode()
+
+
+Json = t.Dict[str, t.Any]
+
+
+def decode_gamestate(gs_as_json: Json) -> types.BitboardGameState:
+    return types.BitboardGameState(**gs_as_json)
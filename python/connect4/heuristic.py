@@ -1,5 +1,7 @@
 import typing as t
 
+import numpy as np
+
 from connect4.rules import BOARD_HEIGHT, BOARD_LENGTH, other_player
 import connect4._types as types
 import utils
@@ -180,3 +182,89 @@ def heuristic(gamestate: types.GameState) -> float:
         + 2
         * (remaining_open_quads_this_player - remaining_open_quads_opponent)
     )
+
+
+############################## Batched heuristic ##############################
+# heuristic for many gamestates at once, on an (n, BOARD_HEIGHT * BOARD_LENGTH)
+# array of flattened boards: 1 for the pieces of the player to move, -1 for the
+# opponent's and 0 for empty cells.
+#
+# As heuristic is written the opponent never has open quads (it checks for 1
+# piece of the player to move next to 3 of the opponent's in 4 cells) and
+# there are never open trips, for the same reason. What is left is
+#   - the cells that complete a line of 4 for the player to move (open quads)
+#   - of those, the ones on the bottom row when X is to move (the only open
+#     quads that survive the parity filter)
+#   - the middle bias
+# which is what batch_heuristic computes, giving the same values.
+
+QUAD_CELLS = np.array(
+    [[r * BOARD_LENGTH + c for (r, c) in quad] for quad in ALL_QUADS]
+)
+BOTTOM_ROW_CELLS = slice((BOARD_HEIGHT - 1) * BOARD_LENGTH, None)
+MIDDLE_BIAS = np.array([3 - abs(3 - c) for (r, c) in ALL_COORDS])
+
+
+def board_array(gamestate: types.GameState) -> np.ndarray:
+    """ Flattened board from the point of view of the player to move """
+    this_player = gamestate.player
+    return np.array(
+        [
+            0 if val is None else 1 if val == this_player else -1
+            for row in gamestate.board
+            for val in row
+        ],
+        dtype=np.int8,
+    )
+
+
+def heuristic_of_boards(boards: np.ndarray, x_to_move: bool) -> t.List[float]:
+    """
+    heuristic of each board in <boards> (see above), all with the same player
+    to move
+    """
+    quads = boards[:, QUAD_CELLS]
+    empty = quads == 0
+    is_open = (empty.sum(axis=2) == 1) & ((quads == 1).sum(axis=2) == 3)
+    # a cell can complete several quads but counts once
+    board_idx, quad_idx = np.nonzero(is_open)
+    open_cells = np.zeros(boards.shape, dtype=bool)
+    open_cells[
+        board_idx,
+        QUAD_CELLS[quad_idx, empty[board_idx, quad_idx].argmax(axis=1)],
+    ] = True
+
+    n_open = open_cells.sum(axis=1)
+    n_on_parity = (
+        open_cells[:, BOTTOM_ROW_CELLS].sum(axis=1)
+        if x_to_move
+        else np.zeros(len(boards), dtype=np.int64)
+    )
+    middle_bias = ((boards == 1) @ MIDDLE_BIAS) / 3.0
+    return [
+        utils.sigmoid(0 + bias + 3 * on_parity + 2 * (n - on_parity))
+        for bias, on_parity, n in zip(
+            middle_bias.tolist(), n_on_parity.tolist(), n_open.tolist()
+        )
+    ]
+
+
+def batch_heuristic(
+    gamestate: types.GameState, actions: t.List[types.Action]
+) -> t.List[float]:
+    """
+    heuristic of the gamestate each of <actions> leads to, computed in one go
+    without taking the actions. For MinimaxConfig.batch_heuristic
+    """
+    # the player to move in the children is the opponent, whose pieces are
+    # -1 in the parent's board
+    parent = -board_array(gamestate)
+    boards = np.tile(parent, (len(actions), 1))
+    for i, (col, _) in enumerate(actions):
+        row = next(
+            r
+            for r in range(BOARD_HEIGHT - 1, -1, -1)
+            if gamestate.board[r][col] is None
+        )
+        boards[i, row * BOARD_LENGTH + col] = -1
+    return heuristic_of_boards(boards, other_player(gamestate.player) == "X")
@@ -1,3 +1,4 @@
+import copy
 import itertools
 from dataclasses import dataclass
 import contextlib
@@ -17,14 +18,25 @@ from connect4.rules import (
     get_all_actions,
     other_player,
     encode_action,
+    decode_action,
+    action_to_int,
+    int_to_action,
+    clone_gamestate,
+    order_actions,
+    action_prior,
+    hash_gamestate,
 )
-from connect4.heuristic import heuristic
+from connect4.heuristic import heuristic, batch_heuristic
 from connect4 import fmt
 import utils
 import engine.typesv1 as types
 from engine.mctsv1 import Engine
 import connect4._types as c4types
-from engine.minimax import minimax
+from engine.minimax import (
+    iterative_deepening,
+    TranspositionTable,
+    HistoryTable,
+)
 
 
 AGENT_TYPES = [
@@ -86,6 +98,7 @@ def play_game(agent1: Agent, agent2: Agent, output: t.Optional[t.IO] = None):
 
 def get_agent(agent_type: AgentType) -> Agent:
     mcts_budget = 2
+    minimax_budget = 2
     if agent_type == "random":
 
         def get_action(gamestate: c4types.GameState) -> c4types.Action:
@@ -111,10 +124,20 @@ def get_agent(agent_type: AgentType) -> Agent:
             heuristic=heuristic,
             get_player=lambda gs: gs.player,
             other_player=other_player,
+            order_actions=order_actions,
+            hash_gamestate=hash_gamestate,
+            killer_moves=True,
+            history_heuristic=True,
+            batch_heuristic=batch_heuristic,
         )
+        # kept for the whole game, what earlier moves learned still helps
+        tt = TranspositionTable(config.tt_capacity)
+        history = HistoryTable()
 
         def get_action(gs: c4types.GameState) -> c4types.Action:
-            _, action = minimax(config, gs, depth=4)
+            _, action = iterative_deepening(
+                config, gs, nseconds=minimax_budget, tt=tt, history=history
+            )
             return action
 
         return Agent(
@@ -149,13 +172,19 @@ def get_agent(agent_type: AgentType) -> Agent:
             is_over=is_over,
             get_final_score=get_final_score,
             players=["X", "O"],
-            budget=mcts_budget,
+            early_stop=True,
             encode_action=encode_action,
+            decode_action=decode_action,
+            action_to_int=action_to_int,
+            int_to_action=int_to_action,
+            clone_gamestate=clone_gamestate,
+            action_prior=action_prior,
+            record_walk_logs=False,
         )
 
         def get_action(gamestate: c4types.GameState) -> c4types.Action:
-            eng = Engine(config)
-            _, action = eng.ponder(gamestate, nseconds=2)
+            eng = Engine(config, copy.deepcopy(gamestate))
+            _, action = eng.ponder(nseconds=mcts_budget)
             return action
 
         return Agent(get_action=get_action, agent_type=agent_type)
@@ -167,15 +196,21 @@ def get_agent(agent_type: AgentType) -> Agent:
             is_over=is_over,
             get_final_score=get_final_score,
             players=["X", "O"],
-            budget=mcts_budget,
-            heuristic_type="basic",
+            early_stop=True,
+            heuristic_type="simple",
             heuristic=heuristic,
             encode_action=encode_action,
+            decode_action=decode_action,
+            action_to_int=action_to_int,
+            int_to_action=int_to_action,
+            clone_gamestate=clone_gamestate,
+            action_prior=action_prior,
+            record_walk_logs=False,
         )
 
         def get_action(gamestate: c4types.GameState) -> c4types.Action:
-            eng = Engine(config)
-            _, action = eng.ponder(gamestate, nseconds=2)
+            eng = Engine(config, copy.deepcopy(gamestate))
+            _, action = eng.ponder(nseconds=mcts_budget)
             return action
 
         return Agent(get_action=get_action, agent_type=agent_type)
@@ -188,15 +223,21 @@ def get_agent(agent_type: AgentType) -> Agent:
             is_over=is_over,
             get_final_score=get_final_score,
             players=["X", "O"],
-            budget=mcts_budget,
+            early_stop=True,
             heuristic_type="pre-visit",
             heuristic=heuristic,
             encode_action=encode_action,
+            decode_action=decode_action,
+            action_to_int=action_to_int,
+            int_to_action=int_to_action,
+            clone_gamestate=clone_gamestate,
+            action_prior=action_prior,
+            record_walk_logs=False,
         )
 
         def get_action(gamestate: c4types.GameState) -> c4types.Action:
-            eng = Engine(config)
-            _, action = eng.ponder(gamestate, nseconds=2)
+            eng = Engine(config, copy.deepcopy(gamestate))
+            _, action = eng.ponder(nseconds=mcts_budget)
             return action
 
         return Agent(get_action=get_action, agent_type=agent_type)
@@ -1,3 +1,4 @@
+import json
 import random
 import typing as t
 
@@ -8,6 +9,18 @@ import utils
 BOARD_LENGTH = 7
 BOARD_HEIGHT = 6
 
+# Zobrist keys. Seeded so that every process (e.g. every engineserver) agrees
+# on the hash of a gamestate
+_zobrist_rng = random.Random(4)
+ZOBRIST_PIECES = {
+    player: [
+        [_zobrist_rng.getrandbits(64) for _ in range(BOARD_LENGTH)]
+        for _ in range(BOARD_HEIGHT)
+    ]
+    for player in ["X", "O"]
+}
+ZOBRIST_O_TO_MOVE = _zobrist_rng.getrandbits(64)
+
 
 def init_game() -> types.GameState:
     return types.GameState(
@@ -33,6 +46,11 @@ def take_action_mut(
         return None
 
     board[next_available_row][col] = mark
+    gamestate.last_move = (next_available_row, col)
+    gamestate.result = None
+    gamestate.zobrist ^= (
+        ZOBRIST_PIECES[mark][next_available_row][col] ^ ZOBRIST_O_TO_MOVE
+    )
     gamestate.num_moves += 1
     gamestate.player = (
         "X"
@@ -46,14 +64,59 @@ def take_action_mut(
 
 Draw = t.Literal["draw"]
 
+# GameState.result of a game that isn't over
+ONGOING = "ongoing"
+
+# (row, col) steps along a line: right, down, down+right, down+left
+LINE_DIRECTIONS = [(0, 1), (1, 0), (1, 1), (1, -1)]
+
 
 def is_over(state: types.GameState) -> t.Optional[t.Union[types.Player, Draw]]:
+    if state.result is None:
+        state.result = _compute_result(state)
+    return None if state.result == ONGOING else state.result
+
+
+def _compute_result(state: types.GameState) -> str:
+    # only the last move can have won, unless we don't know what it was
+    if state.last_move is not None:
+        winner = _find_winner_through(state.board, *state.last_move)
+    else:
+        winner = _find_winner(state.board)
+    if winner is not None:
+        return winner
 
     # draw
     if state.num_moves == BOARD_LENGTH * BOARD_HEIGHT:
         return "draw"
+    return ONGOING
+
+
+def _find_winner_through(
+    board: types.Board, r: int, c: int
+) -> t.Optional[types.Player]:
+    """ Winner of a line of four through (r, c) if there is one """
+    mark = board[r][c]
+    if mark is None:
+        return None
+    for dr, dc in LINE_DIRECTIONS:
+        n_in_line = 1
+        for sign in [1, -1]:
+            x, y = r + sign * dr, c + sign * dc
+            while (
+                0 <= x < BOARD_HEIGHT
+                and 0 <= y < BOARD_LENGTH
+                and board[x][y] == mark
+            ):
+                n_in_line += 1
+                x, y = x + sign * dr, y + sign * dc
+        if n_in_line >= 4:
+            return mark
+    return None
+
 
-    board = state.board
+def _find_winner(board: types.Board) -> t.Optional[types.Player]:
+    """ Winner of any line of four on the board """
     for r in range(BOARD_HEIGHT):
         for c in range(BOARD_LENGTH):
             if board[r][c] is None:
@@ -139,7 +202,13 @@ def undo_action(gamestate: types.GameState, action: types.Action):
     assert (
         r is not None
     ), "Tried to undo action for a column which does not have a marker in it"
+    gamestate.zobrist ^= ZOBRIST_PIECES[board[r][c]][r][c] ^ ZOBRIST_O_TO_MOVE
     board[r][c] = None
+    # the move before this one isn't known, but a move was just made from
+    # this gamestate, so the game isn't over (moves are never made once it
+    # is). Caching that spares is_over a scan of the whole board
+    gamestate.last_move = None
+    gamestate.result = ONGOING
 
 
 def get_all_actions(gamestate: types.GameState) -> t.List[types.Action]:
@@ -149,6 +218,19 @@ def get_all_actions(gamestate: types.GameState) -> t.List[types.Action]:
     return actions
 
 
+def order_actions(
+    gamestate: types.GameState, actions: t.List[types.Action]
+) -> t.List[types.Action]:
+    """ Center columns first, they are part of the most lines of four """
+    center = BOARD_LENGTH // 2
+    return sorted(actions, key=lambda action: abs(action[0] - center))
+
+
+def action_prior(gamestate: types.GameState, action: types.Action) -> float:
+    """ MctsConfig.action_prior, in the same center first order """
+    return -abs(action[0] - BOARD_LENGTH // 2)
+
+
 def get_random_action(gamestate: types.GameState) -> t.Optional[types.Action]:
     actions = get_all_actions(gamestate)
     if len(actions) == 0:
@@ -157,4 +239,64 @@ def get_random_action(gamestate: types.GameState) -> t.Optional[types.Action]:
 
 
 def encode_action(action: types.Action) -> str:
-    raise NotImplementedError
+    return json.dumps(list(action))
+
+
+def decode_action(encoded: str) -> types.Action:
+    col, player = json.loads(encoded)
+    return (col, player)
+
+
+def action_to_int(action: types.Action) -> int:
+    """ Column for X's actions, BOARD_LENGTH + column for O's """
+    col, player = action
+    return col + BOARD_LENGTH * (player == "O")
+
+
+def int_to_action(code: int) -> types.Action:
+    is_o, col = divmod(code, BOARD_LENGTH)
+    return (col, "O" if is_o else "X")
+
+
+def clone_gamestate(gamestate: types.GameState) -> types.GameState:
+    """ Same as copy.deepcopy, but only copies what can be mutated """
+    return types.GameState(
+        board=[row.copy() for row in gamestate.board],
+        num_moves=gamestate.num_moves,
+        player=gamestate.player,
+        zobrist=gamestate.zobrist,
+        last_move=gamestate.last_move,
+        result=gamestate.result,
+    )
+
+
+def hash_gamestate(gamestate: types.GameState) -> int:
+    return gamestate.zobrist
+
+
+def compute_hash(gamestate: types.GameState) -> int:
+    """
+    Zobrist hash of gamestate computed from scratch. take_action_mut and
+    undo_action keep gamestate.zobrist equal to this incrementally
+    """
+    h = ZOBRIST_O_TO_MOVE if gamestate.player == "O" else 0
+    for r, row in enumerate(gamestate.board):
+        for c, x in enumerate(row):
+            if x is not None:
+                h ^= ZOBRIST_PIECES[x][r][c]
+    return h
+
+
+def get_players() -> t.List[types.Player]:
+    return ["X", "O"]
+
+
+def encode_gamestate(gamestate: types.GameState) -> bytes:
+    return json.dumps(gamestate.__dict__).encode()
+
+
+Json = t.Dict[str, t.Any]
+
+
+def decode_gamestate(gs_as_json: Json) -> types.GameState:
+    return types.GameState(**gs_as_json)
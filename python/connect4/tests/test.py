@@ -0,0 +1,161 @@
+import copy
+
+from hypothesis import given, strategies as st
+
+from connect4 import _types as types
+from connect4 import bitboard
+from connect4.heuristic import heuristic, batch_heuristic
+import connect4.rules as connect4_rules
+from connect4.rules import (
+    BOARD_HEIGHT,
+    BOARD_LENGTH,
+    init_game,
+    take_action_mut,
+    undo_action,
+    is_over,
+    get_all_actions,
+    compute_hash,
+    action_to_int,
+    int_to_action,
+    _find_winner,
+)
+
+
+def play(columns) -> types.GameState:
+    gamestate = init_game()
+    for col in columns:
+        take_action_mut(gamestate, (col, gamestate.player))
+    return gamestate
+
+
+@given(st.lists(st.integers(min_value=0, max_value=BOARD_LENGTH - 1)))
+def test_zobrist_hash_is_maintained_incrementally(columns):
+    gamestate = init_game()
+    history = []
+    for col in columns:
+        if is_over(gamestate) is not None:
+            break
+        before = copy.deepcopy(gamestate)
+        action = (col, gamestate.player)
+        if take_action_mut(gamestate, action) is None:
+            continue
+        history.append((before, action))
+        assert gamestate.zobrist == compute_hash(gamestate)
+
+    for before, action in reversed(history):
+        undo_action(gamestate, action)
+        assert gamestate == before
+
+
+def test_zobrist_hash_is_the_same_for_transpositions():
+    assert play([3, 2, 4]).zobrist == play([4, 2, 3]).zobrist
+    assert play([3, 2, 4]).zobrist != play([3, 4, 2]).zobrist
+
+
+@given(st.lists(st.integers(min_value=0, max_value=BOARD_LENGTH - 1)))
+def test_bitboard_agrees_with_rules(columns):
+    gamestate = init_game()
+    bb_gamestate = bitboard.init_game()
+    actions = []
+    for col in columns:
+        if is_over(gamestate) is not None:
+            break
+        action = (col, gamestate.player)
+        assert bitboard.get_all_actions(bb_gamestate) == get_all_actions(
+            gamestate
+        )
+        if take_action_mut(gamestate, action) is None:
+            assert bitboard.take_action_mut(bb_gamestate, action) is None
+            continue
+        assert bitboard.take_action_mut(bb_gamestate, action) is not None
+        actions.append(action)
+
+        assert bitboard.to_gamestate(bb_gamestate) == gamestate
+        assert bitboard.from_gamestate(gamestate) == bb_gamestate
+        assert bitboard.is_over(bb_gamestate) == is_over(gamestate)
+
+    for action in reversed(actions):
+        undo_action(gamestate, action)
+        bitboard.undo_action(bb_gamestate, action)
+        assert bitboard.to_gamestate(bb_gamestate) == gamestate
+    assert bb_gamestate == bitboard.init_game()
+
+
+def full_scan_is_over(gamestate: types.GameState):
+    winner = _find_winner(gamestate.board)
+    if winner is None and gamestate.num_moves == BOARD_LENGTH * BOARD_HEIGHT:
+        return "draw"
+    return winner
+
+
+@given(st.lists(st.integers(min_value=0, max_value=BOARD_LENGTH - 1)))
+def test_last_move_is_over_agrees_with_full_scan(columns):
+    gamestate = init_game()
+    actions = []
+    for col in columns:
+        if is_over(gamestate) is not None:
+            break
+        action = (col, gamestate.player)
+        if take_action_mut(gamestate, action) is not None:
+            actions.append(action)
+            assert is_over(gamestate) == full_scan_is_over(gamestate)
+            # cached
+            assert is_over(gamestate) == full_scan_is_over(gamestate)
+
+    # undo_action goes back to a game that wasn't over, which it caches
+    for action in reversed(actions):
+        undo_action(gamestate, action)
+        assert gamestate.result == connect4_rules.ONGOING
+        assert is_over(gamestate) == full_scan_is_over(gamestate)
+
+
+def test_action_codec_round_trips():
+    actions = [(col, p) for p in ["X", "O"] for col in range(BOARD_LENGTH)]
+    codes = [action_to_int(action) for action in actions]
+    assert codes == list(range(2 * BOARD_LENGTH))
+    assert [int_to_action(code) for code in codes] == actions
+
+
+def test_action_prior_agrees_with_order_actions():
+    gamestate = init_game()
+    actions = get_all_actions(gamestate)
+    by_prior = sorted(
+        actions,
+        key=lambda action: -connect4_rules.action_prior(gamestate, action),
+    )
+    assert by_prior == connect4_rules.order_actions(gamestate, actions)
+
+
+@given(st.lists(st.integers(min_value=0, max_value=BOARD_LENGTH - 1)))
+def test_clone_gamestate_is_a_deep_copy(columns):
+    for rules in [connect4_rules, bitboard]:
+        gamestate = rules.init_game()
+        for col in columns:
+            if rules.is_over(gamestate) is not None:
+                break
+            rules.take_action_mut(gamestate, (col, gamestate.player))
+        clone = rules.clone_gamestate(gamestate)
+        assert clone == copy.deepcopy(gamestate)
+        actions = rules.get_all_actions(clone)
+        if rules.is_over(clone) is None and actions:
+            rules.take_action_mut(clone, actions[0])
+            assert clone != gamestate
+
+
+@given(st.lists(st.integers(min_value=0, max_value=BOARD_LENGTH - 1)))
+def test_batch_heuristic_agrees_with_heuristic(columns):
+    gamestate = init_game()
+    for col in columns:
+        if is_over(gamestate) is not None:
+            return
+        take_action_mut(gamestate, (col, gamestate.player))
+    if is_over(gamestate) is not None:
+        return
+    actions = get_all_actions(gamestate)
+    before = copy.deepcopy(gamestate)
+    values = batch_heuristic(gamestate, actions)
+    assert gamestate == before
+    for action, value in zip(actions, values):
+        take_action_mut(gamestate, action)
+        assert heuristic(gamestate) == value
+        undo_action(gamestate, action)
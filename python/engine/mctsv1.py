@@ -1,13 +1,19 @@
+import concurrent.futures
 import copy
+import dataclasses
 import hashlib
 import math
+import multiprocessing
 import random
 import time
 import typing as t
 
+import numpy as np
 import redis
 
 import engine.typesv1 as types
+from engine.sharedtree import SharedTree, SharedTreeLocks, make_locks
+from engine.tree import NO_PARENT, ArrayTree, Handle, Tree, make_tree
 import utils
 
 
@@ -20,8 +26,32 @@ P = t.TypeVar("P")  # player
 
 MAX_STEPS = 10000
 
-ID_LENGTH = 4  # number of bytes in a node id
-assert ID_LENGTH <= 20, "ID_LENGTH must be <= the size of an md5 hash (20)"
+# with config.early_stop, how many walks go between checks of whether the best
+# action can still change
+EARLY_STOP_INTERVAL = 32
+
+# Node ids are 63 bit so they fit in ArrayTree.ids (an int64 array that keeps
+# -1 for unmaterialized slots)
+ID_BITS = 63
+ID_MASK = (1 << ID_BITS) - 1
+
+_MASK64 = (1 << 64) - 1
+_GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+
+
+def mix_node_id(parent_id: int, action_key: int, attempt: int = 0) -> int:
+    """
+    Id of the child of <parent_id> reached by the action with <action_key>
+    (the splitmix64 finalizer of the two combined). Only depends on its
+    arguments, so every engineserver computes the same ids. <attempt> > 0
+    gives the next ids to try after a collision
+    """
+    z = (
+        (parent_id * _GOLDEN_GAMMA) ^ (action_key + 1 + (attempt << 32))
+    ) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return (z ^ (z >> 31)) & ID_MASK
 
 
 class Engine(t.Generic[G, A, P]):
@@ -33,145 +63,781 @@ class Engine(t.Generic[G, A, P]):
         self.config = config
         self.root_gamestate = gamestate
 
-        self.root_node = types.Node(
-            id=0,
-            parent_id=-1,
-            times_visited=0,
-            score_vec={p: 0 for p in self.config.players},
-        )
-        self.tree = types.Tree(
-            nodes={self.root_node.id: self.root_node}, edges={}
-        )
+        # players are stored by index in the tree
+        self.player_index = self.config.player_index
+
+        # share statistics between nodes that reach the same gamestate
+        self.transpositions = self.config.hash_gamestate is not None
+        if self.transpositions and self.config.tree_type != "array":
+            raise NotImplementedError(
+                "transpositions are only implemented for tree_type array"
+            )
+        if self.config.n_workers > 1 and self.config.parallelism not in [
+            "root",
+            "tree",
+        ]:
+            raise Exception(f"Invalid parallelism {self.config.parallelism}")
+        if self.config.parallelism == "tree" and (
+            self.transpositions or self.config.widening_k is not None
+        ):
+            raise NotImplementedError(
+                "transpositions and progressive widening are not implemented "
+                "for tree parallelism"
+            )
+        if (
+            self.config.n_workers > 1
+            and self.config.parallelism == "root"
+            and self.config.early_stop
+        ):
+            # the workers would have to start a new tree for every check
+            raise NotImplementedError(
+                "early_stop is not implemented for root parallelism"
+            )
+
+        if self.config.scratch_state and self.config.undo_action is None:
+            raise Exception("scratch_state needs undo_action")
+        self._clone = self.config.clone_gamestate or copy.deepcopy
+        self._debug_level = self.config.debug_level
+        # (decoded) actions the current walk took, for undoing them
+        self._action_stack: t.List[A] = []
+
+        # the tree and walk logs hold actions as returned by _encode. Rules
+        # and callers of ponder/advance get them back from _decode
+        if self.config.action_to_int is None:
+            self._encode = self._decode = _identity
+        else:
+            self._encode = self.config.action_to_int
+            self._decode = self.config.int_to_action
+
+        # started on the first parallel ponder, together with the event that
+        # tells its workers to stop walking
+        self._pool: t.Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._stop: t.Any = None  # multiprocessing.Event
+        # tree parallelism only. Lives until the root changes
+        self._shared_tree: t.Optional[SharedTree] = None
+
+        self.reset(gamestate)
 
         self.n_walks_produced = 0
         self.n_walks_consumed = 0
+        # child ids that were already taken when they were computed, and walk
+        # results that were dropped because they went through a node whose id
+        # another engineserver uses for a different node
+        self.n_id_collisions = 0
+        self.n_walks_dropped = 0
+
+        self._profile = self.config.profile
+        self._phases = {name: types.PhaseStats() for name in types.PHASES}
+        self._ponder_seconds = 0.0
+        self._interrupted = False
 
     def ponder(
         self,
-        n_walks: int,
+        n_walks: t.Optional[int] = None,
+        nseconds: t.Optional[float] = None,
     ) -> t.Tuple[t.List[types.WalkLog], A]:
+        """
+        Walk until <n_walks> walks are done or <nseconds> seconds have passed,
+        whichever comes first. The walk logs are only returned if
+        config.record_walk_logs. With config.early_stop the search also ends as
+        soon as the best action can't change in the walks that are left. A
+        call to interrupt() (e.g. from another thread) ends it after the
+        current walk. Either way the best action so far is returned.
+        """
+        if n_walks is None and nseconds is None:
+            raise Exception("ponder needs n_walks or nseconds")
+
+        if self.config.n_workers > 1:
+            # walk logs stay in the workers
+            start = time.perf_counter()
+            action = self._ponder_parallel(n_walks, nseconds)
+            self._ponder_seconds += time.perf_counter() - start
+            self._interrupted = False
+            return [], action
 
+        start = time.perf_counter()
+        deadline = None if nseconds is None else start + nseconds
         walk_logs = []
-        for _ in range(n_walks):
+        n_done = 0
+        while not self._interrupted:
+            if n_walks is not None and n_done >= n_walks:
+                break
+            now = time.perf_counter()
+            if deadline is not None and now >= deadline:
+                break
+            if (
+                self.config.early_stop
+                and n_done > 0
+                and n_done % EARLY_STOP_INTERVAL == 0
+                and self._stops_early(
+                    n_done,
+                    n_walks,
+                    now - start,
+                    None if deadline is None else deadline - now,
+                )
+            ):
+                break
             walk_log = self._walk()
-            walk_logs.append(walk_log)
+            if walk_log is not None:
+                walk_logs.append(walk_log)
+            n_done += 1
+        self._ponder_seconds += time.perf_counter() - start
+        # cleared on the way out rather than on the way in, so an interrupt
+        # that comes before ponder starts (or between two ponders) isn't lost
+        self._interrupted = False
 
         action = self._pick_best_action(
-            self.tree, self.root_gamestate.player, self.root_node.id
+            self.tree, self.root_gamestate.player, self.tree.root
         )
 
         return walk_logs, action
 
+    def interrupt(self):
+        """
+        Make a running ponder return after the walk it's on (after the walk
+        each worker is on with config.n_workers > 1). If no ponder is
+        running, the next one returns right away
+        """
+        self._interrupted = True
+        if self._stop is not None:
+            self._stop.set()
+
+    def stats(self) -> types.EngineStats:
+        """ Snapshot of the engine's counters (see types.EngineStats) """
+        return types.EngineStats(
+            phases={
+                name: dataclasses.replace(phase)
+                for name, phase in self._phases.items()
+            },
+            n_walks_produced=self.n_walks_produced,
+            n_walks_consumed=self.n_walks_consumed,
+            tree_size=len(self.tree),
+            max_depth=self._max_depth,
+            ponder_seconds=self._ponder_seconds,
+        )
+
+    def _record(self, phase: str, start: float):
+        """ Add the time since <start> to <phase> """
+        stats = self._phases[phase]
+        stats.seconds += time.perf_counter() - start
+        stats.calls += 1
+
+    def _stops_early(
+        self,
+        n_done: int,
+        n_walks: t.Optional[int],
+        elapsed: float,
+        time_left: t.Optional[float],
+    ) -> bool:
+        """
+        Whether config.early_stop ends a ponder that did <n_done> walks in
+        <elapsed> seconds, with a budget of <n_walks> walks and <time_left>
+        seconds left
+        """
+        remaining = math.inf
+        if n_walks is not None:
+            remaining = n_walks - n_done
+        if time_left is not None:
+            rate = n_done / max(elapsed, 1e-9)
+            remaining = min(remaining, rate * time_left)
+        return self._best_action_decided(remaining)
+
+    def _best_action_decided(self, remaining: float) -> bool:
+        """
+        Whether the most visited child of the root stays the most visited
+        after <remaining> more walks, even if all of them went to the runner
+        up
+        """
+        tree, root = self.tree, self.tree.root
+        if not tree.is_expanded(root) or tree.num_children(root) == 0:
+            return False
+        if tree.num_children(root) == 1:
+            return True
+        # children that aren't materialized haven't been visited
+        visits = sorted(
+            [tree.visits(tree.resolve(c)) for c, _ in tree.children(root)]
+            + [0, 0],
+            reverse=True,
+        )
+        return visits[0] - visits[1] > remaining
+
+    def close(self):
+        """ Shut down the worker pool and free the shared tree, if any """
+        self._drop_shared_tree()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _start_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._pool is None:
+            self._locks = make_locks()
+            self._stop = multiprocessing.Event()
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                self.config.n_workers,
+                initializer=_init_worker,
+                initargs=(self._locks, self._stop),
+            )
+        return self._pool
+
+    def _ponder_parallel(
+        self, n_walks: t.Optional[int], nseconds: t.Optional[float]
+    ) -> A:
+        """
+        ponder on the worker pool. Workers get a wall clock deadline since
+        they don't share a perf_counter, and stop between walks once
+        self._stop is set. With config.early_stop the walks are handed out
+        in batches of EARLY_STOP_INTERVAL per worker, with the check after
+        each batch
+        """
+        self._start_pool()
+        if self._interrupted:
+            # interrupt() came before there was an event to set
+            self._stop.set()
+        start = time.time()
+        deadline = None if nseconds is None else start + nseconds
+        batch = None
+        if self.config.early_stop:
+            batch = EARLY_STOP_INTERVAL * self.config.n_workers
+        n_before = self.n_walks_produced
+        while True:
+            n_done = self.n_walks_produced - n_before
+            share = None if n_walks is None else n_walks - n_done
+            if batch is not None:
+                share = batch if share is None else min(share, batch)
+            if self.config.parallelism == "tree":
+                action = self._ponder_tree_parallel(share, deadline)
+            else:
+                action = self._ponder_root_parallel(share, deadline)
+            n_done = self.n_walks_produced - n_before
+            now = time.time()
+            if (
+                batch is None
+                or self._stop.is_set()
+                or (n_walks is not None and n_done >= n_walks)
+                or (deadline is not None and now >= deadline)
+                or self._stops_early(
+                    n_done,
+                    n_walks,
+                    now - start,
+                    None if deadline is None else deadline - now,
+                )
+            ):
+                break
+        self._stop.clear()
+        return action
+
+    def _shares(self, n_walks: t.Optional[int]) -> t.List[t.Optional[int]]:
+        """ Number of walks for each worker (None means no limit) """
+        n_workers = self.config.n_workers
+        if n_walks is None:
+            return [None] * n_workers
+        shares = [
+            n_walks // n_workers + int(i < n_walks % n_workers)
+            for i in range(n_workers)
+        ]
+        return [share for share in shares if share > 0]
+
+    def _ponder_root_parallel(
+        self, n_walks: t.Optional[int], deadline: t.Optional[float]
+    ) -> A:
+        """
+        Split <n_walks> over config.n_workers processes, which stop at
+        <deadline> (a time.time()) if they haven't finished by then. Every
+        worker grows a tree of its own from the root with its own seed and
+        sends back the statistics of the root and its children, which are
+        added to this engine's tree before picking an action.
+        """
+        pool = self._start_pool()
+        futures = [
+            pool.submit(
+                _search_root,
+                self.config,
+                self.root_gamestate,
+                share,
+                deadline,
+                random.getrandbits(64),
+            )
+            for share in self._shares(n_walks)
+        ]
+        for future in futures:
+            visits, scores = future.result()
+            self._merge_root_stats(visits, scores)
+            self.n_walks_produced += int(visits[0])
+
+        return self._pick_best_action(
+            self.tree, self.root_gamestate.player, self.tree.root
+        )
+
+    def _ponder_tree_parallel(
+        self, n_walks: t.Optional[int], deadline: t.Optional[float]
+    ) -> A:
+        """
+        Split <n_walks> over config.n_workers processes that all walk the same
+        shared tree (until <deadline>, like _ponder_root_parallel). The shared
+        tree is kept between calls (until the root changes). What this call
+        added to the root and its children is added to this engine's tree
+        before picking an action.
+        """
+        pool = self._start_pool()
+        if self._shared_tree is None:
+            self._shared_tree = SharedTree.create(
+                self.config.shared_tree_capacity,
+                len(self.config.players),
+                self._locks,
+                self.config.virtual_loss,
+            )
+        before_visits, before_scores = self._shared_tree.root_stats()
+        futures = [
+            pool.submit(
+                _search_shared_tree,
+                self._shared_tree.name,
+                self.config,
+                self.root_gamestate,
+                share,
+                deadline,
+                random.getrandbits(64),
+            )
+            for share in self._shares(n_walks)
+        ]
+        for future in futures:
+            future.result()
+
+        visits, scores = self._shared_tree.root_stats()
+        if len(visits) == 1 and visits[0] == before_visits[0]:
+            # no walk on this shared tree finished yet (the deadline came
+            # first), so the root isn't expanded and there is nothing to
+            # merge or to pick from
+            return next(iter(self.config.get_all_actions(self.root_gamestate)))
+        visits[: len(before_visits)] -= before_visits
+        scores[: len(before_scores)] -= before_scores
+        self._merge_root_stats(visits, scores)
+        self.n_walks_produced += int(visits[0])
+
+        return self._pick_best_action(
+            self.tree, self.root_gamestate.player, self.tree.root
+        )
+
+    def _merge_root_stats(self, visits: np.ndarray, scores: np.ndarray):
+        """
+        Add statistics gathered by workers to the root (row 0 of <visits> and
+        <scores>) and its children (the remaining rows, in get_all_actions
+        order)
+        """
+        tree, root = self.tree, self.tree.root
+        self._materialize_root()
+        children = tree.children(root)
+        assert len(visits) == 1 + len(children)
+        tree.add_stats(root, int(visits[0]), scores[0].tolist())
+        for (child, _), child_visits, child_scores in zip(
+            children, visits[1:], scores[1:]
+        ):
+            tree.add_stats(
+                tree.resolve(child), int(child_visits), child_scores.tolist()
+            )
+
+    def _materialize_root(self):
+        """ Expand the root and materialize all of its children """
+        tree, root = self.tree, self.tree.root
+        gamestate = self._clone(self.root_gamestate)
+        if not tree.is_expanded(root):
+            self._expand([], root, gamestate)
+        for k in range(tree.num_children(root)):
+            if not tree.is_materialized(tree.child(root, k)[0]):
+                self._materialize([], root, k, gamestate)
+
+    def _drop_shared_tree(self):
+        if self._shared_tree is not None:
+            self._shared_tree.unlink()
+            self._shared_tree = None
+
+    def reset(self, gamestate: G):
+        """ Throw away the tree and start searching from <gamestate> """
+        self._drop_shared_tree()
+        self.root_gamestate = gamestate
+        # with config.scratch_state, the gamestate walks are made on. Made
+        # from the root's gamestate on the first walk
+        self._scratch: t.Optional[G] = None
+        # deepest walk since the root changed (for stats)
+        self._max_depth = 0
+        # the first reset (from __init__) has no tree to recycle yet
+        self.tree: Tree = make_tree(
+            self.config.tree_type,
+            self.config.players,
+            reuse=getattr(self, "tree", None),
+        )
+        # ids of nodes in walk logs of other engineservers that collide with
+        # the id of a different node here
+        self._foreign_collisions: t.Set[types.NodeId] = set()
+        if self.transpositions:
+            self._array_tree().transpose(
+                self.tree.root, self.config.hash_gamestate(gamestate)
+            )
+
+    def _array_tree(self) -> ArrayTree:
+        """
+        self.tree, for what only ArrayTree has (lazy children, transpositions)
+        """
+        assert isinstance(self.tree, ArrayTree), "needs tree_type array"
+        return self.tree
+
+    def advance(self, actions: t.List[A]) -> bool:
+        """
+        Move the root down the tree along <actions>. The subtree under the new
+        root (and its statistics) is kept and the rest of the tree is freed.
+        If the new root was never added to the tree a fresh tree is started.
+        Returns whether the subtree was reused.
+        """
+        return self._advance([self._encode(action) for action in actions])
+
+    def _advance(self, actions: t.List[t.Any]) -> bool:
+        """ advance with actions as the tree holds them """
+        tree = self.tree
+        gamestate = self._clone(self.root_gamestate)
+        node = tree.root
+        for action in actions:
+            if node is not None:
+                node = tree.resolve(node)
+            if node is not None and tree.is_expanded(node):
+                node = next(
+                    (
+                        child
+                        for (child, child_action) in tree.children(node)
+                        if child_action == action
+                    ),
+                    None,
+                )
+            else:
+                node = None
+            gamestate = self.config.take_action_mut(
+                gamestate, self._decode(action)
+            )
+            assert gamestate is not None, f"Invalid action {action}"
+
+        if node is None:
+            self.reset(gamestate)
+            return False
+        tree.reroot(node, self._child_id)
+        # ids changed
+        self._foreign_collisions = set()
+        self.root_gamestate = gamestate
+        self._scratch = None
+        self._max_depth = 0
+        self._drop_shared_tree()
+        return True
+
+    def advance_to(self, gamestate: G, max_depth: int = 2) -> bool:
+        """
+        Like advance, but finds the actions by looking for <gamestate> at most
+        <max_depth> actions below the root. Returns whether the subtree was
+        reused.
+        """
+        actions = self._find_actions(gamestate, max_depth)
+        if actions is None:
+            self.reset(self._clone(gamestate))
+            return False
+        return self._advance(actions)
+
+    def _find_actions(
+        self, target: G, max_depth: int
+    ) -> t.Optional[t.List[t.Any]]:
+        tree = self.tree
+        hash_gamestate = self.config.hash_gamestate
+        target_hash = (
+            None if hash_gamestate is None else hash_gamestate(target)
+        )
+
+        def search(node: Handle, gamestate: G, depth: int):
+            # comparing hashes first saves most of the deep comparisons
+            if (
+                target_hash is None or hash_gamestate(gamestate) == target_hash
+            ) and gamestate == target:
+                return []
+            node = tree.resolve(node)
+            if depth == max_depth or not tree.is_expanded(node):
+                return None
+            for child, action in tree.children(node):
+                child_gamestate = self.config.take_action_mut(
+                    self._clone(gamestate), self._decode(action)
+                )
+                actions = search(child, child_gamestate, depth + 1)
+                if actions is not None:
+                    return [action] + actions
+            return None
+
+        return search(tree.root, self.root_gamestate, 0)
+
     def consume_walk_log(self, walk_log: types.WalkLog):
+        if self._profile:
+            start = time.perf_counter()
+            self._consume_walk_log(walk_log)
+            self._record("consume", start)
+        else:
+            self._consume_walk_log(walk_log)
+
+    def _consume_walk_log(self, walk_log: types.WalkLog):
+        tree = self.tree
         for item in walk_log:
             if item["event-type"] == "new-node":
-                if item["id"] in self.tree.nodes:
+                if item["parent_id"] in self._foreign_collisions:
+                    # the other engineserver's subtree under a colliding id
+                    # isn't ours, and neither are the ids in it
+                    self._foreign_collisions.add(item["id"])
                     continue
-                else:
-                    self._new_node(
-                        id=item["id"],
-                        parent_id=item["parent_id"],
-                        action=item["action"],
-                    )
+                if (existing := tree.handle(item["id"])) is not None:
+                    if not self._is_same_node(existing, item):
+                        self._foreign_collisions.add(item["id"])
+                    continue
+                parent = tree.handle(item["parent_id"])
+                if "slot" in item:
+                    self._consume_materialized(item, tree.resolve(parent))
+                    continue
+                if self.transpositions:
+                    # other engineservers may have picked a different
+                    # canonical node for this position, in which case we
+                    # already have this child under another id
+                    array_tree = self._array_tree()
+                    parent = array_tree.resolve(parent)
+                    if array_tree.is_expanded(parent) and (
+                        child := array_tree.find_child(parent, item["action"])
+                    ) is not None:
+                        array_tree.alias(item["id"], child)
+                        continue
+                tree.new_node(
+                    id=item["id"],
+                    parent=parent,
+                    action=item["action"],
+                )
 
             elif item["event-type"] == "walk-result":
-                node = self.tree.nodes[item["node_id"]]
-                self._backup(node, item["score_vec"])
+                ids = item.get("path", [item["node_id"]])
+                if self._foreign_collisions.intersection(ids):
+                    self.n_walks_dropped += 1
+                    continue
+                path = [tree.resolve(tree.handle(id)) for id in ids]
+                self._backup(path, item["scores"])
                 self.n_walks_consumed += 1
             else:
                 utils.assert_never(
                     f"Unknown walk_log event-type {item['event-type']}"
                 )
 
-    def _new_node(self, id, parent_id, action, previsit_heuristic_val=None):
+    def _is_same_node(self, node: Handle, item: t.Dict[str, t.Any]) -> bool:
         """
-        This method temporarily brakes the invariant that a node either has all
-        it's children in teh tree or none of it's children (with None)
+        Whether the new-node event <item> is about <node>, which already has
+        its id. Otherwise the other engineserver's id collided with ours
         """
-        nodes, edges = self.tree.nodes, self.tree.edges
-        child_node = types.Node(
-            id=id,
-            parent_id=parent_id,
-            times_visited=0,
-            score_vec={p: 0 for p in self.config.players},
-            heuristic_val=previsit_heuristic_val,
+        tree = self.tree
+        if tree.node_id(node) != item["id"]:
+            # an id another engineserver gave a transposition of node
+            return True
+        parent = tree.parent(node)
+        return (
+            parent != NO_PARENT and tree.node_id(parent) == item["parent_id"]
         )
-        assert (
-            child_node.id not in nodes
-        ), f"nnodes {len(self.tree.nodes)} id {child_node.id}"
-        nodes[child_node.id] = child_node
-        # TODO: is this safe? We want to maintain the invariant that either all
-        # of a nodes children are in the tree or children(parent) = None
-        edges.setdefault(parent_id, [])
-        edges[parent_id].append((child_node.id, action))
-        return child_node
-
-    def _walk(self) -> types.WalkLog:
-        gamestate = copy.deepcopy(self.root_gamestate)
-        walk_log = []  # walk log will be mutated
-        node = self._tree_policy(walk_log, gamestate)
-        score_vec = self._rollout(node, walk_log, gamestate)
-        self._backup(node, score_vec)
-        gamestate = self._restore_gamestate(gamestate, walk_log)
-        assert gamestate == self.root_gamestate
+
+    def _consume_materialized(self, item: t.Dict[str, t.Any], parent: Handle):
+        """ new-node event of a child that was materialized lazily """
+        tree = self._array_tree()
+        if not tree.is_expanded(parent):
+            heuristic_val = item.get("heuristic_val")
+            tree.reserve(
+                parent,
+                item["n_children"],
+                None
+                if heuristic_val is None
+                else types.HeuristicVal(*heuristic_val),
+            )
+        child = tree.child_range(parent)[0] + item["slot"]
+        if tree.is_materialized(child):
+            # with transpositions another engineserver may know this child
+            # under a different id
+            tree.alias(item["id"], child)
+        else:
+            tree.materialize(child, item["id"], item["action"])
+
+    def _walk(self) -> t.Optional[types.WalkLog]:
+        if self.config.scratch_state:
+            # taken while the walk runs, so a walk that raises doesn't leave a
+            # half walked scratch state behind
+            gamestate, self._scratch = self._scratch, None
+            if gamestate is None:
+                gamestate = self._clone(self.root_gamestate)
+        else:
+            gamestate = self._clone(self.root_gamestate)
+        # walk log will be mutated. None when nothing is recorded
+        walk_log = [] if self.config.record_walk_logs else None
+        self._action_stack.clear()
+        if self._profile:
+            gamestate = self._profiled_walk(walk_log, gamestate)
+        else:
+            path = self._tree_policy(walk_log, gamestate)
+            scores = self._rollout(path, walk_log, gamestate)
+            self._backup(path, scores)
+            if self.config.scratch_state or self._debug_level >= 2:
+                gamestate = self._restore_gamestate(gamestate)
+        if self._debug_level >= 2:
+            assert gamestate == self.root_gamestate
+        if self.config.scratch_state:
+            self._scratch = gamestate
         self.n_walks_produced += 1
         return walk_log
 
+    def _profiled_walk(
+        self, walk_log: t.Optional[types.WalkLog], gamestate: G
+    ) -> G:
+        """ The phases of _walk, timed """
+        phases = self._phases
+        start = time.perf_counter()
+        expansion_seconds = phases["expansion"].seconds
+        path = self._tree_policy(walk_log, gamestate)
+        self._record("selection", start)
+        # expansions happen inside the tree policy
+        phases["selection"].seconds -= (
+            phases["expansion"].seconds - expansion_seconds
+        )
+        self._max_depth = max(self._max_depth, len(path) - 1)
+
+        start = time.perf_counter()
+        scores = self._rollout(path, walk_log, gamestate)
+        self._record("rollout", start)
+
+        start = time.perf_counter()
+        self._backup(path, scores)
+        self._record("backup", start)
+
+        if self.config.scratch_state or self._debug_level >= 2:
+            start = time.perf_counter()
+            gamestate = self._restore_gamestate(gamestate)
+            self._record("restore", start)
+        return gamestate
+
     def _tree_policy(
         self,
-        walk_log: types.WalkLog,
+        walk_log: t.Optional[types.WalkLog],
         gamestate: G,
-    ) -> types.Node[A]:
-        nodes, edges = self.tree.nodes, self.tree.edges
+    ) -> t.List[Handle]:
+        """
+        Walk down from the root and return the path taken (root first, leaf
+        last). Mutates gamestate to be the gamestate at the leaf.
+        """
+        tree = self.tree
 
-        ucb_fn = {
-            None: _ucb_basic,
-            "pre-visit": _ucb_with_pre_visit_heuristic,
-            "simple": _ucb_with_simple_heuristic,
-        }[self.config.heuristic_type]
+        # ArrayTree scores all children of a node in one numpy operation,
+        # DictTree falls back to scoring children one at a time
+        vectorized = isinstance(tree, ArrayTree)
+        if vectorized:
+            ucb_fn = UCB_VECTORIZED_FNS[self.config.heuristic_type]
+        else:
+            ucb_fn = UCB_FNS[self.config.heuristic_type]
 
-        node = self.root_node
+        node = tree.root
+        path = [node]
         for _ in range(MAX_STEPS):
-            # If node hasn't been expanded, expand it
-            if edges.get(node.id) is None:
-                self._expand(walk_log, node, gamestate)
-                assert edges.get(node.id) is not None
-                child_nodes = [
-                    nodes[child_id] for (child_id, _) in edges[node.id]
-                ]
-                if len(child_nodes) == 0:
-                    return node
-                return random.choice(child_nodes)
+            # If node hasn't been expanded, expand it and step into a random
+            # child
+            if not tree.is_expanded(node):
+                if self._profile:
+                    start = time.perf_counter()
+                    self._expand(walk_log, node, gamestate)
+                    self._record("expansion", start)
+                else:
+                    self._expand(walk_log, node, gamestate)
+                n_children = self._num_selectable(node)
+                if n_children == 0:
+                    return path
+                child, action = self._child(
+                    walk_log, node, random.randrange(n_children), gamestate
+                )
+                path.append(self._step(walk_log, gamestate, child, action))
+                return path
 
-            children = edges[node.id]
+            n_children = self._num_selectable(node)
 
             # if this is a terminal node, return it
-            if children == []:
-                return node
+            if n_children == 0:
+                return path
 
             # otherwise walk down the tree via ucb
             if gamestate.player == "environment":
-                child_id, action = random.choice(children)
+                k = random.randrange(n_children)
+            elif vectorized:
+                player = self.player_index[gamestate.player]
+                ucb = ucb_fn(self.config.C, tree, node, player)
+                k = int(np.argmax(ucb[:n_children]))
             else:
-                child_id, action = max(
-                    children,
-                    key=lambda child_id_action: ucb_fn(
+                player = self.player_index[gamestate.player]
+                k = max(
+                    range(n_children),
+                    key=lambda k: ucb_fn(
                         self.config.C,
-                        self.tree,
-                        nodes[child_id_action[0]],
-                        gamestate.player,
+                        tree,
+                        tree.child(node, k)[0],
+                        player,
                     ),
                 )
-            assert nodes.get(child_id) is not None
-            walk_log.append({"event-type": "take-action", "action": action})
-            gamestate = self.config.take_action_mut(gamestate, action)
-            node = nodes[child_id]
+            child, action = self._child(walk_log, node, k, gamestate)
+            node = self._step(walk_log, gamestate, child, action)
+            path.append(node)
         raise Exception(f"tree_policy exceeded {MAX_STEPS} steps")
 
+    def _num_selectable(self, node: Handle) -> int:
+        """
+        How many of <node>'s children selection may choose from (the first
+        ones), which progressive widening limits by <node>'s visit count
+        """
+        n_children = self.tree.num_children(node)
+        if self.config.widening_k is None or n_children == 0:
+            return n_children
+        n_allowed = math.ceil(
+            self.config.widening_k
+            * self.tree.visits(node) ** self.config.widening_alpha
+        )
+        return min(n_children, max(1, n_allowed))
+
+    def _get_actions(self, node: Handle, gamestate: G) -> t.List[t.Any]:
+        """
+        Encoded actions of <gamestate> (the gamestate at <node>) in the order
+        of <node>'s children. The order only depends on the gamestate and the
+        node id, so consumers of walk logs can recompute it
+        """
+        actions = list(self.config.get_all_actions(gamestate))
+        if self.config.widening_k is not None:
+            if self.config.action_prior is None:
+                random.Random(self.tree.node_id(node)).shuffle(actions)
+            else:
+                priors = [
+                    self.config.action_prior(gamestate, a) for a in actions
+                ]
+                order = sorted(range(len(actions)), key=lambda i: -priors[i])
+                actions = [actions[i] for i in order]
+        return [self._encode(action) for action in actions]
+
+    def _step(
+        self,
+        walk_log: t.Optional[types.WalkLog],
+        gamestate: G,
+        child: Handle,
+        action: A,
+    ) -> Handle:
+        """
+        Take <action> (the action leading to <child>) and return the node
+        that statistics for the new gamestate are kept on
+        """
+        if walk_log is not None:
+            walk_log.append({"event-type": "take-action", "action": action})
+        action = self._decode(action)
+        self._action_stack.append(action)
+        self.config.take_action_mut(gamestate, action)
+        if self.transpositions:
+            return self._array_tree().transpose(
+                child, self.config.hash_gamestate(gamestate)
+            )
+        return child
+
     def _expand(
         self,
-        walk_log: types.WalkLog,
-        node: types.Node,
+        walk_log: t.Optional[types.WalkLog],
+        node: Handle,
         gamestate: G,
     ):
         """
@@ -179,70 +845,159 @@ class Engine(t.Generic[G, A, P]):
         children already (i.e. called once per node. Different definition than
         definition of expand in wikipedia
         """
-
-        assert self.tree.edges.get(node.id) is None
-        self.tree.edges[node.id] = []
-
+        tree = self.tree
         if self.config.is_over(gamestate) is not None:
+            actions = []
+        else:
+            actions = self._get_actions(node, gamestate)
+        heuristic_val = (
+            None
+            if self.config.heuristic_type is None or len(actions) == 0
+            else types.HeuristicVal(5 * self.config.heuristic(gamestate), 5)
+        )
+
+        if isinstance(tree, ArrayTree):
+            # children are materialized when a walk first steps into them
+            tree.reserve(node, len(actions), heuristic_val, actions)
             return
 
-        for action in self.config.get_all_actions(gamestate):
-            m = hashlib.md5()  # parent id
-            m.update(int.to_bytes(node.id, ID_LENGTH, "big"))
-            m.update(self.config.encode_action(action).encode())
-            id = int.from_bytes(m.digest()[:ID_LENGTH], "big")
+        tree.set_expanded(node)
+        node_id = tree.node_id(node)
+        for action in actions:
+            id = self._new_child_id(node_id, action)
+            tree.new_node(id, node, action, heuristic_val)
 
-            child_node = self._new_node(
-                id,
-                node.id,
-                action,
-                (
-                    None
-                    if self.config.heuristic_type is None
-                    else types.HeuristicVal(
-                        5 * self.config.heuristic(gamestate), 5
-                    )
-                ),
-            )
+            if walk_log is not None:
+                walk_log.append(
+                    {
+                        "event-type": "new-node",
+                        "id": id,
+                        "parent_id": node_id,
+                        "action": action,
+                    }
+                )
 
-            walk_log.append(
-                {
-                    "event-type": "new-node",
-                    "id": child_node.id,
-                    "parent_id": child_node.parent_id,
-                    "action": action,
-                }
-            )
+    def _child(
+        self,
+        walk_log: t.Optional[types.WalkLog],
+        node: Handle,
+        k: int,
+        gamestate: G,
+    ) -> t.Tuple[Handle, A]:
+        """ k-th child of <node> (at <gamestate>), materialized if needed """
+        child, action = self.tree.child(node, k)
+        if not self.tree.is_materialized(child):
+            return self._materialize(walk_log, node, k, gamestate)
+        return child, action
+
+    def _materialize(
+        self,
+        walk_log: t.Optional[types.WalkLog],
+        node: Handle,
+        k: int,
+        gamestate: G,
+    ) -> t.Tuple[Handle, A]:
+        """
+        Give the k-th child slot of <node> (at <gamestate>) its id and action.
+        The new-node event carries the slot and the number of slots so that
+        consumers can reserve the same slots
+        """
+        tree = self._array_tree()
+        child, action = tree.child(node, k)
+        if action is None:
+            # reserved by consume_walk_log, which only knows the slots that
+            # were materialized elsewhere
+            tree.set_slot_actions(node, self._get_actions(node, gamestate))
+            child, action = tree.child(node, k)
+        node_id = tree.node_id(node)
+        id = self._new_child_id(node_id, action)
+        tree.materialize(child, id, action)
+        if walk_log is None:
+            return child, action
+
+        event = {
+            "event-type": "new-node",
+            "id": id,
+            "parent_id": node_id,
+            "action": action,
+            "slot": k,
+            "n_children": tree.num_children(node),
+        }
+        if tree.prior_den[child] > 0:
+            event["heuristic_val"] = [
+                float(tree.prior_num[child]),
+                int(tree.prior_den[child]),
+            ]
+        walk_log.append(event)
+        return child, action
+
+    def _child_id(
+        self, parent_id: types.NodeId, action: A, attempt: int = 0
+    ) -> types.NodeId:
+        return mix_node_id(parent_id, self._action_key(action), attempt)
+
+    def _new_child_id(
+        self, parent_id: types.NodeId, action: A
+    ) -> types.NodeId:
+        """
+        Id for a new child. If the id is taken by another node (or an alias),
+        the next attempt of _child_id is used instead
+        """
+        attempt = 0
+        id = self._child_id(parent_id, action)
+        while self.tree.handle(id) is not None:
+            self.n_id_collisions += 1
+            attempt += 1
+            id = self._child_id(parent_id, action, attempt)
+        return id
+
+    def _action_key(self, action: t.Any) -> int:
+        """
+        Integer that node ids are mixed from, for <action> as the tree holds
+        it (see _encode)
+        """
+        if self.config.action_to_int is not None:
+            return action  # already an action code
+        # no codec, hash the action's string encoding
+        digest = hashlib.md5(self.config.encode_action(action).encode())
+        return int.from_bytes(digest.digest()[:8], "big")
 
     def _rollout(
         self,
-        node: types.Node[A],
-        walk_log: types.WalkLog,
+        path: t.List[Handle],
+        walk_log: t.Optional[types.WalkLog],
         gamestate: G,
-    ) -> types.ScoreVec:
+    ) -> types.Scores:
+        node = path[-1]
         if self.config.rollout_policy is not None:
-            score_vec = self.config.rollout_policy(gamestate)
+            scores = _to_scores(
+                self.config, self.config.rollout_policy(gamestate)
+            )
         else:
             winning_player = self._simulate(walk_log, node, gamestate)
-            score_vec = (
-                self.config.get_final_score(gamestate)
-                if self.config.get_final_score is not None
-                else {p: int(p == winning_player) for p in self.config.players}
-            )
-        assert set(score_vec.keys()) == set(self.config.players)
-        walk_log.append(
-            {
-                "event-type": "walk-result",
-                "score_vec": score_vec,
-                "node_id": node.id,
-            }
-        )
-        return score_vec
+            if self.config.get_final_score is not None:
+                scores = _to_scores(
+                    self.config, self.config.get_final_score(gamestate)
+                )
+            else:
+                scores = _win_scores(self.config, winning_player)
+        if walk_log is None:
+            return scores
+        walk_result = {
+            "event-type": "walk-result",
+            "scores": scores,
+            "node_id": self.tree.node_id(node),
+        }
+        if self.transpositions:
+            # parent pointers don't give the path in a DAG
+            walk_result["path"] = [self.tree.node_id(n) for n in path]
+        walk_log.append(walk_result)
+        return scores
 
     def _simulate(
         self,
-        walk_log: types.WalkLog,
-        node: types.Node[A],
+        walk_log: t.Optional[types.WalkLog],
+        node: Handle,
         gamestate: G,
     ) -> P:
         # TODO: add decisive move heuristic
@@ -252,98 +1007,344 @@ class Engine(t.Generic[G, A, P]):
                 raise Exception(f"Simulate exceeded {MAX_STEPS} steps")
             action = random.choice(self.config.get_all_actions(gamestate))
             self.config.take_action_mut(gamestate, action)
-            walk_log.append({"event-type": "take-action", "action": action})
+            self._action_stack.append(action)
+            if walk_log is not None:
+                walk_log.append(
+                    {
+                        "event-type": "take-action",
+                        "action": self._encode(action),
+                    }
+                )
             c += 1
-        assert self.config.is_over(gamestate) is not None
         return result
 
     def _backup(
         self,
-        node: types.Node,
-        score_vec: types.ScoreVec,
+        path: t.List[Handle],
+        scores: types.Scores,
     ):
         """ Update node statistics """
-        assert all(0 <= v <= 1 for v in score_vec.values())
-        assert set(score_vec.keys()) == set(self.config.players)
-        while node is not None:
-            node.times_visited += 1
-            for key, val in score_vec.items():
-                node.score_vec[key] += val
-
-            node = self.tree.nodes.get(node.parent_id)
+        if self._debug_level >= 1:
+            assert len(scores) == len(self.config.players)
+            assert all(0 <= v <= 1 for v in scores)
+        if self.transpositions:
+            self._array_tree().backup_path(path, scores)
+        else:
+            self.tree.backup(path[-1], scores)
 
-    def _restore_gamestate(
-        self,
-        current_gamestate: G,
-        walk_log: types.WalkLog,
-    ):
+    def _restore_gamestate(self, current_gamestate: G) -> G:
         if self.config.undo_action is not None:
-            actions = [
-                entry["action"]
-                for entry in walk_log
-                if entry["event-type"] == "take-action"
-            ]
-            for action in reversed(actions):
+            for action in reversed(self._action_stack):
                 self.config.undo_action(current_gamestate, action)
             return current_gamestate
         else:
-            return copy.deepcopy(self.root_gamestate)
+            return self._clone(self.root_gamestate)
+
+    def _pick_best_action(self, tree: Tree, player: P, root: Handle) -> A:
+        if self.config.early_stop:
+            # the early stopping rule is about visit counts, so pick the child
+            # it reasoned about
+            _, action = max(
+                (
+                    (tree.visits(tree.resolve(child)), action)
+                    for child, action in tree.children(root)
+                ),
+                key=lambda x: x[0],
+            )
+        else:
+            action = tree.best_action(root, self.player_index[player])
+        return self._decode(action)
+
+
+def _identity(x):
+    return x
+
+
+def _to_scores(
+    config: types.MctsConfig[G, A], score_vec: types.ScoreVec
+) -> types.Scores:
+    """ A score vector of the rules as a list indexed by player index """
+    if config.debug_level >= 1:
+        assert set(score_vec.keys()) == set(config.players)
+    return [score_vec[p] for p in config.players]
+
+
+def _win_scores(config: types.MctsConfig[G, A], winner: P) -> types.Scores:
+    """ 1 for <winner>, 0 for everyone else (everyone on a draw) """
+    scores = [0.0] * len(config.players)
+    index = config.player_index.get(winner)
+    if index is not None:
+        scores[index] = 1.0
+    return scores
+
+
+def _worker_walks(n_walks: t.Optional[int], deadline: t.Optional[float]):
+    """
+    Count walks until <n_walks>, until time.time() passes <deadline> or until
+    the engine sets its stop event
+    """
+    i = 0
+    while (
+        (n_walks is None or i < n_walks)
+        and (deadline is None or time.time() < deadline)
+        and (_worker_stop is None or not _worker_stop.is_set())
+    ):
+        yield i
+        i += 1
+
+
+def _search_root(
+    config: types.MctsConfig[G, A],
+    gamestate: G,
+    n_walks: t.Optional[int],
+    deadline: t.Optional[float],
+    seed: int,
+) -> t.Tuple[np.ndarray, np.ndarray]:
+    """
+    Worker for Engine._ponder_root_parallel. Returns the (visit counts, score
+    sums) of the root followed by its children
+    """
+    random.seed(seed)
+    # walk logs would stay in this process anyway
+    engine = Engine(
+        dataclasses.replace(config, record_walk_logs=False), gamestate
+    )
+    for _ in _worker_walks(n_walks, deadline):
+        engine._walk()
+    engine._materialize_root()
+
+    tree = engine.tree
+    rows = [tree.root] + [
+        tree.resolve(child) for child, _ in tree.children(tree.root)
+    ]
+    players = range(len(config.players))
+    return (
+        np.array([tree.visits(node) for node in rows], dtype=np.int64),
+        np.array(
+            [[tree.score(node, p) for p in players] for node in rows],
+            dtype=np.float64,
+        ),
+    )
+
+
+############################### Tree parallelism ##############################
+# Worker side of Engine._ponder_tree_parallel. Each worker process keeps the
+# shared tree attached between calls, together with the actions of the nodes
+# it has seen (child k of a node is get_all_actions(gamestate)[k]).
+
+_worker_locks: t.Optional[SharedTreeLocks] = None
+_worker_stop: t.Optional[t.Any] = None  # Engine._stop
+_worker_tree: t.Optional[SharedTree] = None
+_worker_actions: t.Dict[Handle, t.List[A]] = {}
 
-    def _pick_best_action(self, tree: types.Tree[G, A], player: P, root_id):
-        root = self.tree.nodes[root_id]
-        child_action_pairs = (
-            (self.tree.nodes[child_id], action)
-            for (child_id, action) in self.tree.edges[root.id]
+
+def _init_worker(locks: SharedTreeLocks, stop):
+    global _worker_locks, _worker_stop
+    _worker_locks, _worker_stop = locks, stop
+
+
+def _search_shared_tree(
+    name: str,
+    config: types.MctsConfig[G, A],
+    gamestate: G,
+    n_walks: t.Optional[int],
+    deadline: t.Optional[float],
+    seed: int,
+):
+    global _worker_tree, _worker_actions
+    if _worker_tree is None or _worker_tree.name != name:
+        if _worker_tree is not None:
+            _worker_tree.close()
+        _worker_tree = SharedTree.attach(
+            name,
+            config.shared_tree_capacity,
+            len(config.players),
+            _worker_locks,
+            config.virtual_loss,
         )
+        _worker_actions = {}
 
-        action_value_pairs = [
-            (action, child.score_vec[player] / float(child.times_visited))
-            for (child, action) in child_action_pairs
-            if child.times_visited > 0  # this shouldn't happen
-        ]
+    random.seed(seed)
+    for _ in _worker_walks(n_walks, deadline):
+        _shared_walk(_worker_tree, _worker_actions, config, gamestate)
 
-        action, _ = max(action_value_pairs, key=lambda x: x[1])
-        return action
 
+def _shared_walk(
+    tree: SharedTree,
+    actions: t.Dict[Handle, t.List[A]],
+    config: types.MctsConfig[G, A],
+    root_gamestate: G,
+):
+    """ Same walk as Engine._walk, on a SharedTree with virtual loss """
+    ucb_fn = UCB_VECTORIZED_FNS[config.heuristic_type]
+    gamestate = (config.clone_gamestate or copy.deepcopy)(root_gamestate)
+    node = tree.root
+    tree.add_virtual(node)
+    path = [node]
+    for _ in range(MAX_STEPS):
+        expanded_here = False
+        if not tree.is_expanded(node):
+            if config.is_over(gamestate) is None:
+                actions[node] = list(config.get_all_actions(gamestate))
+            else:
+                actions[node] = []
+            expanded_here = tree.expand(
+                node,
+                len(actions[node]),
+                (
+                    None
+                    if config.heuristic_type is None
+                    else (5 * config.heuristic(gamestate), 5)
+                ),
+            )
+            if not expanded_here and not tree.is_expanded(node):
+                break  # the tree is full, roll out from here
 
-def _ucb_basic(
-    C: float, tree: types.Tree, node: types.Node, player: P
-) -> float:
-    if node.times_visited == 0:
+        n_children = tree.num_children(node)
+        if n_children == 0:
+            break
+
+        # step into a random child of a node that was just expanded, like
+        # Engine._tree_policy
+        if expanded_here or gamestate.player == "environment":
+            k = random.randrange(n_children)
+        else:
+            player = config.player_index[gamestate.player]
+            k = int(np.argmax(ucb_fn(config.C, tree, node, player)))
+        if node not in actions:
+            actions[node] = list(config.get_all_actions(gamestate))
+        config.take_action_mut(gamestate, actions[node][k])
+        node = tree.child_range(node)[0] + k
+        tree.add_virtual(node)
+        path.append(node)
+        if expanded_here:
+            break
+    else:
+        raise Exception(f"tree_policy exceeded {MAX_STEPS} steps")
+
+    tree.backup_path(path, _rollout_scores(config, gamestate))
+
+
+def _rollout_scores(
+    config: types.MctsConfig[G, A], gamestate: G
+) -> types.Scores:
+    """ Engine._rollout without the walk log """
+    if config.rollout_policy is not None:
+        return _to_scores(config, config.rollout_policy(gamestate))
+    c = 0
+    while (winning_player := config.is_over(gamestate)) is None:
+        if c >= MAX_STEPS:
+            raise Exception(f"Simulate exceeded {MAX_STEPS} steps")
+        action = random.choice(config.get_all_actions(gamestate))
+        config.take_action_mut(gamestate, action)
+        c += 1
+    if config.get_final_score is not None:
+        return _to_scores(config, config.get_final_score(gamestate))
+    return _win_scores(config, winning_player)
+
+
+def _ucb_basic(C: float, tree: Tree, node: Handle, player: int) -> float:
+    times_visited = tree.visits(node)
+    if times_visited == 0:
         return float("inf")
-    xj = node.score_vec[player] / node.times_visited
-    parent = tree.nodes[node.parent_id]
+    xj = tree.score(node, player) / times_visited
+    parent = tree.parent(node)
     explore_term = C * math.sqrt(
-        math.log(parent.times_visited) / float(node.times_visited)
+        math.log(tree.visits(parent)) / float(times_visited)
     )
     return xj + explore_term
 
 
 def _ucb_with_pre_visit_heuristic(
-    C: float, tree: types.Tree, node: types.Node, player: P
+    C: float, tree: Tree, node: Handle, player: int
 ) -> float:
     """
     Like ucb but adds heuristic. Pretends each node has already been visited n
     times with a reward of k each time.
     """
-    n, k = node.heuristic_val.denominator, node.heuristic_val.numerator
+    heuristic_val = tree.heuristic_val(node)
+    n, k = heuristic_val.denominator, heuristic_val.numerator
     # assert self.config.heuristic is not None
     # assert self.config.heuristic_type == "pre-visit"
     assert n > 0
     assert 0 <= k <= n, k
-    xj = (node.score_vec[player] + k) / (node.times_visited + n)
-    parent = tree.nodes[node.parent_id]
-    num_siblings = len(tree.edges[parent.id])
+    times_visited = tree.visits(node)
+    xj = (tree.score(node, player) + k) / (times_visited + n)
+    parent = tree.parent(node)
+    num_siblings = tree.num_children(parent)
     explore_term = C * math.sqrt(
-        math.log(parent.times_visited + n * num_siblings)
-        / float(node.times_visited + n)
+        math.log(tree.visits(parent) + n * num_siblings)
+        / float(times_visited + n)
     )
     return xj + explore_term
 
 
 def _ucb_with_simple_heuristic(
-    C: float, tree: types.Tree, node: types.Node, player: P
+    C: float, tree: Tree, node: Handle, player: int
 ) -> float:
     # assert self.config.heuristic_type == "basic"
     # assert self.config.heuristic is not None
-    return _ucb_basic(C, tree, node, player) + node.heuristic
+    heuristic_val = tree.heuristic_val(node)
+    return (
+        _ucb_basic(C, tree, node, player)
+        + heuristic_val.numerator / heuristic_val.denominator
+    )
+
+
+UCB_FNS = {
+    None: _ucb_basic,
+    "pre-visit": _ucb_with_pre_visit_heuristic,
+    "simple": _ucb_with_simple_heuristic,
+}
+
+
+################################ Vectorized UCB ###############################
+# Same formulas as above, but computed for every child of <node> at once.
+# Returns an array of ucb values indexed by child position.
+
+
+def _ucb_basic_vectorized(
+    C: float, tree: ArrayTree, node: Handle, player: int
+) -> np.ndarray:
+    times_visited, score_sums = tree.child_stats(node, player)
+    parent_visits = tree.visits(node)
+    if parent_visits == 0:
+        # no child has been visited yet, they're all inf
+        return np.full(len(times_visited), np.inf)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ucb = score_sums / times_visited + C * np.sqrt(
+            math.log(parent_visits) / times_visited
+        )
+    ucb[times_visited == 0] = np.inf
+    return ucb
+
+
+def _ucb_with_pre_visit_heuristic_vectorized(
+    C: float, tree: ArrayTree, node: Handle, player: int
+) -> np.ndarray:
+    start, end = tree.child_range(node)
+    n, k = tree.prior_den[start:end], tree.prior_num[start:end]
+    assert (n > 0).all()
+    times_visited, score_sums = tree.child_stats(node, player)
+    times_visited = times_visited + n
+    xj = (score_sums + k) / times_visited
+    explore_term = C * np.sqrt(
+        np.log(tree.visits(node) + n * (end - start)) / times_visited
+    )
+    return xj + explore_term
+
+
+def _ucb_with_simple_heuristic_vectorized(
+    C: float, tree: ArrayTree, node: Handle, player: int
+) -> np.ndarray:
+    start, end = tree.child_range(node)
+    return _ucb_basic_vectorized(C, tree, node, player) + (
+        tree.prior_num[start:end] / tree.prior_den[start:end]
+    )
+
+
+UCB_VECTORIZED_FNS = {
+    None: _ucb_basic_vectorized,
+    "pre-visit": _ucb_with_pre_visit_heuristic_vectorized,
+    "simple": _ucb_with_simple_heuristic_vectorized,
+}
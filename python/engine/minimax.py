@@ -1,6 +1,12 @@
-import engine.typesv1 as types
+from multiprocessing import shared_memory
+import concurrent.futures
+import math
+import time
 import typing as t
 
+import numpy as np
+
+import engine.typesv1 as types
 import utils
 
 G = t.TypeVar("G")
@@ -8,16 +14,11 @@ A = t.TypeVar("A")
 P = t.TypeVar("P")
 
 
-def minimax(
-    config: types.MinimaxConfig[G, A, P], gamestate: G, depth=3
-) -> t.Tuple[float, t.Optional[A]]:
-    this_player = config.get_player(gamestate)
-    opponent = config.other_player(this_player)
+def _mutable_actions(
+    config: types.MinimaxConfig[G, A, P]
+) -> t.Tuple[t.Callable[[G, A], t.Optional[G]], t.Callable[[G, A], t.Any]]:
     if isinstance(config.action, types.MutableActionConfig):
-        take_action_mut, undo_action = (
-            config.action.take_action_mut,
-            config.action.undo_action,
-        )
+        return config.action.take_action_mut, config.action.undo_action
     elif isinstance(config.action, types.ImmutableActionConfig):
         raise NotImplementedError(
             "minimax not implemented for immutable action config"
@@ -25,19 +26,36 @@ def minimax(
     else:
         utils.assert_never(f"Unknown action config type {type(config.action)}")
 
-    get_all_actions, is_over, heuristic = (
-        config.get_all_actions,
-        config.is_over,
-        config.heuristic,
+
+def _terminal_value(
+    config: types.MinimaxConfig[G, A, P], gamestate: G
+) -> t.Optional[float]:
+    """ Value of a finished game for the player to move, None if not over """
+    if (winner := config.is_over(gamestate)) is None:
+        return None
+    this_player = config.get_player(gamestate)
+    opponent = config.other_player(this_player)
+    return (
+        float("+inf")
+        if winner == this_player
+        else float("-inf")
+        if winner == opponent
+        else 0  # draw
     )
-    if (winner := is_over(gamestate)) is not None:
-        value = (
-            float("+inf")
-            if winner == this_player
-            else float("-inf")
-            if winner == opponent
-            else 0  # draw
-        )
+
+
+def minimax(
+    config: types.MinimaxConfig[G, A, P],
+    gamestate: G,
+    depth=3,
+    stats: t.Optional[types.MinimaxStats] = None,
+) -> t.Tuple[float, t.Optional[A]]:
+    take_action_mut, undo_action = _mutable_actions(config)
+    get_all_actions, heuristic = config.get_all_actions, config.heuristic
+    if stats is not None:
+        stats.nodes += 1
+
+    if (value := _terminal_value(config, gamestate)) is not None:
         return value, None
     if depth == 0:
         return heuristic(gamestate), None
@@ -45,6 +63,12 @@ def minimax(
     actions = get_all_actions(gamestate)
     assert actions, "No actions for a non-terminal gamestate"
 
+    if depth == 1 and config.batch_heuristic is not None:
+        values = _child_values(config, gamestate, actions)
+        if stats is not None:
+            stats.nodes += len(actions)
+        return max((-value, action) for value, action in zip(values, actions))
+
     action_value_pairs: t.List[t.Tuple[float, A]] = []
 
     for action in actions:
@@ -53,7 +77,7 @@ def minimax(
             "get_all_actions(G) returned"
             "action A for which take_action_mut(G, A) is None"
         )
-        value, _ = minimax(config, newgamestate, depth - 1)
+        value, _ = minimax(config, newgamestate, depth - 1, stats)
         action_value_pairs.append((-1 * value, action))
         undo_action(
             gamestate, action
@@ -61,3 +85,600 @@ def minimax(
 
     value, action = max(action_value_pairs)
     return value, action
+
+
+# bound of a TTEntry's value
+EXACT = 0
+LOWER = 1  # the real value is >= value
+UPPER = 2  # the real value is <= value
+
+
+class TTEntry(t.NamedTuple):
+    key: int
+    depth: int
+    value: float
+    bound: int
+    action: t.Any
+    generation: int
+
+
+class TranspositionTable:
+    """
+    Alpha-beta results by gamestate hash. It has a fixed number of slots and
+    a gamestate goes to slot hash % capacity. A slot keeps whichever entry of
+    the current search was searched deepest. Entries of earlier searches (see
+    new_search) are always replaced, but until then they still order actions
+    and cut subtrees, so keep one table for a whole game
+    """
+
+    def __init__(self, capacity: int = 1 << 16):
+        self.capacity = capacity
+        self.slots: t.List[t.Optional[TTEntry]] = [None] * capacity
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return sum(entry is not None for entry in self.slots)
+
+    def new_search(self):
+        self.generation += 1
+
+    def get(self, key: int) -> t.Optional[TTEntry]:
+        entry = self.slots[key % self.capacity]
+        if entry is None or entry.key != key:
+            return None
+        return entry
+
+    def put(self, key: int, depth: int, value: float, bound: int, action):
+        slot = key % self.capacity
+        old = self.slots[slot]
+        if (
+            old is None
+            or old.key == key
+            or old.generation != self.generation
+            or depth >= old.depth
+        ):
+            self.slots[slot] = TTEntry(
+                key, depth, value, bound, action, self.generation
+            )
+
+
+class HistoryTable:
+    """
+    Cutoffs caused by each action, weighted by depth squared so that cutoffs
+    near the root count the most. new_search halves every score, so a table
+    kept for a whole game follows the position
+    """
+
+    def __init__(self):
+        self.scores: t.Dict[t.Any, int] = {}
+
+    def new_search(self):
+        self.scores = {
+            action: score // 2
+            for action, score in self.scores.items()
+            if score > 1
+        }
+
+    def add_cutoff(self, action, depth: int):
+        self.scores[action] = self.scores.get(action, 0) + depth * depth
+
+
+class MinimaxPool:
+    """
+    The worker processes alphabeta and iterative_deepening split the root
+    over when config.n_workers > 1. The processes start with the first
+    search and every one of them keeps a transposition table and a history
+    table (if the config asks for them) until close(). Keep one pool for a
+    whole game, like the tt and history of the caller
+    """
+
+    def __init__(self, config: types.MinimaxConfig):
+        self.config = config
+        # searches run on the pool so far, workers start a new search of
+        # their tables when it changes
+        self.n_searches = 0
+        self._pool: t.Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+    def close(self):
+        """ Shut down the worker processes, which drops their tables """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _start_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                self.config.n_workers,
+                initializer=_init_worker,
+                initargs=(self.config,),
+            )
+        return self._pool
+
+
+N_KILLERS = 2
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+class _Search:
+    """ What every node of one alpha-beta search needs """
+
+    __slots__ = (
+        "config",
+        "take_action_mut",
+        "undo_action",
+        "stats",
+        "tt",
+        "deadline",
+        "hit_horizon",
+        "pool",
+        "root_depth",
+        "killers",
+        "history",
+    )
+
+    def __init__(
+        self,
+        config: types.MinimaxConfig,
+        stats: t.Optional[types.MinimaxStats],
+        tt: t.Optional[TranspositionTable],
+        pool: t.Optional[MinimaxPool] = None,
+        history: t.Optional[HistoryTable] = None,
+        new_search: bool = True,
+    ):
+        self.config = config
+        self.pool = pool
+        if pool is not None:
+            pool.n_searches += 1
+        self.take_action_mut, self.undo_action = _mutable_actions(config)
+        self.stats = stats if stats is not None else types.MinimaxStats()
+        if tt is None and config.hash_gamestate is not None:
+            tt = TranspositionTable(config.tt_capacity)
+        if tt is not None and new_search:
+            tt.new_search()
+        self.tt = tt
+        # perf_counter time after which the search gives up
+        self.deadline: t.Optional[float] = None
+        # whether a value was cut off by depth rather than the game ending
+        self.hit_horizon = False
+        # depth of the search at the root, the ply of a node is root_depth
+        # minus its depth
+        self.root_depth = 0
+        # ply -> latest actions that caused a cutoff there, newest first. Kept
+        # between the iterations of iterative_deepening
+        self.killers: t.Dict[int, t.List[t.Any]] = {}
+        if history is None and config.history_heuristic:
+            history = HistoryTable()
+        if history is not None and new_search:
+            history.new_search()
+        self.history = history
+
+    def add_cutoff(self, action, depth: int):
+        """ Remember that <action> at a node of <depth> caused a cutoff """
+        if self.config.killer_moves:
+            killers = self.killers.setdefault(self.root_depth - depth, [])
+            if action not in killers:
+                killers.insert(0, action)
+                del killers[N_KILLERS:]
+        if self.history is not None:
+            self.history.add_cutoff(action, depth)
+
+
+def alphabeta(
+    config: types.MinimaxConfig[G, A, P],
+    gamestate: G,
+    depth=3,
+    stats: t.Optional[types.MinimaxStats] = None,
+    tt: t.Optional[TranspositionTable] = None,
+    history: t.Optional[HistoryTable] = None,
+    pool: t.Optional[MinimaxPool] = None,
+) -> t.Tuple[float, t.Optional[A]]:
+    """
+    Same value as minimax, but skips the actions that can't change it. The
+    earlier config.order_actions puts the best action, the more it skips. On
+    ties the action that comes first in that order is returned. Without <tt>
+    a fresh table is used if config.hash_gamestate is given, and the same
+    goes for <history> and config.history_heuristic. config.n_workers > 1
+    needs a <pool>, which the caller closes
+    """
+    if config.n_workers > 1 and pool is None:
+        raise Exception("alphabeta with n_workers > 1 needs a MinimaxPool")
+    search = _Search(config, stats, tt, pool, history)
+    return _search_root(search, gamestate, depth)
+
+
+def iterative_deepening(
+    config: types.MinimaxConfig[G, A, P],
+    gamestate: G,
+    nseconds: t.Optional[float] = None,
+    max_depth: t.Optional[int] = None,
+    stats: t.Optional[types.MinimaxStats] = None,
+    tt: t.Optional[TranspositionTable] = None,
+    history: t.Optional[HistoryTable] = None,
+    pool: t.Optional[MinimaxPool] = None,
+) -> t.Tuple[float, t.Optional[A]]:
+    """
+    alphabeta to depth 1, 2, 3... until <nseconds> have passed or <max_depth>
+    is done, whichever comes first. Returns the value and action of the
+    deepest iteration that completed, an iteration the deadline interrupts is
+    thrown away. Depth 1 always completes, so there is always an action.
+    Deepening stops early once the value is a proven win or loss or the whole
+    game tree was searched. Each iteration starts with the best action of the
+    one before, which the transposition table (<tt>, see alphabeta) keeps.
+    Killer moves and the history table are kept between iterations
+    """
+    if nseconds is None and max_depth is None:
+        raise Exception("iterative_deepening needs nseconds or max_depth")
+    if config.n_workers > 1 and pool is None:
+        raise Exception(
+            "iterative_deepening with n_workers > 1 needs a MinimaxPool"
+        )
+    deadline = None if nseconds is None else time.perf_counter() + nseconds
+    search = _Search(config, stats, tt, pool, history)
+    depth = 0
+    value, action = 0.0, None
+    while max_depth is None or depth < max_depth:
+        search.hit_horizon = False
+        try:
+            value, action = _search_root(search, gamestate, depth + 1)
+        except _OutOfTime:
+            break
+        depth += 1
+        search.stats.depth = depth
+        if depth == 1:
+            search.deadline = deadline
+        if math.isinf(value) or not search.hit_horizon:
+            break
+    return value, action
+
+
+def _search_root(
+    search: _Search, gamestate: G, depth: int
+) -> t.Tuple[float, t.Optional[A]]:
+    search.root_depth = depth
+    if search.pool is None:
+        return _alphabeta(
+            search, gamestate, depth, float("-inf"), float("+inf")
+        )
+    return _split_root(search, search.pool, gamestate, depth)
+
+
+def _ordered_actions(
+    search: _Search, gamestate: G, depth: int, first: t.Optional[A]
+) -> t.List[A]:
+    """
+    <first>, then the killer moves of the ply, then the other actions by
+    history score. Ties keep the config.order_actions order
+    """
+    config = search.config
+    actions = config.get_all_actions(gamestate)
+    assert actions, "No actions for a non-terminal gamestate"
+    if config.order_actions is not None:
+        actions = config.order_actions(gamestate, actions)
+    if search.history is not None:
+        scores = search.history.scores
+        actions = sorted(actions, key=lambda a: -scores.get(a, 0))
+    front = [] if first is None else [first]
+    front += search.killers.get(search.root_depth - depth, [])
+    if front:
+        front = [a for a in dict.fromkeys(front) if a in actions]
+        actions = front + [a for a in actions if a not in front]
+    return actions
+
+
+def _child_values(
+    config: types.MinimaxConfig[G, A, P], gamestate: G, actions: t.List[A]
+) -> t.List[float]:
+    """
+    Value of the gamestate each of <actions> leads to for the player to move
+    there. Finished games are valued like everywhere else, the others with
+    one config.batch_heuristic call
+    """
+    take_action_mut, undo_action = _mutable_actions(config)
+    values: t.List[t.Optional[float]] = []
+    for action in actions:
+        take_action_mut(gamestate, action)
+        values.append(_terminal_value(config, gamestate))
+        undo_action(gamestate, action)
+    ongoing = [a for a, value in zip(actions, values) if value is None]
+    if not ongoing:
+        return values
+    heuristic_values = iter(config.batch_heuristic(gamestate, ongoing))
+    return [
+        next(heuristic_values) if value is None else value for value in values
+    ]
+
+
+def _alphabeta(
+    search: _Search,
+    gamestate: G,
+    depth: int,
+    alpha: float,
+    beta: float,
+) -> t.Tuple[float, t.Optional[A]]:
+    """
+    Negamax with fail-soft alpha-beta. A value <= alpha is an upper bound on
+    the real value and a value >= beta is a lower bound, anything in between
+    is exact
+    """
+    config, stats, tt = search.config, search.stats, search.tt
+    stats.nodes += 1
+    if search.deadline is not None and time.perf_counter() > search.deadline:
+        raise _OutOfTime()
+
+    if (value := _terminal_value(config, gamestate)) is not None:
+        return value, None
+    if depth == 0:
+        search.hit_horizon = True
+        return config.heuristic(gamestate), None
+
+    tt_action, key = None, None
+    if tt is not None:
+        key = config.hash_gamestate(gamestate)
+        entry = tt.get(key)
+        if entry is not None:
+            stats.tt_hits += 1
+            tt_action = entry.action
+            if entry.depth >= depth:
+                if entry.bound == EXACT:
+                    alpha = beta = entry.value
+                elif entry.bound == LOWER:
+                    alpha = max(alpha, entry.value)
+                else:
+                    beta = min(beta, entry.value)
+                if alpha >= beta:
+                    # the entry may hide a horizon
+                    search.hit_horizon = True
+                    return entry.value, entry.action
+    alpha_orig = alpha
+
+    actions = _ordered_actions(search, gamestate, depth, tt_action)
+    if depth == 1 and config.batch_heuristic is not None:
+        return _alphabeta_leaves(search, gamestate, actions, beta, key)
+
+    take_action_mut, undo_action = search.take_action_mut, search.undo_action
+    best_value, best_action = float("-inf"), None
+    for action in actions:
+        newgamestate = take_action_mut(gamestate, action)
+        assert newgamestate is not None, (
+            "get_all_actions(G) returned"
+            "action A for which take_action_mut(G, A) is None"
+        )
+        try:
+            value, _ = _alphabeta(
+                search, newgamestate, depth - 1, -beta, -alpha
+            )
+        finally:
+            # also when the deadline passed, so the caller's gamestate is
+            # left as it was
+            undo_action(gamestate, action)
+        value = -value
+
+        if best_action is None or value > best_value:
+            best_value, best_action = value, action
+        alpha = max(alpha, value)
+        if alpha >= beta:
+            stats.cutoffs += 1
+            search.add_cutoff(action, depth)
+            break
+
+    if tt is not None:
+        bound = (
+            UPPER
+            if best_value <= alpha_orig
+            else LOWER
+            if best_value >= beta
+            else EXACT
+        )
+        tt.put(key, depth, best_value, bound, best_action)
+    return best_value, best_action
+
+
+def _alphabeta_leaves(
+    search: _Search,
+    gamestate: G,
+    actions: t.List[A],
+    beta: float,
+    key: t.Optional[int],
+) -> t.Tuple[float, t.Optional[A]]:
+    """
+    _alphabeta at depth 1 with config.batch_heuristic. Every child is
+    evaluated, so the value is exact even when it's outside the window
+    """
+    stats = search.stats
+    values = _child_values(search.config, gamestate, actions)
+    stats.nodes += len(actions)
+    search.hit_horizon = True
+
+    best_value, best_action = float("-inf"), None
+    for action, value in zip(actions, values):
+        if best_action is None or -value > best_value:
+            best_value, best_action = -value, action
+    if best_value >= beta:
+        stats.cutoffs += 1
+        search.add_cutoff(best_action, 1)
+    if search.tt is not None:
+        search.tt.put(key, 1, best_value, EXACT, best_action)
+    return best_value, best_action
+
+
+############################### Root splitting ################################
+# With MinimaxConfig.n_workers > 1 the root's actions are searched by the
+# processes of a MinimaxPool. Every worker gets its own copy of the gamestate
+# (the pickled one), so MutableActionConfig works unchanged.
+
+
+def _split_root(
+    search: _Search, pool: MinimaxPool, gamestate: G, depth: int
+) -> t.Tuple[float, t.Optional[A]]:
+    """
+    Young brothers wait: the first action is searched here with the full
+    window, which gives alpha. The other actions are then searched by the
+    workers of <pool>, one task each. Workers share alpha through one
+    float64 of shared memory. A task starts from the best value any task has
+    proven so far and picks up raises while it runs (see
+    _search_root_action). A task whose value isn't above the alpha it ended
+    with only has an upper bound, but then its action can't be the best
+    either
+    """
+    config, stats, tt = search.config, search.stats, search.tt
+    if depth <= 1 or _terminal_value(config, gamestate) is not None:
+        # nothing worth splitting
+        return _alphabeta(
+            search, gamestate, depth, float("-inf"), float("+inf")
+        )
+    stats.nodes += 1
+
+    tt_action = None
+    if tt is not None:
+        key = config.hash_gamestate(gamestate)
+        entry = tt.get(key)
+        if entry is not None:
+            stats.tt_hits += 1
+            tt_action = entry.action
+    actions = _ordered_actions(search, gamestate, depth, tt_action)
+
+    first = actions[0]
+    search.take_action_mut(gamestate, first)
+    try:
+        value, _ = _alphabeta(
+            search, gamestate, depth - 1, float("-inf"), float("+inf")
+        )
+    finally:
+        search.undo_action(gamestate, first)
+    best_value, best_exact, best_action = -value, True, first
+
+    rest = actions[1:]
+    if rest and best_value != float("+inf"):
+        deadline = None
+        if search.deadline is not None:
+            # workers don't share this process' perf_counter
+            deadline = time.time() + search.deadline - time.perf_counter()
+        executor = pool._start_pool()
+        shm = shared_memory.SharedMemory(create=True, size=8)
+        try:
+            np.ndarray((1,), dtype=np.float64, buffer=shm.buf)[0] = best_value
+            futures = [
+                executor.submit(
+                    _search_root_action,
+                    config,
+                    gamestate,
+                    action,
+                    depth,
+                    deadline,
+                    shm.name,
+                    pool.n_searches,
+                )
+                for action in rest
+            ]
+            try:
+                results = [future.result() for future in futures]
+            finally:
+                for future in futures:
+                    future.cancel()
+        finally:
+            shm.close()
+            shm.unlink()
+
+        for action, (value, exact, hit_horizon, worker_stats) in zip(
+            rest, results
+        ):
+            stats.nodes += worker_stats.nodes
+            stats.cutoffs += worker_stats.cutoffs
+            stats.tt_hits += worker_stats.tt_hits
+            search.hit_horizon |= hit_horizon
+            if (value, exact) > (best_value, best_exact):
+                best_value, best_exact, best_action = value, exact, action
+
+    if tt is not None:
+        tt.put(key, depth, best_value, EXACT, best_action)
+    return best_value, best_action
+
+
+_worker_alpha: t.Optional[shared_memory.SharedMemory] = None
+_worker_tt: t.Optional[TranspositionTable] = None
+_worker_history: t.Optional[HistoryTable] = None
+# MinimaxPool.n_searches of the search the worker's tables are on
+_worker_search = 0
+
+
+def _init_worker(config: types.MinimaxConfig):
+    global _worker_tt, _worker_history
+    if config.hash_gamestate is not None:
+        _worker_tt = TranspositionTable(config.tt_capacity)
+    if config.history_heuristic:
+        _worker_history = HistoryTable()
+
+
+def _search_root_action(
+    config: types.MinimaxConfig[G, A, P],
+    gamestate: G,
+    action: A,
+    depth: int,
+    deadline: t.Optional[float],
+    alpha_name: str,
+    search_id: int,
+) -> t.Tuple[float, bool, bool, types.MinimaxStats]:
+    """
+    Worker for _split_root. Returns the value of <action> for the player to
+    move in <gamestate>, whether that value is above the shared alpha,
+    whether the search hit its horizon and the stats of the search. The
+    worker's tables (see _init_worker) are kept for all its tasks, and start
+    a new search when <search_id> does
+    """
+    global _worker_alpha, _worker_search
+    if _worker_alpha is None or _worker_alpha.name != alpha_name:
+        if _worker_alpha is not None:
+            _worker_alpha.close()
+        _worker_alpha = shared_memory.SharedMemory(name=alpha_name)
+    shared_alpha = np.ndarray((1,), dtype=np.float64, buffer=_worker_alpha.buf)
+    if search_id != _worker_search:
+        _worker_search = search_id
+        for table in (_worker_tt, _worker_history):
+            if table is not None:
+                table.new_search()
+
+    search = _Search(
+        config, None, _worker_tt, None, _worker_history, new_search=False
+    )
+    search.root_depth = depth
+    if deadline is not None:
+        search.deadline = time.perf_counter() + deadline - time.time()
+    stats = search.stats
+    search.take_action_mut(gamestate, action)
+
+    alpha = float(shared_alpha[0])
+    if _terminal_value(config, gamestate) is not None:
+        child_value, _ = _alphabeta(
+            search, gamestate, depth - 1, float("-inf"), -alpha
+        )
+    else:
+        # negamax at the child of the root, whose beta is -alpha. alpha is
+        # read again before each of its actions
+        stats.nodes += 1
+        child_value = float("-inf")
+        for child_action in _ordered_actions(
+            search, gamestate, depth - 1, None
+        ):
+            alpha = max(alpha, float(shared_alpha[0]))
+            if child_value >= -alpha:
+                stats.cutoffs += 1
+                break
+            search.take_action_mut(gamestate, child_action)
+            try:
+                value, _ = _alphabeta(
+                    search, gamestate, depth - 2, alpha, -child_value
+                )
+            finally:
+                search.undo_action(gamestate, child_action)
+            child_value = max(child_value, -value)
+
+    value = -child_value
+    exact = value > alpha
+    if exact and value > shared_alpha[0]:
+        # two workers can race here, but whatever ends up in shared_alpha has
+        # been proven, so it's still a valid bound
+        shared_alpha[0] = value
+    return value, exact, search.hit_horizon, stats
@@ -0,0 +1,244 @@
+"""
+Tree for tree parallel search (MctsConfig.parallelism == "tree")
+
+Every worker process of engine.mctsv1.Engine walks the same tree. Its arrays
+live in one multiprocessing.shared_memory block, laid out like the arrays of
+engine.tree.ArrayTree (children of a node are contiguous). Actions and node
+ids aren't stored: child k of a node is get_all_actions(gamestate)[k], which
+every worker can recompute.
+
+Capacity is fixed when the block is created. Once it's full nodes simply stop
+being expanded and walks roll out from the leaf they reach.
+
+Synchronization:
+    - allocating children (SharedTree.expand) holds locks.alloc
+    - visit counts, virtual losses and score sums of node i are only changed
+      while holding locks.stripes[i % len(locks.stripes)]
+    - selection reads without locks. A stale read only makes a walk pick a
+      slightly worse child. child_start is written after everything else
+      about the children, so a node that looks expanded is
+"""
+from multiprocessing import shared_memory
+import multiprocessing
+import typing as t
+
+import numpy as np
+
+
+NO_PARENT = -1
+
+Handle = int
+
+N_STRIPES = 64
+
+INT_FIELDS = [
+    "parents",
+    "visit_counts",
+    "virtual",
+    "child_start",
+    "child_count",
+    "prior_den",
+]
+FLOAT_FIELDS = ["prior_num"]
+
+
+class SharedTreeLocks(t.NamedTuple):
+    alloc: t.Any  # multiprocessing.Lock
+    stripes: t.List[t.Any]
+
+
+def make_locks(n_stripes: int = N_STRIPES) -> SharedTreeLocks:
+    return SharedTreeLocks(
+        alloc=multiprocessing.Lock(),
+        stripes=[multiprocessing.Lock() for _ in range(n_stripes)],
+    )
+
+
+class SharedTree:
+    """
+    Handles are indices into the arrays, the root is 0. virtual[i] is the
+    number of walks currently passing through node i. Each of them counts as
+    <virtual_loss> extra visits that scored 0, which steers other workers
+    away from the path until the walk backs up.
+    """
+
+    def __init__(
+        self,
+        shm: shared_memory.SharedMemory,
+        capacity: int,
+        nplayers: int,
+        locks: SharedTreeLocks,
+        virtual_loss: float,
+    ):
+        self.shm = shm
+        self.name = shm.name
+        self.capacity = capacity
+        self.locks = locks
+        self.virtual_loss = virtual_loss
+
+        offset = 0
+
+        def view(dtype, shape):
+            nonlocal offset
+            arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            offset += arr.nbytes
+            return arr
+
+        # header[0] is the number of allocated nodes
+        self.header = view(np.int64, (1,))
+        # INT_FIELDS, then FLOAT_FIELDS, in order
+        self.parents = view(np.int64, (capacity,))
+        self.visit_counts = view(np.int64, (capacity,))
+        self.virtual = view(np.int64, (capacity,))
+        self.child_start = view(np.int64, (capacity,))
+        self.child_count = view(np.int64, (capacity,))
+        self.prior_den = view(np.int64, (capacity,))
+        self.prior_num = view(np.float64, (capacity,))
+        self.score_sums = view(np.float64, (capacity, nplayers))
+
+        self.root = 0
+
+    @staticmethod
+    def nbytes(capacity: int, nplayers: int) -> int:
+        n_columns = len(INT_FIELDS) + len(FLOAT_FIELDS) + nplayers
+        return 8 * (1 + capacity * n_columns)
+
+    @classmethod
+    def create(
+        cls,
+        capacity: int,
+        nplayers: int,
+        locks: SharedTreeLocks,
+        virtual_loss: float,
+    ) -> "SharedTree":
+        """ Allocate a block holding just the (unexpanded) root """
+        shm = shared_memory.SharedMemory(
+            create=True, size=cls.nbytes(capacity, nplayers)
+        )
+        tree = cls(shm, capacity, nplayers, locks, virtual_loss)
+        tree.header[0] = 1
+        tree.parents[0] = NO_PARENT
+        tree.child_start[0] = -1
+        return tree
+
+    @classmethod
+    def attach(
+        cls,
+        name: str,
+        capacity: int,
+        nplayers: int,
+        locks: SharedTreeLocks,
+        virtual_loss: float,
+    ) -> "SharedTree":
+        shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, capacity, nplayers, locks, virtual_loss)
+
+    def close(self):
+        # numpy views hold exported pointers into the buffer
+        self.header = self.score_sums = None
+        self.parents = self.visit_counts = self.virtual = None
+        self.child_start = self.child_count = None
+        self.prior_den = self.prior_num = None
+        self.shm.close()
+
+    def unlink(self):
+        """ Close and free the block. Only the creator should call this """
+        self.close()
+        self.shm.unlink()
+
+    def __len__(self) -> int:
+        return int(self.header[0])
+
+    def is_expanded(self, node: Handle) -> bool:
+        return self.child_start[node] != -1
+
+    def num_children(self, node: Handle) -> int:
+        return int(self.child_count[node])
+
+    def child_range(self, node: Handle) -> t.Tuple[int, int]:
+        start = int(self.child_start[node])
+        return start, start + int(self.child_count[node])
+
+    def parent(self, node: Handle) -> Handle:
+        return int(self.parents[node])
+
+    def visits(self, node: Handle) -> float:
+        """ Visits including virtual ones """
+        return float(
+            self.visit_counts[node] + self.virtual_loss * self.virtual[node]
+        )
+
+    def score(self, node: Handle, player: int) -> float:
+        return float(self.score_sums[node, player])
+
+    def child_stats(
+        self, node: Handle, player: int
+    ) -> t.Tuple[np.ndarray, np.ndarray]:
+        """
+        (times visited including virtual visits, score sums for <player>) of
+        every child of <node>
+        """
+        start, end = self.child_range(node)
+        return (
+            self.visit_counts[start:end]
+            + self.virtual_loss * self.virtual[start:end],
+            self.score_sums[start:end, player],
+        )
+
+    def expand(
+        self,
+        node: Handle,
+        n_children: int,
+        prior: t.Optional[t.Tuple[float, int]] = None,
+    ) -> bool:
+        """
+        Allocate <n_children> children for <node>. Returns False if another
+        worker expanded <node> first or if the tree is full, in which case
+        <node> is left as it is.
+        """
+        with self.locks.alloc:
+            if self.child_start[node] != -1:
+                return False
+            start = int(self.header[0])
+            end = start + n_children
+            if end > self.capacity:
+                return False
+            self.parents[start:end] = node
+            self.visit_counts[start:end] = 0
+            self.virtual[start:end] = 0
+            self.score_sums[start:end] = 0
+            self.child_start[start:end] = -1
+            self.child_count[start:end] = 0
+            num, den = (0.0, 0) if prior is None else prior
+            self.prior_num[start:end] = num
+            self.prior_den[start:end] = den
+            self.header[0] = end
+            self.child_count[node] = n_children
+            self.child_start[node] = start
+            return True
+
+    def add_virtual(self, node: Handle):
+        with self._lock(node):
+            self.virtual[node] += 1
+
+    def backup_path(self, path: t.Sequence[Handle], scores: t.Sequence[float]):
+        """ Record a finished walk and take back its virtual losses """
+        for node in path:
+            with self._lock(node):
+                self.virtual[node] -= 1
+                self.visit_counts[node] += 1
+                self.score_sums[node] += scores
+
+    def root_stats(self) -> t.Tuple[np.ndarray, np.ndarray]:
+        """
+        (visit counts, score sums) of the root followed by its children
+        """
+        start, end = self.child_range(self.root)
+        if start == -1:
+            start = end = 0
+        rows = [self.root] + list(range(start, end))
+        return self.visit_counts[rows].copy(), self.score_sums[rows].copy()
+
+    def _lock(self, node: Handle):
+        stripes = self.locks.stripes
+        return stripes[node % len(stripes)]
@@ -0,0 +1,1036 @@
+import copy
+import dataclasses
+import math
+import operator
+import random
+import threading
+import time
+
+from hypothesis import given, strategies as st
+import numpy as np
+import pytest
+
+import engine.typesv1 as types
+from engine.mctsv1 import Engine, UCB_FNS, UCB_VECTORIZED_FNS
+from engine.tree import ArrayTree
+from engine.minimax import (
+    minimax,
+    alphabeta,
+    iterative_deepening,
+    MinimaxPool,
+    TranspositionTable,
+    HistoryTable,
+)
+from connect4.heuristic import (
+    heuristic as connect4_heuristic,
+    batch_heuristic as connect4_batch_heuristic,
+)
+import connect4.rules as connect4_rules
+import t2048.rules as t2048_rules
+
+
+def t2048_config(**kwargs) -> types.MctsConfig:
+    kwargs.setdefault("debug_level", 2)
+    return types.MctsConfig(
+        take_action_mut=t2048_rules.take_action_mut,
+        get_all_actions=t2048_rules.get_all_actions,
+        is_over=t2048_rules.is_over,
+        get_final_score=t2048_rules.get_final_score,
+        players=t2048_rules.get_players(),
+        encode_action=t2048_rules.encode_action,
+        decode_action=t2048_rules.decode_action,
+        **kwargs,
+    )
+
+
+def t2048_gamestate(seed: int):
+    random.seed(seed)
+    return t2048_rules.init_game()
+
+
+def root_child_stats(engine: Engine):
+    tree = engine.tree
+    return [
+        (tree.node_id(child), tree.visits(child), tree.score(child, 0))
+        for child, _ in tree.children(tree.root)
+    ]
+
+
+def test_array_tree_agrees_with_dict_tree():
+    results, new_node_ids = [], []
+    for tree_type in ["dict", "array"]:
+        gamestate = t2048_gamestate(seed=0)
+        engine = Engine(t2048_config(tree_type=tree_type), gamestate)
+        random.seed(1)
+        walk_logs, action = engine.ponder(50)
+        # ArrayTree creates children lazily, so new-node events come later
+        # (and only for children that were stepped into)
+        new_node_ids.append(
+            {
+                e["id"]
+                for walk_log in walk_logs
+                for e in walk_log
+                if e["event-type"] == "new-node"
+            }
+        )
+        walk_logs = [
+            [e for e in walk_log if e["event-type"] != "new-node"]
+            for walk_log in walk_logs
+        ]
+        results.append(
+            (len(engine.tree), root_child_stats(engine), walk_logs, action)
+        )
+
+    assert results[0] == results[1]
+    assert new_node_ids[1] < new_node_ids[0]
+
+
+def test_consume_walk_log_reproduces_tree():
+    for tree_type in ["dict", "array"]:
+        gamestate = t2048_gamestate(seed=2)
+        producer = Engine(t2048_config(tree_type=tree_type), gamestate)
+        consumer = Engine(t2048_config(tree_type=tree_type), gamestate)
+
+        walk_logs, _ = producer.ponder(30)
+        for walk_log in walk_logs:
+            # engineservers only broadcast new-node and walk-result events
+            consumer.consume_walk_log(
+                [e for e in walk_log if e["event-type"] != "take-action"]
+            )
+
+        assert len(consumer.tree) == len(producer.tree)
+        assert consumer.n_walks_consumed == 30
+        assert root_child_stats(consumer) == root_child_stats(producer)
+
+
+@given(
+    st.lists(
+        st.tuples(
+            st.integers(min_value=0, max_value=100),  # times visited
+            st.floats(min_value=0, max_value=1),  # mean score
+            st.floats(min_value=0, max_value=1),  # heuristic
+        ),
+        min_size=1,
+        max_size=50,
+    )
+)
+def test_vectorized_ucb_agrees_with_scalar_ucb(children):
+    tree = ArrayTree(["player"])
+    tree.set_expanded(tree.root)
+    for i, (visits, mean_score, heuristic) in enumerate(children):
+        child = tree.new_node(
+            i + 1, tree.root, i, types.HeuristicVal(5 * heuristic, 5)
+        )
+        tree.visit_counts[child] = visits
+        tree.score_sums[child, 0] = visits * mean_score
+    tree.visit_counts[tree.root] = sum(visits for visits, _, _ in children)
+
+    for heuristic_type, ucb_fn in UCB_FNS.items():
+        scalar = [
+            ucb_fn(types.MctsConfig.C, tree, child, 0)
+            for child, _ in tree.children(tree.root)
+        ]
+        vectorized = UCB_VECTORIZED_FNS[heuristic_type](
+            types.MctsConfig.C, tree, tree.root, 0
+        )
+        assert np.allclose(scalar, vectorized), heuristic_type
+
+
+def subtree_size(tree, node) -> int:
+    """ Number of nodes, including child slots that aren't materialized """
+    if not tree.is_expanded(node):
+        return 1
+    return 1 + sum(
+        subtree_size(tree, tree.child(node, k)[0])
+        for k in range(tree.num_children(node))
+    )
+
+
+def test_advance_keeps_subtree_statistics():
+    for tree_type in ["dict", "array"]:
+        gamestate = t2048_gamestate(seed=3)
+        engine = Engine(t2048_config(tree_type=tree_type), gamestate)
+        engine.ponder(200)
+
+        tree = engine.tree
+        actions, child = [], tree.root
+        for _ in range(2):  # player action then environment action
+            child, action = max(
+                tree.children(child), key=lambda ca: tree.visits(ca[0])
+            )
+            actions.append(action)
+        visits, score = tree.visits(child), tree.score(child, 0)
+        size = subtree_size(tree, child)
+
+        assert engine.advance(actions)
+        tree = engine.tree
+        assert tree.visits(tree.root) == visits
+        assert tree.score(tree.root, 0) == score
+        assert len(tree) == size == subtree_size(tree, tree.root)
+        assert engine.root_gamestate.player == "player"
+
+        # the kept subtree is labeled like a tree built from scratch
+        for child, action in tree.children(tree.root):
+            assert tree.node_id(child) == engine._child_id(0, action)
+
+        engine.ponder(20)
+        assert tree.visits(tree.root) == visits + 20
+
+
+def test_advance_to_finds_descendant_gamestate():
+    for tree_type in ["dict", "array"]:
+        gamestate = t2048_gamestate(seed=4)
+        engine = Engine(t2048_config(tree_type=tree_type), gamestate)
+        engine.ponder(300)
+
+        tree = engine.tree
+        player_child, player_action = tree.children(tree.root)[0]
+        env_child, env_action = tree.children(player_child)[0]
+        visits = tree.visits(env_child)
+
+        played = t2048_rules.take_action_mut(
+            t2048_rules.take_action_mut(
+                copy.deepcopy(gamestate), player_action
+            ),
+            env_action,
+        )
+        assert engine.advance_to(played)
+        assert engine.root_gamestate == played
+        assert engine.tree.visits(engine.tree.root) == visits
+
+        # not a descendant, starts a fresh tree
+        assert not engine.advance_to(t2048_gamestate(seed=5))
+        assert len(engine.tree) == 1
+
+
+def connect4_config(**kwargs) -> types.MctsConfig:
+    kwargs.setdefault("debug_level", 2)
+    return types.MctsConfig(
+        take_action_mut=connect4_rules.take_action_mut,
+        undo_action=connect4_rules.undo_action,
+        get_all_actions=connect4_rules.get_all_actions,
+        is_over=connect4_rules.is_over,
+        get_final_score=connect4_rules.get_final_score,
+        players=["X", "O"],
+        encode_action=connect4_rules.encode_action,
+        decode_action=connect4_rules.decode_action,
+        **kwargs,
+    )
+
+
+def connect4_middlegame():
+    gamestate = connect4_rules.init_game()
+    for col in [3, 3, 2, 4, 4, 2, 5, 1]:
+        connect4_rules.take_action_mut(gamestate, (col, gamestate.player))
+    return gamestate
+
+
+def check_transpositions(engine: Engine):
+    """
+    Every node reached through the tree is the canonical node of the
+    gamestate it leads to
+    """
+    tree, config = engine.tree, engine.config
+    seen = set()
+
+    def check(node, gamestate):
+        node = tree.resolve(node)
+        assert tree.table[config.hash_gamestate(gamestate)] == node
+        if node in seen or not tree.is_expanded(node):
+            return
+        seen.add(node)
+        for child, action in tree.children(node):
+            config.take_action_mut(gamestate, action)
+            if tree.links[child] != -1:
+                check(child, gamestate)
+            config.undo_action(gamestate, action)
+
+    check(tree.root, copy.deepcopy(engine.root_gamestate))
+
+
+def test_transpositions_share_statistics():
+    random.seed(6)
+    gamestate = connect4_middlegame()
+    config = connect4_config(hash_gamestate=connect4_rules.hash_gamestate)
+    engine = Engine(config, copy.deepcopy(gamestate))
+    engine.ponder(500)
+
+    tree = engine.tree
+    assert tree.transposed
+    assert tree.visits(tree.root) == 500
+    check_transpositions(engine)
+
+    random.seed(6)
+    plain = Engine(connect4_config(), copy.deepcopy(gamestate))
+    plain.ponder(500)
+    assert len(tree) < len(plain.tree)
+
+    # walk logs reproduce the statistics of the DAG
+    consumer = Engine(config, copy.deepcopy(gamestate))
+    random.seed(6)
+    walk_logs, _ = Engine(config, copy.deepcopy(gamestate)).ponder(100)
+    for walk_log in walk_logs:
+        consumer.consume_walk_log(
+            [e for e in walk_log if e["event-type"] != "take-action"]
+        )
+    assert consumer.tree.visits(consumer.tree.root) == 100
+
+
+def test_advance_with_transpositions():
+    random.seed(7)
+    gamestate = connect4_middlegame()
+    config = connect4_config(hash_gamestate=connect4_rules.hash_gamestate)
+    engine = Engine(config, gamestate)
+    engine.ponder(500)
+
+    tree = engine.tree
+    actions, child = [], tree.root
+    for _ in range(2):
+        child, action = max(
+            (
+                (c, a)
+                for (c, a) in tree.children(tree.resolve(child))
+                if tree.is_expanded(tree.resolve(c))
+                and tree.num_children(tree.resolve(c)) > 0
+            ),
+            key=lambda ca: tree.visits(tree.resolve(ca[0])),
+        )
+        actions.append(action)
+    visits = tree.visits(tree.resolve(child))
+
+    assert engine.advance(actions)
+    assert engine.tree.visits(engine.tree.root) == visits
+    check_transpositions(engine)
+    engine.ponder(50)
+    check_transpositions(engine)
+
+
+def test_reroot_promotes_transposition_outside_subtree():
+    tree = ArrayTree(["player"])
+    tree.transpose(tree.root, 0)
+    a, b = (
+        tree.new_node(id, tree.root, action)
+        for id, action in [(1, "a"), (2, "b")]
+    )
+    x = tree.new_node(3, a, "x")
+    y = tree.new_node(4, b, "y")
+    z = tree.new_node(5, x, "z")
+    for node, gamestate_hash in [(a, 1), (b, 2), (x, 3), (y, 3), (z, 4)]:
+        tree.transpose(node, gamestate_hash)
+    assert tree.resolve(y) == x
+    tree.backup_path([tree.root, a, x, z], [1.0])
+    tree.backup_path([tree.root, b, x], [0.5])
+
+    tree.reroot(
+        b,
+        lambda parent_id, action, attempt: hash((parent_id, action, attempt)),
+    )
+
+    # b's subtree is b -> y, and y takes over x (and its child z)
+    assert len(tree) == 3
+    y, (z, action) = tree.child(tree.root, 0)[0], tree.child(1, 0)
+    assert action == "z"
+    assert tree.resolve(y) == y
+    assert tree.visits(y) == 2 and tree.score(y, 0) == 1.5
+    assert tree.parent(z) == y
+    assert tree.table == {2: tree.root, 3: y, 4: z}
+    assert not tree.transposed
+
+
+def test_root_parallel_ponder_merges_root_statistics():
+    random.seed(8)
+    gamestate = connect4_middlegame()
+    engine = Engine(connect4_config(n_workers=2), copy.deepcopy(gamestate))
+    try:
+        walk_logs, action = engine.ponder(101)
+        engine.ponder(50)
+    finally:
+        engine.close()
+
+    tree = engine.tree
+    assert walk_logs == []
+    assert engine.n_walks_produced == 151
+    assert tree.visits(tree.root) == 151
+    assert sum(tree.visits(c) for c, _ in tree.children(tree.root)) == 151
+    assert action in connect4_rules.get_all_actions(gamestate)
+
+
+def test_tree_parallel_ponder_shares_one_tree():
+    random.seed(9)
+    gamestate = connect4_middlegame()
+    config = connect4_config(n_workers=2, parallelism="tree")
+    engine = Engine(config, copy.deepcopy(gamestate))
+    try:
+        engine.ponder(200)
+        _, action = engine.ponder(100)
+
+        shared = engine._shared_tree
+        n = len(shared)
+        assert shared.visit_counts[shared.root] == 300
+        # every walk took its virtual losses back
+        assert (shared.virtual[:n] == 0).all()
+        for node in range(n):
+            if shared.is_expanded(node) and shared.num_children(node) > 0:
+                start, end = shared.child_range(node)
+                assert (shared.parents[start:end] == node).all()
+                assert (
+                    shared.visit_counts[start:end].sum()
+                    <= shared.visit_counts[node]
+                )
+
+        tree = engine.tree
+        assert tree.visits(tree.root) == 300
+        assert [tree.visits(c) for c, _ in tree.children(tree.root)] == list(
+            shared.root_stats()[0][1:]
+        )
+        assert action in connect4_rules.get_all_actions(gamestate)
+
+        engine.advance([action])
+        assert engine._shared_tree is None
+
+        # a budget so small that no walk finishes leaves the new shared tree
+        # without even a root expansion
+        tree = engine.tree
+        visits = tree.visits(tree.root)
+        _, action = engine.ponder(nseconds=1e-6)
+        assert tree.visits(tree.root) == visits
+        assert action in connect4_rules.get_all_actions(engine.root_gamestate)
+        engine.ponder(50)
+        assert tree.visits(tree.root) == visits + 50
+    finally:
+        engine.close()
+
+
+def test_ponder_time_budget():
+    random.seed(10)
+    engine = Engine(connect4_config(), connect4_middlegame())
+    start = time.perf_counter()
+    walk_logs, _ = engine.ponder(nseconds=0.2)
+    elapsed = time.perf_counter() - start
+    assert 0.2 <= elapsed < 0.5
+    assert len(walk_logs) > 0
+    assert engine.tree.visits(engine.tree.root) == len(walk_logs)
+
+    # whichever budget runs out first
+    walk_logs, _ = engine.ponder(n_walks=10, nseconds=10)
+    assert len(walk_logs) == 10
+
+
+def test_ponder_early_stop():
+    random.seed(11)
+    # X to move and wins in column 3
+    gamestate = connect4_rules.init_game()
+    for col in [0, 0, 1, 1, 2, 6]:
+        connect4_rules.take_action_mut(gamestate, (col, gamestate.player))
+    engine = Engine(connect4_config(early_stop=True), gamestate)
+    walk_logs, action = engine.ponder(n_walks=2000)
+    assert action == (3, "X")
+    assert len(walk_logs) < 2000
+
+    tree = engine.tree
+    visits = sorted(tree.visits(c) for c, _ in tree.children(tree.root))
+    assert visits[-1] - visits[-2] > 2000 - len(walk_logs)
+
+
+def test_ponder_interrupt():
+    random.seed(12)
+    engine = Engine(connect4_config(), connect4_middlegame())
+    timer = threading.Timer(0.1, engine.interrupt)
+    timer.start()
+    start = time.perf_counter()
+    walk_logs, action = engine.ponder(nseconds=10)
+    assert time.perf_counter() - start < 1
+    assert len(walk_logs) > 0
+    assert action in connect4_rules.get_all_actions(connect4_middlegame())
+
+    # an interrupt between two ponders ends the next one, and only that one
+    engine.interrupt()
+    walk_logs, _ = engine.ponder(n_walks=100)
+    assert walk_logs == []
+    walk_logs, _ = engine.ponder(n_walks=100)
+    assert len(walk_logs) == 100
+
+
+@pytest.mark.parametrize("parallelism", ["root", "tree"])
+def test_parallel_ponder_interrupt(parallelism):
+    random.seed(17)
+    config = connect4_config(n_workers=2, parallelism=parallelism)
+    engine = Engine(config, connect4_middlegame())
+    try:
+        engine.ponder(n_walks=20)
+        timer = threading.Timer(0.3, engine.interrupt)
+        timer.start()
+        start = time.perf_counter()
+        engine.ponder(nseconds=10)
+        assert time.perf_counter() - start < 3
+
+        # the interrupt is cleared on the way out, and one that comes between
+        # two ponders ends the next one
+        engine.interrupt()
+        n_walks = engine.n_walks_produced
+        engine.ponder(n_walks=100)
+        assert engine.n_walks_produced == n_walks
+        engine.ponder(n_walks=100)
+        assert engine.n_walks_produced == n_walks + 100
+    finally:
+        engine.close()
+
+
+def test_parallel_ponder_early_stop():
+    random.seed(18)
+    gamestate = connect4_rules.init_game()
+    for col in [0, 0, 1, 1, 2, 6]:
+        connect4_rules.take_action_mut(gamestate, (col, gamestate.player))
+    config = connect4_config(n_workers=2, parallelism="tree", early_stop=True)
+    engine = Engine(config, gamestate)
+    try:
+        _, action = engine.ponder(n_walks=2000)
+    finally:
+        engine.close()
+    assert action == (3, "X")
+    assert engine.n_walks_produced < 2000
+
+    # root parallel workers start a new tree every ponder
+    with pytest.raises(NotImplementedError):
+        Engine(dataclasses.replace(config, parallelism="root"), gamestate)
+
+
+def test_children_are_materialized_lazily():
+    random.seed(13)
+    gamestate = connect4_middlegame()
+    producer = Engine(connect4_config(), copy.deepcopy(gamestate))
+    walk_logs, _ = producer.ponder(100)
+
+    tree = producer.tree
+    new_nodes = [
+        e for w in walk_logs for e in w if e["event-type"] == "new-node"
+    ]
+    # a walk materializes at most the child it selects and the child it
+    # steps into after expanding, instead of every child of what it expands
+    assert len(new_nodes) == len(tree.index_of) - 1 <= 200
+    assert len(tree.index_of) < len(tree)
+    # the slots hold their actions until they are materialized
+    assert None not in tree.actions[1:]
+
+    consumer = Engine(connect4_config(), copy.deepcopy(gamestate))
+    for walk_log in walk_logs:
+        consumer.consume_walk_log(
+            [e for e in walk_log if e["event-type"] != "take-action"]
+        )
+    assert consumer.tree.index_of.keys() == tree.index_of.keys()
+    for id, node in tree.index_of.items():
+        assert consumer.tree.visits(consumer.tree.handle(id)) == tree.visits(
+            node
+        )
+    assert subtree_size(consumer.tree, consumer.tree.root) == len(tree)
+
+    # the consumer can keep searching the tree it was sent
+    consumer.ponder(100)
+    assert consumer.tree.visits(consumer.tree.root) == 200
+
+
+def max_depth(tree, node) -> int:
+    children = [
+        child for child, _ in tree.children(node) if tree.visits(child) > 0
+    ]
+    return 1 + max((max_depth(tree, child) for child in children), default=0)
+
+
+def test_progressive_widening():
+    depths = []
+    for widening_k in [None, 1.0]:
+        random.seed(14)
+        engine = Engine(
+            t2048_config(widening_k=widening_k), t2048_gamestate(seed=6)
+        )
+        engine.ponder(300)
+        tree = engine.tree
+        depths.append(max_depth(tree, tree.root))
+
+        if widening_k is None:
+            continue
+        for node in range(len(tree)):
+            if not tree.is_expanded(node):
+                continue
+            visited = sum(tree.visits(c) > 0 for c, _ in tree.children(node))
+            assert visited <= max(1, math.ceil(tree.visits(node) ** 0.5))
+
+    assert depths[1] > depths[0]
+
+
+def test_progressive_widening_orders_children_by_prior():
+    random.seed(15)
+    gamestate = connect4_middlegame()
+    config = connect4_config(
+        widening_k=1.0,
+        action_prior=connect4_rules.action_prior,
+    )
+    engine = Engine(config, copy.deepcopy(gamestate))
+    engine.ponder(4)
+
+    # the root has been visited at most 3 times when selecting, so only the
+    # first two children (by prior: the center column, then 2 or 4) are
+    # reachable
+    tree = engine.tree
+    visited = [a for c, a in tree.children(tree.root) if tree.visits(c) > 0]
+    assert visited[0] == (3, "X")
+    assert {col for col, _ in visited} <= {3, 2, 4}
+
+
+def test_progressive_widening_survives_advance():
+    random.seed(16)
+    engine = Engine(
+        connect4_config(widening_k=1.0), connect4_rules.init_game()
+    )
+    engine.ponder(300)
+    tree = engine.tree
+    _, action = max(tree.children(tree.root), key=lambda c: tree.visits(c[0]))
+    assert engine.advance([action])
+    engine.ponder(1500)
+
+    # the children a node got before the advance and the ones it got after
+    # come from the same order
+    tree = engine.tree
+    for node in range(len(tree)):
+        if tree.is_expanded(node):
+            actions = [action for _, action in tree.children(node)]
+            assert len(actions) == len(set(actions))
+
+
+def test_action_codec():
+    codec = dict(
+        action_to_int=connect4_rules.action_to_int,
+        int_to_action=connect4_rules.int_to_action,
+    )
+    results = []
+    for kwargs in [{}, codec]:
+        engine = Engine(connect4_config(**kwargs), connect4_middlegame())
+        random.seed(0)
+        walk_logs, action = engine.ponder(200)
+        tree = engine.tree
+        results.append(
+            (
+                [
+                    (engine._decode(a), tree.visits(c), tree.score(c, 0))
+                    for c, a in tree.children(tree.root)
+                ],
+                action,
+            )
+        )
+    assert results[0] == results[1]
+
+    # the tree and walk logs only hold action codes
+    assert all(
+        isinstance(e["action"], int)
+        for walk_log in walk_logs
+        for e in walk_log
+        if "action" in e
+    )
+    consumer = Engine(connect4_config(**codec), connect4_middlegame())
+    for walk_log in walk_logs:
+        consumer.consume_walk_log(
+            [e for e in walk_log if e["event-type"] != "take-action"]
+        )
+    assert root_child_stats(consumer) == root_child_stats(engine)
+
+    # ... and ponder/advance take and return actions
+    assert isinstance(action, tuple)
+    assert engine.advance([action])
+
+
+def test_node_id_collisions_are_recovered():
+    codec = dict(
+        action_to_int=connect4_rules.action_to_int,
+        int_to_action=connect4_rules.int_to_action,
+    )
+    for tree_type in ["dict", "array"]:
+        engines = [
+            Engine(
+                connect4_config(tree_type=tree_type, **codec),
+                connect4_middlegame(),
+            )
+            for _ in range(2)
+        ]
+        for engine in engines:
+            # every child wants id 0 (the root's), then 1, 2, ...
+            engine._child_id = lambda parent_id, action, attempt=0: attempt
+        producer, consumer = engines
+        random.seed(0)
+        walk_logs, action = producer.ponder(100)
+        assert producer.n_id_collisions > 0
+        for walk_log in walk_logs:
+            consumer.consume_walk_log(
+                [e for e in walk_log if e["event-type"] != "take-action"]
+            )
+        assert consumer.n_walks_dropped == 0
+        assert root_child_stats(consumer) == root_child_stats(producer)
+
+        assert producer.advance([action])
+        tree = producer.tree
+        nodes = [tree.root]
+        for node in nodes:
+            if tree.is_expanded(node):
+                nodes.extend(child for child, _ in tree.children(node))
+        ids = [tree.node_id(node) for node in nodes]
+        assert len(ids) > 1 and len(set(ids)) == len(ids)
+        assert all(tree.handle(id) == node for id, node in zip(ids, nodes))
+
+
+def test_foreign_node_id_collision_drops_walks():
+    engine = Engine(connect4_config(), connect4_middlegame())
+    engine.ponder(50)
+    tree = engine.tree
+    (a, _), (b, _) = tree.children(tree.root)[:2]
+    grandchild, _ = tree.children(a)[0]
+    visits = tree.visits(tree.root)
+
+    # another engineserver used grandchild's id for a child of b
+    foreign_id = tree.node_id(grandchild)
+    engine.consume_walk_log(
+        [
+            {
+                "event-type": "new-node",
+                "id": foreign_id,
+                "parent_id": tree.node_id(b),
+                "action": (0, "X"),
+            },
+            {
+                "event-type": "new-node",
+                "id": 12345,
+                "parent_id": foreign_id,
+                "action": (0, "O"),
+            },
+            {
+                "event-type": "walk-result",
+                "scores": [1.0, 0.0],
+                "node_id": 12345,
+            },
+        ]
+    )
+    assert engine.n_walks_dropped == 1
+    assert tree.visits(tree.root) == visits
+    assert tree.handle(12345) is None
+
+
+def test_scratch_state_walks_like_fresh_copies():
+    results = []
+    for kwargs in [
+        {},
+        dict(
+            clone_gamestate=connect4_rules.clone_gamestate,
+            scratch_state=True,
+        ),
+    ]:
+        engine = Engine(connect4_config(**kwargs), connect4_middlegame())
+        random.seed(0)
+        walk_logs, action = engine.ponder(200)
+        assert engine.advance([action])
+        walk_logs += engine.ponder(100)[0]
+        results.append((walk_logs, root_child_stats(engine)))
+    assert results[0] == results[1]
+
+    with pytest.raises(Exception, match="undo_action"):
+        Engine(t2048_config(scratch_state=True), t2048_gamestate(seed=0))
+
+
+def test_ponder_without_walk_logs():
+    results = []
+    for kwargs in [
+        {},
+        dict(record_walk_logs=False),
+        dict(record_walk_logs=False, scratch_state=True),
+    ]:
+        engine = Engine(connect4_config(**kwargs), connect4_middlegame())
+        random.seed(0)
+        walk_logs, action = engine.ponder(200)
+        assert bool(walk_logs) == engine.config.record_walk_logs
+        assert engine.n_walks_produced == 200
+        results.append((root_child_stats(engine), action))
+    assert results[0] == results[1] == results[2]
+
+
+def test_walk_results_carry_scores_by_player_index():
+    config = connect4_config(tree_type="dict")
+    assert config.player_index == {"X": 0, "O": 1}
+    engine = Engine(config, connect4_middlegame())
+    walk_logs, _ = engine.ponder(50)
+    totals = [0.0, 0.0]
+    for walk_log in walk_logs:
+        (result,) = [e for e in walk_log if e["event-type"] == "walk-result"]
+        assert len(result["scores"]) == 2
+        totals = [a + b for a, b in zip(totals, result["scores"])]
+    tree = engine.tree
+    assert [tree.score(tree.root, p) for p in range(2)] == totals
+
+
+def test_dict_tree_recycles_nodes():
+    engine = Engine(connect4_config(tree_type="dict"), connect4_middlegame())
+    _, action = engine.ponder(100)
+    tree = engine.tree
+    assert not hasattr(tree.nodes[tree.root], "__dict__")
+
+    n_nodes = len(tree)
+    assert engine.advance([action])
+    assert len(tree.pool) == n_nodes - len(tree) > 0
+
+    # new nodes come out of the pool, reset
+    n_free = len(tree.pool)
+    walk_logs, _ = engine.ponder(20)
+    n_new = sum(
+        e["event-type"] == "new-node" for log in walk_logs for e in log
+    )
+    assert len(tree.pool) == max(0, n_free - n_new)
+    for node in tree.nodes.values():
+        assert node.times_visited > 0 or node.score_sums == [0.0, 0.0]
+
+    # a reset hands every node of the old tree to the new one (whose root
+    # takes one of them)
+    n_free, n_nodes = len(tree.pool), len(tree)
+    engine.reset(connect4_middlegame())
+    assert engine.tree.pool is tree.pool
+    assert len(tree.pool) == n_free + n_nodes - 1
+
+
+def test_stats_snapshot():
+    engine = Engine(connect4_config(), connect4_middlegame())
+    engine.ponder(50)
+    stats = engine.stats()
+    assert stats.n_walks_produced == 50 and stats.walks_per_sec > 0
+    assert stats.tree_size == len(engine.tree)
+    # nothing is timed without config.profile
+    assert all(phase.calls == 0 for phase in stats.phases.values())
+
+    engine = Engine(connect4_config(profile=True), connect4_middlegame())
+    walk_logs, _ = engine.ponder(50)
+    engine.consume_walk_log([])
+    stats = engine.stats()
+    phases = stats.phases
+    for name in ["selection", "rollout", "backup", "restore"]:
+        assert phases[name].calls == 50 and phases[name].seconds > 0
+    assert 0 < phases["expansion"].calls <= 50
+    assert phases["consume"].calls == 1
+    assert stats.max_depth >= 1
+    assert "walks/s" in stats.format()
+
+    # a snapshot doesn't change with the engine
+    engine.ponder(10)
+    assert stats.phases["selection"].calls == 50
+
+
+def connect4_minimax_config(**kwargs) -> types.MinimaxConfig:
+    return types.MinimaxConfig(
+        action=types.MutableActionConfig(
+            take_action_mut=connect4_rules.take_action_mut,
+            undo_action=connect4_rules.undo_action,
+        ),
+        get_all_actions=connect4_rules.get_all_actions,
+        is_over=connect4_rules.is_over,
+        heuristic=connect4_heuristic,
+        # picklable, for n_workers > 1
+        get_player=operator.attrgetter("player"),
+        other_player=connect4_rules.other_player,
+        **kwargs,
+    )
+
+
+def connect4_openings(n: int, n_moves: int = 6):
+    random.seed(0)
+    for _ in range(n):
+        gamestate = connect4_rules.init_game()
+        for _ in range(n_moves):
+            action = connect4_rules.get_random_action(gamestate)
+            connect4_rules.take_action_mut(gamestate, action)
+        yield gamestate
+
+
+@pytest.mark.parametrize("order_actions", [None, connect4_rules.order_actions])
+def test_alphabeta_agrees_with_minimax(order_actions):
+    config = connect4_minimax_config(order_actions=order_actions)
+    for gamestate in connect4_openings(4):
+        before = copy.deepcopy(gamestate)
+
+        minimax_stats = types.MinimaxStats()
+        alphabeta_stats = types.MinimaxStats()
+        value, _ = minimax(config, gamestate, 3, minimax_stats)
+        ab_value, ab_action = alphabeta(config, gamestate, 3, alphabeta_stats)
+        assert ab_value == value
+        assert gamestate == before
+
+        # the action alphabeta returns is worth its value
+        connect4_rules.take_action_mut(gamestate, ab_action)
+        child_value, _ = minimax(config, gamestate, 2)
+        assert -child_value == value
+
+        assert alphabeta_stats.nodes < minimax_stats.nodes
+        assert alphabeta_stats.cutoffs > 0
+
+
+def test_alphabeta_finds_win():
+    config = connect4_minimax_config(
+        order_actions=connect4_rules.order_actions
+    )
+    # X has three in the bottom row and is to move
+    gamestate = connect4_rules.init_game()
+    for col in [0, 0, 1, 1, 2, 2]:
+        connect4_rules.take_action_mut(gamestate, (col, gamestate.player))
+    value, action = alphabeta(config, gamestate, 4)
+    assert value == float("inf")
+    assert action == (3, "X")
+
+
+def test_iterative_deepening_agrees_with_alphabeta():
+    plain = connect4_minimax_config(order_actions=connect4_rules.order_actions)
+    config = connect4_minimax_config(
+        order_actions=connect4_rules.order_actions,
+        hash_gamestate=connect4_rules.hash_gamestate,
+    )
+    for gamestate in connect4_openings(3):
+        before = copy.deepcopy(gamestate)
+        value, _ = alphabeta(plain, gamestate, 4)
+
+        tt_stats = types.MinimaxStats()
+        assert alphabeta(config, gamestate, 4, tt_stats)[0] == value
+
+        stats = types.MinimaxStats()
+        id_value, action = iterative_deepening(
+            config, gamestate, max_depth=4, stats=stats
+        )
+        assert gamestate == before
+        assert id_value == value and action is not None
+        assert stats.depth == 4 and stats.tt_hits > 0
+
+
+def test_iterative_deepening_time_budget():
+    config = connect4_minimax_config(
+        order_actions=connect4_rules.order_actions,
+        hash_gamestate=connect4_rules.hash_gamestate,
+    )
+    gamestate = connect4_rules.init_game()
+    before = copy.deepcopy(gamestate)
+    stats = types.MinimaxStats()
+    start = time.perf_counter()
+    _, action = iterative_deepening(
+        config, gamestate, nseconds=0.3, stats=stats
+    )
+    assert time.perf_counter() - start < 1.0
+    # the interrupted iteration left the gamestate as it was
+    assert gamestate == before
+    assert action in connect4_rules.get_all_actions(gamestate)
+    assert stats.depth >= 1
+
+    with pytest.raises(Exception):
+        iterative_deepening(config, gamestate)
+
+
+def test_transposition_table_is_bounded():
+    tt = TranspositionTable(capacity=8)
+    tt.new_search()
+    for key in range(100):
+        tt.put(key, 1, 0.0, 0, None)
+    assert len(tt) == 8
+    # a shallower entry doesn't replace a deeper one of the same search
+    tt.put(3, 5, 1.0, 0, None)
+    tt.put(11, 2, 2.0, 0, None)
+    assert tt.get(11) is None and tt.get(3).value == 1.0
+    # but does replace one of an earlier search
+    tt.new_search()
+    tt.put(11, 2, 2.0, 0, None)
+    assert tt.get(3) is None and tt.get(11).value == 2.0
+
+
+def test_split_root_agrees_with_serial_search():
+    serial = connect4_minimax_config(
+        order_actions=connect4_rules.order_actions,
+        hash_gamestate=connect4_rules.hash_gamestate,
+    )
+    parallel = dataclasses.replace(serial, n_workers=2)
+    with pytest.raises(Exception):
+        alphabeta(parallel, connect4_rules.init_game(), 4)
+
+    pool = MinimaxPool(parallel)
+    try:
+        for gamestate in connect4_openings(3):
+            before = copy.deepcopy(gamestate)
+            value, _ = alphabeta(serial, gamestate, 4)
+            stats = types.MinimaxStats()
+            parallel_value, action = alphabeta(
+                parallel, gamestate, 4, stats, pool=pool
+            )
+            assert gamestate == before
+            assert parallel_value == value
+            # the worker's nodes are counted too
+            assert stats.nodes > len(connect4_rules.get_all_actions(gamestate))
+
+            # the workers keep their tables between searches
+            again = types.MinimaxStats()
+            alphabeta(parallel, gamestate, 4, again, pool=pool)
+            assert again.nodes < stats.nodes
+
+            # the action is worth the value
+            connect4_rules.take_action_mut(gamestate, action)
+            assert -alphabeta(serial, gamestate, 3)[0] == value
+
+        _, action = iterative_deepening(
+            parallel, before, max_depth=3, pool=pool
+        )
+        assert action in connect4_rules.get_all_actions(before)
+    finally:
+        pool.close()
+
+
+def test_killer_moves_and_history_search_fewer_nodes():
+    config = connect4_minimax_config(
+        order_actions=connect4_rules.order_actions,
+        hash_gamestate=connect4_rules.hash_gamestate,
+    )
+    learned = dataclasses.replace(
+        config, killer_moves=True, history_heuristic=True
+    )
+    stats, learned_stats = types.MinimaxStats(), types.MinimaxStats()
+    history = HistoryTable()
+    for gamestate in connect4_openings(4):
+        before = copy.deepcopy(gamestate)
+        value, _ = alphabeta(config, gamestate, 4, stats)
+        learned_value, _ = alphabeta(
+            learned, gamestate, 4, learned_stats, history=history
+        )
+        assert gamestate == before
+        assert learned_value == value
+    assert learned_stats.nodes < stats.nodes
+    assert history.scores
+
+
+def test_history_table_ages():
+    history = HistoryTable()
+    history.add_cutoff((3, "X"), 4)
+    history.add_cutoff((3, "X"), 1)
+    history.add_cutoff((2, "X"), 1)
+    assert history.scores == {(3, "X"): 17, (2, "X"): 1}
+    history.new_search()
+    assert history.scores == {(3, "X"): 8}
+
+
+def test_batch_heuristic_gives_the_same_values():
+    config = connect4_minimax_config(
+        order_actions=connect4_rules.order_actions,
+        hash_gamestate=connect4_rules.hash_gamestate,
+        killer_moves=True,
+    )
+    batched = dataclasses.replace(
+        config, batch_heuristic=connect4_batch_heuristic
+    )
+    for gamestate in connect4_openings(3):
+        before = copy.deepcopy(gamestate)
+        assert minimax(batched, gamestate, 2) == minimax(config, gamestate, 2)
+        value, _ = alphabeta(config, gamestate, 4)
+        batched_value, action = alphabeta(batched, gamestate, 4)
+        assert gamestate == before
+        assert batched_value == value
+        connect4_rules.take_action_mut(gamestate, action)
+        assert -alphabeta(config, gamestate, 3)[0] == value
+
+    # children that end the game aren't passed to batch_heuristic
+    gamestate = connect4_rules.init_game()
+    for col in [0, 0, 1, 1, 2, 2]:
+        connect4_rules.take_action_mut(gamestate, (col, gamestate.player))
+    assert alphabeta(batched, gamestate, 1) == (float("inf"), (3, "X"))
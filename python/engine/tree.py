@@ -0,0 +1,685 @@
+"""
+Tree storage for engine.mctsv1.Engine
+
+Both trees hand out integer node handles and the engine only ever talks to the
+tree through handles. DictTree is the original layout (one types.Node per node
+in a dict, plus an edges dict) and uses the node id as the handle. ArrayTree is
+a struct of arrays: every per-node field is a numpy array indexed by a dense
+integer index, and the children of a node occupy a contiguous range of
+indices.
+
+Node ids are still what goes into walk logs, since they have to agree across
+engineservers. tree.handle(id) / tree.node_id(handle) convert between the two.
+
+ArrayTree children are lazy: expanding a node reserves a slot for every child
+(the numpy fields of all of them are written at once), but a child only gets
+its id and action, i.e. is materialized, the first time a walk steps into it.
+DictTree children are created up front.
+"""
+import typing as t
+
+import numpy as np
+
+import engine.typesv1 as types
+
+
+G = t.TypeVar("G")  # gamestate
+A = t.TypeVar("A")  # action
+P = t.TypeVar("P")  # player
+
+NO_PARENT = -1
+
+# ArrayTree.ids of a child slot that hasn't been materialized
+UNMATERIALIZED = -1
+
+Handle = int
+
+# child_id(parent_id, action, attempt) is the id of a child, attempt > 0
+# giving the ids to try when the earlier ones are taken
+ChildIdFn = t.Callable[[types.NodeId, A, int], types.NodeId]
+
+
+def _free_child_id(
+    child_id: ChildIdFn,
+    parent_id: types.NodeId,
+    action: A,
+    taken: t.Container[types.NodeId],
+) -> types.NodeId:
+    attempt = 0
+    id = child_id(parent_id, action, attempt)
+    while id in taken:
+        attempt += 1
+        id = child_id(parent_id, action, attempt)
+    return id
+
+
+class NodePool:
+    """
+    types.Node objects of discarded subtrees, handed out again by
+    DictTree.new_node instead of allocating new ones
+    """
+
+    def __init__(self, nplayers: int):
+        self.nplayers = nplayers
+        self.free: t.List[types.Node] = []
+
+    def __len__(self) -> int:
+        return len(self.free)
+
+    def acquire(
+        self,
+        id: types.NodeId,
+        parent_id: types.NodeId,
+        heuristic_val: t.Optional[types.HeuristicVal],
+    ) -> types.Node:
+        if self.free:
+            node = self.free.pop()
+            node.reset(id, parent_id, heuristic_val)
+            return node
+        return types.Node(id, parent_id, self.nplayers, heuristic_val)
+
+    def release(self, nodes: t.Iterable[types.Node]):
+        self.free.extend(nodes)
+
+
+class DictTree(types.Tree[G, A]):
+    """
+    Reference tree. Handles are node ids. Nodes dropped by reroot (or of a
+    tree passed to make_tree as <reuse>) go to self.pool
+    """
+
+    def __init__(self, players: t.List[P], pool: t.Optional[NodePool] = None):
+        super().__init__(nodes={}, edges={})
+        self.players = players
+        self.pool = NodePool(len(players)) if pool is None else pool
+        self.root = self.new_node(0, NO_PARENT, None)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def new_node(
+        self,
+        id: types.NodeId,
+        parent: Handle,
+        action: t.Optional[A],
+        heuristic_val: t.Optional[types.HeuristicVal] = None,
+    ) -> Handle:
+        """
+        This method temporarily brakes the invariant that a node either has all
+        it's children in the tree or none of it's children (with None)
+        """
+        nodes, edges = self.nodes, self.edges
+        assert id not in nodes, f"nnodes {len(nodes)} id {id}"
+        child_node = self.pool.acquire(id, parent, heuristic_val)
+        nodes[child_node.id] = child_node
+        if parent != NO_PARENT:
+            # TODO: is this safe? We want to maintain the invariant that
+            # either all of a nodes children are in the tree or
+            # children(parent) = None
+            edges.setdefault(parent, [])
+            edges[parent].append((child_node.id, action))
+        return child_node.id
+
+    def handle(self, id: types.NodeId) -> t.Optional[Handle]:
+        return id if id in self.nodes else None
+
+    def node_id(self, node: Handle) -> types.NodeId:
+        return node
+
+    def resolve(self, node: Handle) -> Handle:
+        return node
+
+    def is_materialized(self, node: Handle) -> bool:
+        return True
+
+    def is_expanded(self, node: Handle) -> bool:
+        return self.edges.get(node) is not None
+
+    def set_expanded(self, node: Handle):
+        assert self.edges.get(node) is None
+        self.edges[node] = []
+
+    def num_children(self, node: Handle) -> int:
+        return len(self.edges[node])
+
+    def child(self, node: Handle, k: int) -> t.Tuple[Handle, A]:
+        return self.edges[node][k]
+
+    def children(self, node: Handle) -> t.List[t.Tuple[Handle, A]]:
+        return self.edges[node]
+
+    def parent(self, node: Handle) -> Handle:
+        return self.nodes[node].parent_id
+
+    def visits(self, node: Handle) -> int:
+        return self.nodes[node].times_visited
+
+    def score(self, node: Handle, player: int) -> float:
+        return self.nodes[node].score_sums[player]
+
+    def heuristic_val(self, node: Handle) -> t.Optional[types.HeuristicVal]:
+        return self.nodes[node].heuristic_val
+
+    def backup(self, node: Handle, scores: t.Sequence[float]):
+        nodes = self.nodes
+        node_obj = nodes.get(node)
+        indices = range(len(scores))
+        while node_obj is not None:
+            node_obj.times_visited += 1
+            score_sums = node_obj.score_sums
+            for i in indices:
+                score_sums[i] += scores[i]
+            node_obj = nodes.get(node_obj.parent_id)
+
+    def add_stats(self, node: Handle, visits: int, scores: t.Sequence[float]):
+        """ Add statistics gathered elsewhere to <node> (not its parents) """
+        node_obj = self.nodes[node]
+        node_obj.times_visited += visits
+        for i, val in enumerate(scores):
+            node_obj.score_sums[i] += val
+
+    def best_action(self, node: Handle, player: int) -> A:
+        action_value_pairs = [
+            (action, child.score_sums[player] / float(child.times_visited))
+            for (child, action) in (
+                (self.nodes[child_id], action)
+                for (child_id, action) in self.edges[node]
+            )
+            if child.times_visited > 0  # this shouldn't happen
+        ]
+        action, _ = max(action_value_pairs, key=lambda x: x[1])
+        return action
+
+    def reroot(self, node: Handle, child_id: ChildIdFn):
+        """
+        Make <node> the root, dropping everything outside of its subtree. The
+        subtree is relabeled top down with child_id(parent_id, action, 0),
+        starting from id 0 at the new root, so the ids agree with a tree that
+        was built from scratch at the new root (a taken id moves on to the
+        next attempt)
+        """
+        nodes, edges = {}, {}
+        taken = {0}
+        kept = set()  # old ids
+        queue = [(node, 0, NO_PARENT)]  # (old id, new id, new parent id)
+        for old_id, new_id, new_parent_id in queue:
+            kept.add(old_id)
+            node_obj = self.nodes[old_id]
+            node_obj.id, node_obj.parent_id = new_id, new_parent_id
+            nodes[new_id] = node_obj
+            if old_id in self.edges:
+                edges[new_id] = []
+                for old_child_id, action in self.edges[old_id]:
+                    new_child_id = _free_child_id(
+                        child_id, new_id, action, taken
+                    )
+                    taken.add(new_child_id)
+                    edges[new_id].append((new_child_id, action))
+                    queue.append((old_child_id, new_child_id, new_id))
+        self.pool.release(
+            node_obj
+            for old_id, node_obj in self.nodes.items()
+            if old_id not in kept
+        )
+        self.nodes, self.edges = nodes, edges
+        self.root = 0
+
+
+class ArrayTree(t.Generic[G, A]):
+    """
+    Struct of arrays tree. Handles are dense indices into the arrays below.
+    Children of a node are stored contiguously at
+    [child_start[i], child_start[i] + child_count[i]). child_start is -1 for a
+    node that hasn't been expanded.
+
+    With transpositions the tree is a DAG. The first node to reach a position
+    is that position's canonical node, and any other node that reaches the
+    same position links to it (links[i]) instead of getting statistics and
+    children of its own. links[i] is -1 for a node whose position hasn't been
+    looked up yet (or when transpositions are off).
+
+    reserve() allocates the slots of all children of a node at once, with
+    ids[i] == UNMATERIALIZED and their actions if they are known (None
+    otherwise, see set_slot_actions). materialize() gives a slot its id.
+    child_stats, child_range etc. cover every slot (a slot that isn't
+    materialized has never been visited), children() only the materialized
+    ones.
+    """
+
+    def __init__(self, players: t.List[P], capacity: int = 1024):
+        self.players = players
+        self.n = 0
+        self.capacity = capacity
+
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.parents = np.full(capacity, NO_PARENT, dtype=np.int64)
+        self.visit_counts = np.zeros(capacity, dtype=np.int64)
+        self.score_sums = np.zeros((capacity, len(players)), dtype=np.float64)
+        self.child_start = np.full(capacity, -1, dtype=np.int64)
+        self.child_count = np.zeros(capacity, dtype=np.int64)
+
+        # pre-visit heuristic (numerator, denominator). denominator 0 means the
+        # node has no heuristic value
+        self.prior_num = np.zeros(capacity, dtype=np.float64)
+        self.prior_den = np.zeros(capacity, dtype=np.int64)
+
+        self.links = np.full(capacity, -1, dtype=np.int64)
+        # gamestate hash -> canonical node. Only used with transpositions
+        self.table: t.Dict[int, Handle] = {}
+        # whether any node links to a node other than itself
+        self.transposed = False
+
+        self.actions: t.List[t.Optional[A]] = []
+        self.index_of: t.Dict[types.NodeId, Handle] = {}
+
+        self.root = self.new_node(0, NO_PARENT, None)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _grow(self, min_capacity: int = 0):
+        capacity = max(2 * self.capacity, min_capacity)
+        for name in [
+            "ids",
+            "parents",
+            "visit_counts",
+            "score_sums",
+            "child_start",
+            "child_count",
+            "prior_num",
+            "prior_den",
+            "links",
+        ]:
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[: self.n] = old[: self.n]
+            setattr(self, name, new)
+        self.capacity = capacity
+
+    def new_node(
+        self,
+        id: types.NodeId,
+        parent: Handle,
+        action: t.Optional[A],
+        heuristic_val: t.Optional[types.HeuristicVal] = None,
+    ) -> Handle:
+        """
+        Siblings must be added one after the other (which is how _expand and
+        walk logs produce them) so that children stay contiguous
+        """
+        assert id not in self.index_of, f"nnodes {self.n} id {id}"
+        if self.n == self.capacity:
+            self._grow()
+        i = self.n
+        self.n += 1
+
+        self.ids[i] = id
+        self.parents[i] = parent
+        self.visit_counts[i] = 0
+        self.score_sums[i] = 0
+        self.child_start[i] = -1
+        self.child_count[i] = 0
+        self.links[i] = -1
+        if heuristic_val is None:
+            self.prior_num[i], self.prior_den[i] = 0, 0
+        else:
+            self.prior_num[i] = heuristic_val.numerator
+            self.prior_den[i] = heuristic_val.denominator
+        self.actions.append(action)
+        self.index_of[id] = i
+
+        if parent != NO_PARENT:
+            if self.child_start[parent] == -1:
+                self.child_start[parent] = i
+            assert (
+                self.child_start[parent] + self.child_count[parent] == i
+            ), f"children of node {parent} are not contiguous"
+            self.child_count[parent] += 1
+        return i
+
+    def reserve(
+        self,
+        node: Handle,
+        n_children: int,
+        heuristic_val: t.Optional[types.HeuristicVal] = None,
+        actions: t.Optional[t.List[A]] = None,
+    ) -> int:
+        """
+        Expand <node> with <n_children> unmaterialized child slots and return
+        the index of the first one. <actions> are the actions of the slots, in
+        order. The slots keep them until they are materialized, so they move
+        with the slots in a reroot
+        """
+        assert self.child_start[node] == -1
+        start, end = self.n, self.n + n_children
+        if end > self.capacity:
+            self._grow(end)
+        self.n = end
+
+        self.ids[start:end] = UNMATERIALIZED
+        self.parents[start:end] = node
+        self.visit_counts[start:end] = 0
+        self.score_sums[start:end] = 0
+        self.child_start[start:end] = -1
+        self.child_count[start:end] = 0
+        self.links[start:end] = -1
+        if heuristic_val is None:
+            self.prior_num[start:end], self.prior_den[start:end] = 0, 0
+        else:
+            self.prior_num[start:end] = heuristic_val.numerator
+            self.prior_den[start:end] = heuristic_val.denominator
+        if actions is None:
+            self.actions.extend([None] * n_children)
+        else:
+            assert len(actions) == n_children
+            self.actions.extend(actions)
+
+        self.child_start[node] = start
+        self.child_count[node] = n_children
+        return start
+
+    def is_materialized(self, node: Handle) -> bool:
+        return self.ids[node] != UNMATERIALIZED
+
+    def materialize(self, node: Handle, id: types.NodeId, action: A):
+        assert id not in self.index_of, f"nnodes {self.n} id {id}"
+        assert self.ids[node] == UNMATERIALIZED
+        self.ids[node] = id
+        self.actions[node] = action
+        self.index_of[id] = node
+
+    def set_slot_actions(self, node: Handle, actions: t.List[A]):
+        """
+        Actions of the slots of <node> (all of them, in order) when they were
+        reserved without. Materialized slots keep the action they have and
+        the other slots get the rest of <actions>, in order, so no action
+        ends up in two slots even if <actions> isn't the order the slots were
+        materialized in (e.g. the node's id changed in a reroot)
+        """
+        start, end = self.child_range(node)
+        slots = range(start, end)
+        taken = [self.actions[i] for i in slots if self.is_materialized(i)]
+        rest = iter([action for action in actions if action not in taken])
+        for i in slots:
+            if not self.is_materialized(i):
+                self.actions[i] = next(rest)
+
+    def handle(self, id: types.NodeId) -> t.Optional[Handle]:
+        return self.index_of.get(id)
+
+    def alias(self, id: types.NodeId, node: Handle):
+        """ Make <id> refer to <node> as well """
+        self.index_of.setdefault(id, node)
+
+    def resolve(self, node: Handle) -> Handle:
+        link = int(self.links[node])
+        return node if link == -1 else link
+
+    def transpose(self, node: Handle, gamestate_hash: int) -> Handle:
+        """
+        Link <node> to the canonical node for its position and return the
+        canonical node (which is <node> itself if it's the first node to reach
+        the position)
+        """
+        link = int(self.links[node])
+        if link != -1:
+            return link
+        canonical = self.table.setdefault(gamestate_hash, node)
+        self.links[node] = canonical
+        if canonical != node:
+            self.transposed = True
+            # node may already have been backed up through walk logs from
+            # other engineservers before we looked it up
+            self.visit_counts[canonical] += self.visit_counts[node]
+            self.score_sums[canonical] += self.score_sums[node]
+        return canonical
+
+    def find_child(self, node: Handle, action: A) -> t.Optional[Handle]:
+        start, end = self.child_range(node)
+        return next(
+            (
+                i
+                for i in range(start, end)
+                if self.ids[i] != UNMATERIALIZED and self.actions[i] == action
+            ),
+            None,
+        )
+
+    def node_id(self, node: Handle) -> types.NodeId:
+        return int(self.ids[node])
+
+    def is_expanded(self, node: Handle) -> bool:
+        return self.child_start[node] != -1
+
+    def set_expanded(self, node: Handle):
+        assert self.child_start[node] == -1
+        # children will be allocated starting at the next free index
+        self.child_start[node] = self.n
+
+    def num_children(self, node: Handle) -> int:
+        return int(self.child_count[node])
+
+    def child_range(self, node: Handle) -> t.Tuple[int, int]:
+        start = int(self.child_start[node])
+        return start, start + int(self.child_count[node])
+
+    def child(self, node: Handle, k: int) -> t.Tuple[Handle, A]:
+        i = int(self.child_start[node]) + k
+        return i, self.actions[i]
+
+    def children(self, node: Handle) -> t.List[t.Tuple[Handle, A]]:
+        """ Materialized children """
+        start, end = self.child_range(node)
+        ids = self.ids
+        return [
+            (i, self.actions[i])
+            for i in range(start, end)
+            if ids[i] != UNMATERIALIZED
+        ]
+
+    def parent(self, node: Handle) -> Handle:
+        return int(self.parents[node])
+
+    def visits(self, node: Handle) -> int:
+        return int(self.visit_counts[node])
+
+    def score(self, node: Handle, player: int) -> float:
+        return float(self.score_sums[node, player])
+
+    def child_stats(
+        self, node: Handle, player: int
+    ) -> t.Tuple[np.ndarray, np.ndarray]:
+        """
+        (times visited, score sums for <player>) of every child of <node>, as
+        seen through links
+        """
+        start, end = self.child_range(node)
+        if not self.transposed:
+            return (
+                self.visit_counts[start:end],
+                self.score_sums[start:end, player],
+            )
+        targets = self.links[start:end]
+        targets = np.where(targets == -1, np.arange(start, end), targets)
+        return self.visit_counts[targets], self.score_sums[targets, player]
+
+    def heuristic_val(self, node: Handle) -> t.Optional[types.HeuristicVal]:
+        if self.prior_den[node] == 0:
+            return None
+        return types.HeuristicVal(
+            float(self.prior_num[node]), int(self.prior_den[node])
+        )
+
+    def backup(self, node: Handle, scores: t.Sequence[float]):
+        path = []
+        parents = self.parents
+        while node != NO_PARENT:
+            path.append(node)
+            node = int(parents[node])
+        # a path from a node to the root never repeats an index, so the
+        # buffered fancy-index += is safe here
+        self.visit_counts[path] += 1
+        self.score_sums[path] += scores
+
+    def backup_path(self, path: t.Sequence[Handle], scores: t.Sequence[float]):
+        """
+        Backup along the path a walk actually took. With transpositions a
+        node can have several parents, so parent pointers can't be followed.
+        A node that shows up in the path twice is only updated once.
+        """
+        self.visit_counts[path] += 1
+        self.score_sums[path] += scores
+
+    def add_stats(self, node: Handle, visits: int, scores: t.Sequence[float]):
+        """ Add statistics gathered elsewhere to <node> (not its parents) """
+        self.visit_counts[node] += visits
+        self.score_sums[node] += scores
+
+    def best_action(self, node: Handle, player: int) -> A:
+        start, end = self.child_range(node)
+        visits, score_sums = self.child_stats(node, player)
+        visited = visits > 0  # unvisited children shouldn't happen
+        assert visited.any(), "no visited children to pick an action from"
+        values = np.full(end - start, -np.inf)
+        values[visited] = score_sums[visited] / visits[visited]
+        return self.actions[start + int(np.argmax(values))]
+
+    def reroot(self, node: Handle, child_id: ChildIdFn):
+        """
+        Make <node> the root, dropping everything outside of its subtree. The
+        subtree is copied into fresh arrays in breadth first order (which
+        keeps children contiguous) and relabeled top down like
+        DictTree.reroot
+        """
+        node = self.resolve(node)
+
+        # With transpositions a canonical node can be reachable from the new
+        # root only through links, with the range it lives in being dropped.
+        # One of the kept nodes linking to it takes over its statistics and
+        # children
+        promoted: t.Dict[Handle, Handle] = {}
+        if self.transposed:
+            canonical = self.links[: self.n].copy()
+            unresolved = canonical == -1
+            canonical[unresolved] = np.arange(self.n)[unresolved]
+            reachable, queue, kept = {node}, [node], {node}
+            for x in queue:
+                start, end = self.child_range(x)
+                kept.update(range(start, end))
+                for slot, target in zip(
+                    range(start, end), canonical[start:end].tolist()
+                ):
+                    if target not in reachable:
+                        reachable.add(target)
+                        queue.append(target)
+                    if target != slot and target not in kept:
+                        promoted.setdefault(target, slot)
+            promoted = {
+                target: slot
+                for target, slot in promoted.items()
+                if target not in kept
+            }
+            for target, slot in promoted.items():
+                self.visit_counts[slot] = self.visit_counts[target]
+                self.score_sums[slot] = self.score_sums[target]
+                self.child_start[slot] = self.child_start[target]
+                self.child_count[slot] = self.child_count[target]
+                start, end = self.child_range(slot)
+                self.parents[start:end] = slot
+            links = self.links[: self.n]
+            for target, slot in promoted.items():
+                links[links == target] = slot
+                links[slot] = slot
+
+        order = [node]
+        i = 0
+        while i < len(order):
+            x = order[i]
+            if self.links[x] == -1 or self.links[x] == x:
+                start, end = self.child_range(x)
+                order.extend(range(start, end))
+            i += 1
+        order = np.array(order, dtype=np.int64)
+        n = len(order)
+        remap = np.full(self.n, NO_PARENT, dtype=np.int64)
+        remap[order] = np.arange(n)
+
+        capacity = max(1024, 1 << (n - 1).bit_length())
+        for name in [
+            "ids",
+            "parents",
+            "visit_counts",
+            "score_sums",
+            "child_start",
+            "child_count",
+            "prior_num",
+            "prior_den",
+            "links",
+        ]:
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:n] = old[order]
+            setattr(self, name, new)
+        self.n, self.capacity = n, capacity
+
+        self.parents[0] = NO_PARENT
+        self.parents[1:n] = remap[self.parents[1:n]]
+        has_children = self.child_count[:n] > 0
+        self.child_start[:n][has_children] = remap[
+            self.child_start[:n][has_children]
+        ]
+        linked = self.links[:n] != -1
+        self.links[:n][linked] = remap[self.links[:n][linked]]
+        # nodes linking elsewhere don't own children
+        not_canonical = linked & (self.links[:n] != np.arange(n))
+        self.child_start[:n][not_canonical] = -1
+        self.child_count[:n][not_canonical] = 0
+        self.transposed = bool(not_canonical.any())
+        self.table = {
+            h: int(remap[promoted.get(c, c)])
+            for h, c in self.table.items()
+            if remap[promoted.get(c, c)] != NO_PARENT
+        }
+
+        self.actions = [self.actions[i] for i in order]
+        self.actions[0] = None
+        self.ids[0] = 0
+        self.index_of = {0: 0}
+        # breadth first order, so parents are relabeled before their children
+        for i in range(1, n):
+            if self.ids[i] != UNMATERIALIZED:
+                id = _free_child_id(
+                    child_id,
+                    int(self.ids[self.parents[i]]),
+                    self.actions[i],
+                    self.index_of,
+                )
+                self.ids[i] = id
+                self.index_of[id] = i
+        self.root = 0
+
+
+Tree = t.Union[DictTree, ArrayTree]
+
+
+def make_tree(
+    tree_type: str, players: t.List[P], reuse: t.Optional[Tree] = None
+) -> Tree:
+    """
+    <reuse> is a tree that is being thrown away. A DictTree recycles its
+    nodes
+    """
+    if tree_type == "array":
+        return ArrayTree(players)
+    elif tree_type == "dict":
+        pool = None
+        if (
+            isinstance(reuse, DictTree)
+            and reuse.pool.nplayers == len(players)
+        ):
+            pool = reuse.pool
+            pool.release(reuse.nodes.values())
+            reuse.nodes, reuse.edges = {}, {}
+        return DictTree(players, pool)
+    else:
+        raise Exception(f"Unknown tree_type {tree_type}")
@@ -1,5 +1,5 @@
 import math
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import typing as t
 
 
@@ -17,25 +17,66 @@ class HeuristicVal(t.NamedTuple):
 
 ScoreVec = t.Dict[P, float]
 
+# scores of every player, indexed by MctsConfig.player_index
+Scores = t.List[float]
+
 WalkLog = t.List[t.Dict[str, t.Any]]
 
 # A node is not 1:1 with gamestate. A node is a series of actions from the
 # root. So two nodes can have the same gamestates if the sequence of actions to
-# the two nodes lead to the same gamestate
-@dataclass
+# the two nodes lead to the same gamestate (unless MctsConfig.hash_gamestate is
+# given, see engine.tree.ArrayTree)
 class Node(t.Generic[A]):
-    id: NodeId
-    parent_id: t.Optional[NodeId]
+    """
+    Node of engine.tree.DictTree. Slotted (no __dict__ per node) since
+    engineserver trees get to millions of nodes. The heuristic value is kept
+    inline as prior_num / prior_den (prior_den == 0 if there is none)
+    """
 
-    times_visited: int
+    __slots__ = (
+        "id",
+        "parent_id",
+        "times_visited",
+        "score_sums",
+        "prior_num",
+        "prior_den",
+    )
 
-    # map from player to total score for this player across all visits to this
-    # node
-    score_vec: ScoreVec
+    def __init__(
+        self,
+        id: NodeId,
+        parent_id: NodeId,
+        nplayers: int,
+        heuristic_val: t.Optional[HeuristicVal] = None,
+    ):
+        # total score of each player (by MctsConfig.player_index) across all
+        # visits to this node
+        self.score_sums: Scores = [0.0] * nplayers
+        self.reset(id, parent_id, heuristic_val)
 
-    # player: P  # whose turn it is to move
+    def reset(
+        self,
+        id: NodeId,
+        parent_id: NodeId,
+        heuristic_val: t.Optional[HeuristicVal] = None,
+    ):
+        """ Make this a fresh node, for reuse by engine.tree.NodePool """
+        self.id = id
+        self.parent_id = parent_id
+        self.times_visited = 0
+        score_sums = self.score_sums
+        for i in range(len(score_sums)):
+            score_sums[i] = 0.0
+        if heuristic_val is None:
+            self.prior_num, self.prior_den = 0.0, 0
+        else:
+            self.prior_num, self.prior_den = heuristic_val
 
-    heuristic_val: t.Optional[HeuristicVal] = None
+    @property
+    def heuristic_val(self) -> t.Optional[HeuristicVal]:
+        if self.prior_den == 0:
+            return None
+        return HeuristicVal(self.prior_num, self.prior_den)
 
 
 @dataclass
@@ -47,6 +88,61 @@ class Tree(t.Generic[G, A]):
     ]  # TODO: action could go in node.parent instead of the tree?
 
 
+# phases of a walk that Engine times with MctsConfig.profile. consume is
+# Engine.consume_walk_log, which isn't part of a walk
+PHASES = ["selection", "expansion", "rollout", "backup", "restore", "consume"]
+
+
+@dataclass
+class PhaseStats:
+    seconds: float = 0.0
+    calls: int = 0
+
+
+@dataclass
+class EngineStats:
+    """
+    Snapshot returned by Engine.stats(). phases and max_depth (the deepest a
+    walk went since the root last changed) stay at 0 unless
+    MctsConfig.profile is on. Selection excludes the expansions done during
+    it
+    """
+
+    phases: t.Dict[str, PhaseStats]
+    n_walks_produced: int
+    n_walks_consumed: int
+    tree_size: int
+    max_depth: int
+    ponder_seconds: float
+
+    @property
+    def walks_per_sec(self) -> float:
+        if self.ponder_seconds == 0:
+            return 0.0
+        return self.n_walks_produced / self.ponder_seconds
+
+    def format(self) -> str:
+        """ Counters, then the phase table if the engine was profiled """
+        profiled = any(phase.calls > 0 for phase in self.phases.values())
+        lines = [
+            f"walks produced {self.n_walks_produced} consumed "
+            f"{self.n_walks_consumed} ({self.walks_per_sec:.0f} walks/s)",
+            f"tree size {self.tree_size}"
+            + (f" max depth {self.max_depth}" if profiled else ""),
+        ]
+        total = sum(phase.seconds for phase in self.phases.values())
+        for name, phase in self.phases.items():
+            if phase.calls == 0:
+                continue
+            share = phase.seconds / total if total > 0 else 0.0
+            lines.append(
+                f"{name:<10}{phase.seconds:>9.3f}s {share:>6.1%} "
+                f"{phase.calls:>9} calls "
+                f"{1e6 * phase.seconds / phase.calls:>9.1f}us/call"
+            )
+        return "\n".join(lines)
+
+
 @dataclass
 class RedisConfig:
     host: str
@@ -73,10 +169,82 @@ class MctsConfig(t.Generic[G, A]):
     heuristic: t.Optional[t.Callable[[G], float]] = None
     C = 1 / math.sqrt(2)
 
-    # TODO: change budget to terminationconfig, allows time bank or thing where
-    # final node has to be same as something
+    # "array" (struct of arrays, see engine.tree.ArrayTree) or "dict" (one
+    # Node per node, kept as a reference implementation)
+    tree_type: str = "array"
+
+    # If given, nodes that reach the same gamestate share statistics (the
+    # tree becomes a DAG). Two gamestates with the same hash are assumed to be
+    # the same gamestate
+    hash_gamestate: t.Optional[t.Callable[[G], int]] = None
+
+    # Parallel search. With more than one worker Engine.ponder splits the
+    # walks over a process pool. parallelism is either
+    #   "root": each worker searches its own tree from the root and only the
+    #       statistics of the root's children are merged
+    #   "tree": all workers search one tree in shared memory (see
+    #       engine.sharedtree), which holds at most shared_tree_capacity nodes.
+    #       virtual_loss is how many lost visits a walk that is still running
+    #       counts as for the nodes on its path
+    n_workers: int = 1
+    parallelism: str = "root"
+    virtual_loss: float = 1.0
+    shared_tree_capacity: int = 1 << 20
+
+    # Progressive widening. If widening_k is given, a node that has been
+    # visited N times only selects among its first
+    # max(1, ceil(widening_k * N ** widening_alpha)) children. Children are
+    # ordered by action_prior(gamestate, action) (highest first), or shuffled
+    # by node id if there is no prior
+    widening_k: t.Optional[float] = None
+    widening_alpha: float = 0.5
+    action_prior: t.Optional[t.Callable[[G, A], float]] = None
+
+    # Stop Engine.ponder before its budget (walks or seconds) runs out once the
+    # most visited child of the root can't be overtaken anymore. The most
+    # visited child is then also the action ponder returns (instead of the
+    # child with the best average score)
+    early_stop: bool = False
+
+    # Copies gamestates (e.g. common.main.Rules.clone_gamestate). Defaults to
+    # copy.deepcopy
+    clone_gamestate: t.Optional[t.Callable[[G], G]] = None
+
+    # Walk on one scratch gamestate that every walk reuses (undo_action puts
+    # it back to the root's gamestate after a walk) instead of on a fresh
+    # copy of the root's gamestate. Needs undo_action
+    scratch_state: bool = False
+
+    # Record a walk log for every walk (what Engine.ponder returns and
+    # engineservers share). Local search can turn them off, which saves
+    # building an event dict per action and node
+    record_walk_logs: bool = True
+
+    # Time the phases of every walk (see PHASES and Engine.stats). Costs a
+    # few perf_counter calls per walk, nothing when off
+    profile: bool = False
+
+    # Invariant checks the engine makes:
+    #   0: none
+    #   1: score vectors of walks (own and consumed ones) are valid
+    #   2: also that every walk restored the root's gamestate (a deep
+    #       comparison per walk)
+    debug_level: int = 1
+
+    # Integer action codec (e.g. common.main.Rules.action_to_int). If given,
+    # the tree, walk logs and take-action events hold action codes, and
+    # actions are only decoded to call the rules and to return from ponder
+    action_to_int: t.Optional[t.Callable[[A], int]] = None
+    int_to_action: t.Optional[t.Callable[[int], A]] = None
+
     decisive_moves_heuristic: bool = False
 
+    # players[i] -> i. The engine keeps scores in lists indexed this way
+    player_index: t.Dict[P, int] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.player_index = {p: i for i, p in enumerate(self.players)}
+
 
 ################################ Minimax Config ###############################
 @dataclass
@@ -98,3 +266,53 @@ class MinimaxConfig(t.Generic[G, A, P]):
     heuristic: t.Callable[[G], float]
     get_player: t.Callable[[G], P]
     other_player: t.Callable[[P], P]
+
+    # Optional args
+
+    # Returns the actions of a gamestate reordered best guess first.
+    # engine.minimax.alphabeta prunes the most when the best action comes
+    # first
+    order_actions: t.Optional[t.Callable[[G, t.List[A]], t.List[A]]] = None
+
+    # If given, alphabeta and iterative_deepening keep a transposition table
+    # (see engine.minimax.TranspositionTable) of tt_capacity entries. Two
+    # gamestates with the same hash are assumed to be the same gamestate
+    hash_gamestate: t.Optional[t.Callable[[G], int]] = None
+    tt_capacity: int = 1 << 16
+
+    # Move ordering learned during the search (actions must be hashable).
+    # killer_moves tries first the last two actions that caused a cutoff at
+    # the same ply. history_heuristic orders the remaining actions by how
+    # many (depth weighted) cutoffs they caused anywhere in the tree, see
+    # engine.minimax.HistoryTable
+    killer_moves: bool = False
+    history_heuristic: bool = False
+
+    # If given, the children of a node of depth 1 are evaluated together:
+    # batch_heuristic(gamestate, actions) returns heuristic of the gamestate
+    # each of <actions> leads to (in the same order), e.g. with one numpy call
+    # for all of them. Children that end the game are left out of <actions>
+    batch_heuristic: t.Optional[
+        t.Callable[[G, t.List[A]], t.Sequence[float]]
+    ] = None
+
+    # With more than one worker alphabeta and iterative_deepening split the
+    # actions of the root over the processes of the engine.minimax.MinimaxPool
+    # they are given (see engine.minimax._split_root)
+    n_workers: int = 1
+
+
+@dataclass
+class MinimaxStats:
+    """
+    Counters a search adds to when given one. nodes counts every gamestate
+    visited, leaves included. cutoffs counts the nodes where alpha-beta
+    stopped before trying every action. tt_hits counts the nodes found in the
+    transposition table. depth is the deepest iteration iterative_deepening
+    completed
+    """
+
+    nodes: int = 0
+    cutoffs: int = 0
+    tt_hits: int = 0
+    depth: int = 0
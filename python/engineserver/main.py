@@ -5,6 +5,7 @@
 
 from queue import Queue, Empty
 import json
+import os
 import random
 import threading
 import typing as t
@@ -19,12 +20,17 @@ import utils
 import redis
 
 
-ID_LENGTH = 32  # number of bits in a node id
+ID_LENGTH = 63  # number of bits in a node id (engine.mctsv1.ID_BITS)
 
 BUDGET = 2
 
 N_WALK_BATCH = 25
 
+# ENGINESERVER_PROFILE=1 times every phase of every walk (MctsConfig.profile)
+# and prints the phase table along with the walk counters on each new
+# gamestate. Off by default since the timing isn't free
+PROFILE = os.environ.get("ENGINESERVER_PROFILE", "0") == "1"
+
 
 G = t.TypeVar("G")  # gamestate
 A = t.TypeVar("A")  # action
@@ -54,7 +60,8 @@ def serve(redis_config: eng_types.RedisConfig, engineserver_id: int) -> A:
     )
     command_thread.start()
 
-    engine, gamestate, config = (
+    engine, gamestate, config, game_type = (
+        None,
         None,
         None,
         None,
@@ -78,21 +85,22 @@ def serve(redis_config: eng_types.RedisConfig, engineserver_id: int) -> A:
                 command.gamestate_id,
                 parse_config(command) or config,
             )
+            same_game_type = command.game_type == game_type
+            game_type = command.game_type
 
             if engine is not None:
                 # receiving new game
-                n_nodes = len(engine.tree.nodes)
-                n_walks_produced = engine.n_walks_produced
-                n_walks_consumed = engine.n_walks_consumed
-                n_walks = n_walks_consumed + n_walks_produced
-                print(
-                    f"{gamestate_id=}\t{n_walks=}\t{n_walks_produced=}\t{n_walks_consumed=}"
-                )
-            engine = Engine(config, gamestate)
+                print(f"{gamestate_id=}\n{engine.stats().format()}")
+            if engine is not None and same_game_type:
+                # keep the subtree if the new gamestate is a descendant of the
+                # old root, otherwise this starts a fresh tree
+                engine.advance_to(gamestate)
+            else:
+                engine = Engine(config, gamestate)
         elif isinstance(command, ctypes.NewConfig):
             utils.print_err("Command NewConfig is unimplemented")
         elif isinstance(command, ctypes.Stop):
-            engine, gamestate, config = None, None, None
+            engine, gamestate, config, game_type = None, None, None, None
         elif command is None:
             pass
         else:
@@ -100,13 +108,17 @@ def serve(redis_config: eng_types.RedisConfig, engineserver_id: int) -> A:
 
         if engine is not None:
             walk_logs, best_move = engine.ponder(n_walks=N_WALK_BATCH)
-            # print(f"{gamestate_id=} {len(engine.tree.nodes)=}")
+            # print(f"{gamestate_id=} {len(engine.tree)=}")
             broadcast_walk_logs(walk_logs, r, gamestate_id, engineserver_id)
             consume_new_walk_logs(rsr, gamestate_id, engine, engineserver_id)
+            # actions go over the wire as action codes
             utils.write_chan(
                 r,
                 "actions",
-                {"gamestate_id": gamestate_id, "best_move": best_move},
+                {
+                    "gamestate_id": gamestate_id,
+                    "best_move": config.action_to_int(best_move),
+                },
             )
 
 
@@ -121,9 +133,14 @@ def parse_config(command: ctypes.NewGamestate) -> eng_types.MctsConfig:
         is_over=rules.is_over,
         # rollout_policy=rollout_policy,
         get_final_score=rules.get_final_score,
-        players=["player"],
+        players=rules.get_players(),
         encode_action=rules.encode_action,
         decode_action=rules.decode_action,
+        action_to_int=rules.action_to_int,
+        int_to_action=rules.int_to_action,
+        clone_gamestate=rules.clone_gamestate,
+        action_prior=rules.action_prior,
+        profile=PROFILE,
     )
 
 
@@ -194,12 +211,15 @@ def consume_new_walk_logs(
         if log["engineserver_id"] != engineserver_id
     ]
 
-    old_times_visited = engine.root_node.times_visited
+    tree = engine.tree
+    old_times_visited = tree.visits(tree.root)
+    old_n_dropped = engine.n_walks_dropped
     engine.consume_walk_log(consumable_logs)
-    visited_increase = engine.root_node.times_visited - old_times_visited
+    visited_increase = tree.visits(tree.root) - old_times_visited
+    # walks through a node whose id collided with one of ours are dropped
     num_walk_results = sum(
         1 for log in consumable_logs if log["event-type"] == "walk-result"
-    )
+    ) - (engine.n_walks_dropped - old_n_dropped)
     assert visited_increase == num_walk_results
 
 
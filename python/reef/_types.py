@@ -223,6 +223,9 @@ class GameState:
     center: Center
     deck: t.List[Card]
     color_piles: t.Dict[Color, int]
+    # zobrist hash of everything but history, kept up to date by
+    # rules.take_action_mut
+    zobrist: int = 0
 
 
 @dataclass
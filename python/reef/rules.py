@@ -1,3 +1,5 @@
+import functools
+import hashlib
 import itertools
 import random
 import copy
@@ -56,6 +58,7 @@ def init_game(nplayers: int) -> types.GameState:
             ]
         },
     )
+    gamestate.zobrist = compute_hash(gamestate)
 
     return gamestate
 
@@ -66,6 +69,8 @@ MAX_STACK_HEIGHT = 4
 
 BOARD_SIZE = 4
 
+CENTER_SIZE = 4  # cards in the center, it's refilled from the deck
+
 
 def get_all_actions(
     gamestate: types.GameState,
@@ -281,6 +286,88 @@ def _is_gamestate_valid(state: types.GameState) -> bool:
     )
 
 
+################################### Zobrist ###################################
+# Reef gamestates have too many parts (hands, center, deck, coins, scores) for
+# precomputed key tables, so keys are derived from a digest of what they
+# describe (stable across processes) and cached.
+
+
+@functools.lru_cache(maxsize=None)
+def _zobrist_key(*parts: t.Hashable) -> int:
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+_CARD_IDS = {repr(card): i for (i, card) in enumerate(types.ALL_CARDS)}
+
+
+def _card_id(card: types.Card) -> t.Union[int, str]:
+    card_repr = repr(card)
+    return _CARD_IDS.get(card_repr, card_repr)
+
+
+def _hash_stack(
+    player_idx: int, x: int, y: int, stack: types.BoardStack
+) -> int:
+    color = None if stack.color is None else stack.color.value
+    return _zobrist_key("board", player_idx, x, y, stack.height, color)
+
+
+def _hash_hand(state: types.GameState, player_idx: int) -> int:
+    h = 0
+    for slot, card in enumerate(state.players[player_idx].hand):
+        h ^= _zobrist_key("hand", player_idx, slot, _card_id(card))
+    return h
+
+
+def _hash_center(state: types.GameState) -> int:
+    h = 0
+    for slot, (card, coins) in enumerate(state.center):
+        h ^= _zobrist_key("center", slot, _card_id(card), coins)
+    return h
+
+
+def _hash_deck_top(state: types.GameState) -> int:
+    """ key of the card at the top of the deck (the one deck.pop() returns) """
+    position = len(state.deck) - 1
+    return _zobrist_key("deck", position, _card_id(state.deck[position]))
+
+
+def _hash_score(player_idx: int, score: int) -> int:
+    return _zobrist_key("score", player_idx, score)
+
+
+def _hash_color_pile(color: types.Color, count: int) -> int:
+    return _zobrist_key("pile", color.value, count)
+
+
+def _hash_to_move(player_idx: int) -> int:
+    return _zobrist_key("player", player_idx)
+
+
+def compute_hash(state: types.GameState) -> int:
+    """
+    Zobrist hash of gamestate computed from scratch. take_action_mut keeps
+    gamestate.zobrist equal to this incrementally
+    """
+    h = _hash_to_move(state.player) ^ _hash_center(state)
+    for position, card in enumerate(state.deck):
+        h ^= _zobrist_key("deck", position, _card_id(card))
+    for color, count in state.color_piles.items():
+        h ^= _hash_color_pile(color, count)
+    for player_idx, player in enumerate(state.players):
+        h ^= _hash_hand(state, player_idx)
+        h ^= _hash_score(player_idx, player.score)
+        for x, row in enumerate(player.board):
+            for y, stack in enumerate(row):
+                h ^= _hash_stack(player_idx, x, y, stack)
+    return h
+
+
+def hash_gamestate(gamestate: types.GameState) -> int:
+    return gamestate.zobrist
+
+
 # TODO: consider making an lru cache out of this so that when you call
 # get_all_actions, which calls this to see if valid, when you later call
 # take_action the result is already cached
@@ -301,50 +388,75 @@ def take_action_mut(
     state: types.GameState,
     action: types.Action,
 ) -> t.Optional[types.GameState]:
-    player = state.players[state.player]
+    player_idx = state.player
+    player = state.players[player_idx]
+    # parts of the gamestate an action touches are hashed out before the
+    # action and back in after it
     if isinstance(action, types.DrawCenterCardAction):
         if action.center_index >= len(state.center):
             return None
+        state.zobrist ^= (
+            _hash_center(state)
+            ^ _hash_hand(state, player_idx)
+            ^ _hash_score(player_idx, player.score)
+        )
         (drawn_card, score) = state.center.pop(action.center_index)
         player.hand.append(drawn_card)
         player.score += score
 
         if len(state.deck) > 0:
+            state.zobrist ^= _hash_deck_top(state)
             state.center.append((state.deck.pop(), 0))
+        state.zobrist ^= (
+            _hash_center(state)
+            ^ _hash_hand(state, player_idx)
+            ^ _hash_score(player_idx, player.score)
+        )
 
     elif isinstance(action, types.PlayCardAction):
         if action.hand_index >= len(player.hand):
             return None
+        state.zobrist ^= _hash_hand(state, player_idx)
         card = player.hand.pop(action.hand_index)
+        state.zobrist ^= _hash_hand(state, player_idx)
         x1, y1 = action.placement1
         x2, y2 = action.placement2
-        player.board[x1][y1] = types.BoardStack(
-            player.board[x1][y1].height + 1,
-            card.color1,
-        )
-        player.board[x2][y2] = types.BoardStack(
-            player.board[x2][y2].height + 1,
-            card.color2,
-        )
-        state.color_piles[card.color1] -= 1
-        state.color_piles[card.color2] -= 1
-
+        for (x, y), color in [
+            ((x1, y1), card.color1),
+            ((x2, y2), card.color2),
+        ]:
+            board = player.board
+            state.zobrist ^= _hash_stack(player_idx, x, y, board[x][y])
+            board[x][y] = types.BoardStack(board[x][y].height + 1, color)
+            state.zobrist ^= _hash_stack(player_idx, x, y, board[x][y])
+        for color in [card.color1, card.color2]:
+            state.zobrist ^= _hash_color_pile(color, state.color_piles[color])
+            state.color_piles[color] -= 1
+            state.zobrist ^= _hash_color_pile(color, state.color_piles[color])
+
+        state.zobrist ^= _hash_score(player_idx, player.score)
         player.score += score_play_action(state, action, card)
+        state.zobrist ^= _hash_score(player_idx, player.score)
     elif isinstance(action, types.DrawDeckAction):
         if len(state.deck) == 0:
             return None
+        state.zobrist ^= _hash_deck_top(state)
         card = state.deck.pop()
 
         if len(player.hand) >= MAX_HAND_SIZE:
             return None
+        state.zobrist ^= _hash_hand(state, player_idx)
         player.hand.append(card)
+        state.zobrist ^= _hash_hand(state, player_idx)
 
         # put a coin on an arbitrary center card that has the lowest number of
         # coins on it . TODO: fix it so the player has a choice of what card to
         # put it on
         if player.score == 0:
             return None
+        state.zobrist ^= _hash_score(player_idx, player.score)
         player.score -= 1
+        state.zobrist ^= _hash_score(player_idx, player.score)
 
         if state.center:
             # if there are cards in the center, add 1 coin to the card with the
@@ -358,11 +470,15 @@ def take_action_mut(
                 ),
                 key=lambda x: x[2],
             )
+            state.zobrist ^= _hash_center(state)
             state.center[idx] = (card, score + 1)
+            state.zobrist ^= _hash_center(state)
     else:
         utils.assert_never(f"unknown action type {type(action)}")
 
+    state.zobrist ^= _hash_to_move(state.player)
     state.player = (state.player + 1) % len(state.players)
+    state.zobrist ^= _hash_to_move(state.player)
 
     if not _is_gamestate_valid(state):
         return None
@@ -374,3 +490,46 @@ def is_over(gamestate: types.GameState) -> bool:
         any(pile == 0 for pile in gamestate.color_piles.values())
         and gamestate.player == 0
     )
+
+
+# action_to_int codes: DrawCenterCardAction(i) is i, DrawDeckAction is
+# CENTER_SIZE and PlayCardAction codes start after that
+_DRAW_DECK_CODE = CENTER_SIZE
+_PLAY_CARD_CODE = CENTER_SIZE + 1
+_N_SQUARES = BOARD_SIZE * BOARD_SIZE
+
+
+def _square(placement: t.Tuple[int, int]) -> int:
+    x, y = placement
+    return x * BOARD_SIZE + y
+
+
+def action_to_int(action: types.Action) -> int:
+    if isinstance(action, types.DrawCenterCardAction):
+        assert 0 <= action.center_index < CENTER_SIZE, action
+        return action.center_index
+    elif isinstance(action, types.DrawDeckAction):
+        return _DRAW_DECK_CODE
+    elif isinstance(action, types.PlayCardAction):
+        return (
+            _PLAY_CARD_CODE
+            + action.hand_index * _N_SQUARES * _N_SQUARES
+            + _square(action.placement1) * _N_SQUARES
+            + _square(action.placement2)
+        )
+    else:
+        assert_never(f"Unexpected action type {action}")
+
+
+def int_to_action(code: int) -> types.Action:
+    if code < _DRAW_DECK_CODE:
+        return types.DrawCenterCardAction(code)
+    elif code == _DRAW_DECK_CODE:
+        return types.DrawDeckAction()
+    hand_index, squares = divmod(code - _PLAY_CARD_CODE, _N_SQUARES ** 2)
+    square1, square2 = divmod(squares, _N_SQUARES)
+    return types.PlayCardAction(
+        hand_index=hand_index,
+        placement1=divmod(square1, BOARD_SIZE),
+        placement2=divmod(square2, BOARD_SIZE),
+    )
@@ -7,10 +7,16 @@ from reef import fmt
 from reef import _types as types
 from reef.score import maximal_covering
 from reef.rules import (
+    init_game,
+    is_over,
     is_valid_action,
     take_action,
+    take_action_mut,
     get_random_action,
     get_all_actions,
+    compute_hash,
+    action_to_int,
+    int_to_action,
 )
 from reef.main import play_random_computer_vs_random_computer
 
@@ -152,3 +158,30 @@ def test_get_random_action_returns_valid_action(gamestate: types.GameState):
     assert (
         random_action is None or random_action in all_actions
     ), "get_random_action returned an action not contained in get_all_actions"
+
+
+@given(st.integers(min_value=0, max_value=2 ** 32))
+def test_zobrist_hash_is_maintained_incrementally(seed):
+    random.seed(seed)
+    gamestate = init_game(2)
+    assert gamestate.zobrist == compute_hash(gamestate)
+    while not is_over(gamestate):
+        action = get_random_action(gamestate)
+        if action is None:
+            break
+        take_action_mut(gamestate, action)
+        assert gamestate.zobrist == compute_hash(gamestate)
+
+
+@given(st.integers(min_value=0, max_value=2 ** 32))
+def test_action_codec_round_trips(seed):
+    random.seed(seed)
+    gamestate = init_game(2)
+    while not is_over(gamestate):
+        actions = get_all_actions(gamestate)
+        if not actions:
+            break
+        codes = [action_to_int(action) for action in actions]
+        assert len(set(codes)) == len(codes)
+        assert [int_to_action(code) for code in codes] == actions
+        take_action_mut(gamestate, random.choice(actions))
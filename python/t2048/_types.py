@@ -10,6 +10,9 @@ Player = t.Union[t.Literal["player"], t.Literal["environment"]]
 class GameState:
     player: Player
     board: Board
+    # zobrist hash of board and player, kept up to date by
+    # rules.take_action_mut
+    zobrist: int = 0
 
 
 @dataclass
@@ -52,5 +52,6 @@ if __name__ == "__main__":
             )
 
         agent = get_agent(player_type, '2048', player_type)
+        stack.callback(agent.close)
 
         play_game([agent], '2048', output)
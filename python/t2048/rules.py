@@ -6,6 +6,26 @@ import typing as t
 import utils
 
 
+# Zobrist keys, indexed by [r][c][log2(tile)]. Seeded so that every process
+# (e.g. every engineserver) agrees on the hash of a gamestate
+MAX_TILE_EXPONENT = 17  # 2 ** 17 is the largest possible tile on a 4x4 board
+_zobrist_rng = random.Random(2048)
+ZOBRIST_TILES = [
+    [
+        [_zobrist_rng.getrandbits(64) for _ in range(MAX_TILE_EXPONENT + 1)]
+        for _ in range(4)
+    ]
+    for _ in range(4)
+]
+ZOBRIST_ENVIRONMENT_TO_MOVE = _zobrist_rng.getrandbits(64)
+
+
+def _tile_key(r: int, c: int, val: t.Optional[int]) -> int:
+    if val is None:
+        return 0
+    return ZOBRIST_TILES[r][c][val.bit_length() - 1]
+
+
 def init_game() -> types.GameState:
 
     board = [
@@ -19,7 +39,9 @@ def init_game() -> types.GameState:
     init_placements = random.sample(choices, k=2)
     for (r, c) in init_placements:
         board[r][c] = random.choice([2, 4])
-    return types.GameState(player="player", board=board)
+    gamestate = types.GameState(player="player", board=board)
+    gamestate.zobrist = compute_hash(gamestate)
+    return gamestate
 
 
 def get_indexes(row=None, col=None, rev=False):
@@ -47,6 +69,11 @@ def take_environment_action(gamestate, action: types.EnvironmentAction):
     assert gamestate.player == "environment"
     r, c = action.placement
     val = action.val
+    gamestate.zobrist ^= (
+        _tile_key(r, c, gamestate.board[r][c])
+        ^ _tile_key(r, c, val)
+        ^ ZOBRIST_ENVIRONMENT_TO_MOVE
+    )
     gamestate.board[r][c] = val
     gamestate.player = "player"
     return gamestate
@@ -57,6 +84,7 @@ def take_player_action(
 ):
     assert gamestate.player == "player"
     board = gamestate.board
+    old_board = [row[:] for row in board]
     if isinstance(player_action, dict):
         print(player_action)
     action = player_action.action
@@ -121,6 +149,15 @@ def take_player_action(
 
         if counter == 1000:
             raise Exception("oh no")
+
+    # tiles move all over the place during a slide, so rehash only the cells
+    # that changed once it's done
+    for r in range(4):
+        for c in range(4):
+            if old_board[r][c] != board[r][c]:
+                gamestate.zobrist ^= _tile_key(r, c, old_board[r][c])
+                gamestate.zobrist ^= _tile_key(r, c, board[r][c])
+    gamestate.zobrist ^= ZOBRIST_ENVIRONMENT_TO_MOVE
     gamestate.player = "environment"
     return gamestate
 
@@ -212,7 +249,7 @@ def get_all_environment_actions(
     return [
         types.EnvironmentAction(placement=placement, val=val)
         for placement in placements
-        for val in [1, 2]
+        for val in [2, 4]
     ]
 
 
@@ -265,10 +302,66 @@ def decode_action(encoded: str) -> types.Action:
         utils.assert_never(f"Unexpected action type {data['type']}")
 
 
+DIRECTIONS = ["up", "down", "left", "right"]
+_DIRECTION_CODES = {d: i for i, d in enumerate(DIRECTIONS)}
+
+
+def action_to_int(action: types.Action) -> int:
+    """
+    0-3 for player actions (index in DIRECTIONS), then
+    4 + 2 * (4 * row + col) + (val == 4) for environment actions
+    """
+    if isinstance(action, types.PlayerAction):
+        return _DIRECTION_CODES[action.action]
+    elif isinstance(action, types.EnvironmentAction):
+        r, c = action.placement
+        return len(DIRECTIONS) + 2 * (4 * r + c) + (action.val == 4)
+    else:
+        utils.assert_never(f"Unexpected action type {action}")
+
+
+def int_to_action(code: int) -> types.Action:
+    if code < len(DIRECTIONS):
+        return types.PlayerAction(action=DIRECTIONS[code])
+    square, is_four = divmod(code - len(DIRECTIONS), 2)
+    return types.EnvironmentAction(
+        placement=divmod(square, 4), val=4 if is_four else 2
+    )
+
+
 def get_players():
     return ["player"]
 
 
+def clone_gamestate(gamestate: types.GameState) -> types.GameState:
+    """ Same as copy.deepcopy, but only copies what can be mutated """
+    return types.GameState(
+        player=gamestate.player,
+        board=[row.copy() for row in gamestate.board],
+        zobrist=gamestate.zobrist,
+    )
+
+
+def hash_gamestate(gamestate: types.GameState) -> int:
+    return gamestate.zobrist
+
+
+def compute_hash(gamestate: types.GameState) -> int:
+    """
+    Zobrist hash of gamestate computed from scratch. take_action_mut keeps
+    gamestate.zobrist equal to this incrementally
+    """
+    h = (
+        ZOBRIST_ENVIRONMENT_TO_MOVE
+        if gamestate.player == "environment"
+        else 0
+    )
+    for r, row in enumerate(gamestate.board):
+        for c, val in enumerate(row):
+            h ^= _tile_key(r, c, val)
+    return h
+
+
 def encode_gamestate(gamestate: types.GameState) -> bytes:
     return json.dumps(gamestate.__dict__).encode()
 
@@ -0,0 +1,50 @@
+import random
+
+from hypothesis import given, strategies as st
+
+import t2048._types as types
+from t2048.rules import (
+    init_game,
+    take_action_mut,
+    is_over,
+    get_random_action,
+    get_all_actions,
+    compute_hash,
+    action_to_int,
+    int_to_action,
+    clone_gamestate,
+)
+
+
+@given(st.integers(min_value=0, max_value=2 ** 32))
+def test_zobrist_hash_is_maintained_incrementally(seed):
+    random.seed(seed)
+    gamestate = init_game()
+    assert gamestate.zobrist == compute_hash(gamestate)
+    for _ in range(200):
+        if is_over(gamestate) is not None:
+            break
+        take_action_mut(gamestate, get_random_action(gamestate))
+        assert gamestate.zobrist == compute_hash(gamestate)
+
+
+def test_action_codec_round_trips():
+    gamestate = init_game()
+    actions = [
+        types.PlayerAction(action=a) for a in ["up", "down", "left", "right"]
+    ] + get_all_actions(types.GameState("environment", [[None] * 4] * 4))
+    codes = [action_to_int(action) for action in actions]
+    assert codes == list(range(len(actions)))
+    assert [int_to_action(code) for code in codes] == actions
+    for action in get_all_actions(gamestate):
+        assert int_to_action(action_to_int(action)) == action
+
+
+@given(st.integers(min_value=0, max_value=2 ** 32))
+def test_clone_gamestate_is_a_deep_copy(seed):
+    random.seed(seed)
+    gamestate = init_game()
+    clone = clone_gamestate(gamestate)
+    assert clone == gamestate
+    take_action_mut(clone, get_random_action(clone))
+    assert clone != gamestate